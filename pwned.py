@@ -36,23 +36,43 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
+import atexit
+import collections
 import os
 import sys
 import datetime
 import hashlib
 import getopt
-import time
+import itertools
+import tempfile
 import threading
-import zipfile
-import requests
 
 import pwned_stats as pstat
+import pwned_bindb as pbindb
+import pwned_index as pidx
+import pwned_join as pjoin
+import pwned_parallel as pparallel
+import pwned_web as pweb
+import pwned_cache as pcache
+import pwned_ratelimit as pratelimit
+import pwned_output as poutput
+import pwned_serve as pserve
+import pwned_filter as pfilter
+import pwned_hashing as phash
+import pwned_records as precords
+import pwned_metrics as pmetrics
+import pwned_update as pupdate
+import pwned_hot as phot
+import pwned_ranges as pranges
+import pwned_rangeserve as prangeserve
+import pwned_sort as psort
+import pwned_blockdb as pblockdb
 
 my_stats = pstat.PwnedStats()
-my_stats.start_timer()
 
 HASH_PREFIX_LENGTH  = 5
 BASE_PWD_SEARCH_URL = 'https://api.pwnedpasswords.com/range/'
+API_URL_ENV_VAR     = 'PWNED_API_URL' #default of --api_url: a mirror of the range api (see --serve_range)
 
 #type of expected inputs for the scrypt
 IM_UNKNOWN_MODE     = 0
@@ -70,10 +90,26 @@ DB_WEB              = 1
 DB_LOCAL            = 2
 DB_LOCAL_SORTED     = 3
 DB_LOCAL_ZIP        = 4
+DB_LOCAL_PACKED     = 5 #packed binary file (see pwned_bindb.py) built with --build_packed_db
+DB_LOCAL_RANGES     = 6 #directory (or zip) of one range file per prefix, see pwned_ranges.py
+DB_LOCAL_BLOCKS     = 7 #block compressed binary file (see pwned_blockdb.py) built with --build_block_db
+
+#tools: they do not check any password, they prepare local db files
+TM_NONE             = 0
+TM_BUILD_PACKED_DB  = 1
+TM_BUILD_INDEX      = 2
+TM_SERVE            = 3 #lookup daemon, see pwned_serve.py
+TM_BUILD_FILTER     = 4
+TM_UPDATE_DB        = 5 #merge a new release into the sorted db, see pwned_update.py
+TM_BUILD_HOT_TIER   = 6
+TM_SERVE_RANGE      = 7 #range api mirror of the local db, see pwned_rangeserve.py
+TM_SORT_DB          = 8 #external merge sort of a HASH:count db, see pwned_sort.py
+TM_BUILD_BLOCK_DB   = 9
 
 INPUT_MODES: list[int]     = [IM_SINGLE_PASSOWRD, IM_PASSWORD_FILE, IM_TEXT_FILE]
 OPERATION_MODES: list[int] = [OM_PLAIN, OM_HASH]
-DATABASE_MODES: list[int]  = [DB_WEB, DB_LOCAL, DB_LOCAL_SORTED, DB_LOCAL_ZIP]
+DATABASE_MODES: list[int]  = [DB_WEB, DB_LOCAL, DB_LOCAL_SORTED, DB_LOCAL_ZIP, DB_LOCAL_PACKED, DB_LOCAL_RANGES, DB_LOCAL_BLOCKS]
+TOOL_MODES: list[int]      = [TM_NONE, TM_BUILD_PACKED_DB, TM_BUILD_INDEX, TM_SERVE, TM_BUILD_FILTER, TM_UPDATE_DB, TM_BUILD_HOT_TIER, TM_SERVE_RANGE, TM_SORT_DB, TM_BUILD_BLOCK_DB]
 
 ERR_NO_ERROR         = 0
 ERR_WRONG_PARAMETERS = 1
@@ -90,6 +126,11 @@ SPLIT_CHARS      = [":", "/", "=", "\t"]
 #words longer than 5 will be excluded
 MIN_WORD_LENGTH=5
 
+#-f/-t inputs are read, hashed and checked in chunks of this many passwords (memory stays flat whatever the input size)
+LOOKUP_CHUNK_SIZE = 10000    #engines that look up each hash (web, packed db): results are shown chunk by chunk
+SCAN_CHUNK_SIZE   = 1000000  #engines that read the whole db for each chunk (-l, -z, --workers): one db pass per chunk
+#with -b, inputs bigger than SCAN_CHUNK_SIZE are spilled to disk in sorted runs of this size (still one db pass)
+
 #A line_tocheck with ANY of the words in "excluding_list" will return TRUE (so to be excluded)
 def lineToBeExcluded(line_tocheck, excluding_list):
     result=False
@@ -140,43 +181,113 @@ def printColor(text: str, color:str="white") -> None:
     return
 
 
-def getPasswordList(filename):
+def getPasswordList(filename, l_hash_workers=1):
+    return list(iterPasswordList(filename, l_hash_workers))
+
+
+def iterPasswordList(filename, l_hash_workers=1):
+    """ same as getPasswordList but the records are generated one at a time while reading the file """
+    for the_store in iterPasswordListBatches(filename, l_hash_workers):
+        yield from the_store
+
+
+def iterPasswordListBatches(filename, l_hash_workers=1, l_keep_passwords=True):
+    """ the records of getPasswordList in RecordStore batches (see pwned_records.py) """
     # def __init__(self, src_password, src_hash, found_filename, found_linenumber, ispwned=False):
     # with context manager assures us the
     # file will be closed when leaving the scope
-    with open(filename, 'r', errors='ignore', encoding='utf-8') as file:
-        lines = file.readlines()
-
-    cleaned_word_list = []
-    file_line:int=0
-    for the_line in lines:
-        file_line=file_line+1
-        remove_unwanted: str=the_line.strip()
-
-        if not lineToBeExcluded(remove_unwanted, LINES_TO_EXCLUDE):
-            for chartoremove in SPLIT_CHARS:
-                remove_unwanted = remove_unwanted.replace(chartoremove, " ")
-        
-            newline=remove_unwanted.split(" ")
-            #assert " " not in newline
-            for word in newline:
-                if not wordToBeExcluded(word, MIN_WORD_LENGTH):
-                    the_hash = hashlib.sha1()
-                    the_hash.update(str(word).strip().encode('utf-8'))
-                    new_rec= password_record(word, the_hash.hexdigest().upper(), filename, file_line, False)
-                    cleaned_word_list.append(new_rec)
-        
-    return cleaned_word_list
+    def iterWords():
+        with open(filename, 'r', errors='ignore', encoding='utf-8') as file:
+            file_line:int=0
+            for the_line in file:
+                file_line=file_line+1
+                remove_unwanted: str=the_line.strip()
+
+                if not lineToBeExcluded(remove_unwanted, LINES_TO_EXCLUDE):
+                    for chartoremove in SPLIT_CHARS:
+                        remove_unwanted = remove_unwanted.replace(chartoremove, " ")
+            
+                    newline=remove_unwanted.split(" ")
+                    #assert " " not in newline
+                    for word in newline:
+                        if not wordToBeExcluded(word, MIN_WORD_LENGTH):
+                            yield word, file_line
+        countInputBytes(filename)
+
+    #the words are hashed in batches (by l_hash_workers processes), see pwned_hashing.py
+    return iterHashedStores(iterWords(), filename, l_hash_workers, l_keep_passwords, lambda word_and_line: str(word_and_line[0]).strip())
+
+
+def wordOfLine(l_word_and_line):
+    """ the word of a (word, line number) of iterHashedStores """
+    return l_word_and_line[0]
+
+
+def iterHashedStores(l_words_and_lines, l_filename, l_hash_workers=1, l_keep_passwords=True, l_word_of=None):
+    """ RecordStore of each batch of (word, line number) of l_words_and_lines, with the raw digests:
+        the hex strings are built only when something asks for src_hash. l_word_of is the string to hash (the word by default).
+    """
+    if l_word_of is None:
+        l_word_of = wordOfLine
+    batches = pmetrics.iterTimed(iterChunks(l_words_and_lines, phash.HASH_BATCH_SIZE), pmetrics.STAGE_READ)
+    for the_batch, the_digests in phash.iterHashedBatches(batches, l_hash_workers, l_word_of):
+        the_store = precords.RecordStore(l_filename, l_keep_passwords)
+        the_store.extend_digests([word for word, _ in the_batch] if l_keep_passwords else None,
+                                 [file_line for _, file_line in the_batch], the_digests)
+        yield the_store
+
+
+def countInputBytes(l_filename):
+    """ called when l_filename has been read to the end """
+    pmetrics.getRegistry().counter("pwned_input_bytes_read_total", "Bytes of the -f/-t input files read").inc(os.path.getsize(l_filename))
+
+
+def iterChunks(l_iterable, l_chunk_size):
+    """ lists of (at most) l_chunk_size consecutive items of l_iterable """
+    chunk = []
+    for item in l_iterable:
+        chunk.append(item)
+        if len(chunk) >= l_chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iterRecordChunks(l_records, l_chunk_size):
+    """ chunks of (at most) l_chunk_size records for the batch engines. l_records yields records (password_record,
+        chunked in lists) or RecordStore batches (regrouped in RecordStore chunks, see pwned_records.py)
+    """
+    l_records = iter(l_records)
+    first_item = next(l_records, None)
+    if first_item is None:
+        return
+    if isinstance(first_item, precords.RecordStore):
+        yield from precords.iterStoreChunks(itertools.chain([first_item], l_records), l_chunk_size)
+    else:
+        yield from iterChunks(itertools.chain([first_item], l_records), l_chunk_size)
 
 
 class password_record:
-    def __init__(self, src_password, src_hash, found_filename, found_linenumber, ispwned=False):
+    def __init__(self, src_password, src_hash, found_filename, found_linenumber, ispwned=False, src_digest=None):
         self.src_password = src_password    # instance variable unique to each instance
-        self.src_hash = src_hash
+        self._src_hash = src_hash
+        self.src_digest = src_digest        # raw 20 bytes SHA1 (hashed plain passwords), None for -s input
         self.found_filename = found_filename
         self.found_linenumber = found_linenumber
         self.ispwned = ispwned
 
+    @property
+    def src_hash(self):
+        """ 40 chars uppercase hex SHA1, built from src_digest the first time it is needed """
+        if self._src_hash is None and self.src_digest is not None:
+            self._src_hash = phash.hexDigest(self.src_digest)
+        return self._src_hash
+
+    @src_hash.setter
+    def src_hash(self, value):
+        self._src_hash = value
+
 
 def printStats() -> None:
 
@@ -187,16 +298,88 @@ def printStats() -> None:
     print("\n")
     print("---------------------------------------------------------------")
     print(f"Total number of passwords/hash read.......: {loc_stats.number_of_password_read:,}")
+    if loc_stats.unique_passwords_checked > 0:
+        print(f"Distinct passwords/hash looked up.........: {loc_stats.unique_passwords_checked:,}")
     print(f"Total number of passwords/hash pwned......: {loc_stats.pwned_passwords_found:,}")
     print(f"Total number of passwords/hash safe.......: {loc_stats.safe_passwords_found:,}")
     print(f"Total number of passwords/hash invalid....: {loc_stats.safe_passwords_invalid:,}")
     print(f"Total number of lines scanned in local db : {loc_stats.scanned_lines_in_db:,}")
+    if (loc_stats.range_cache_hits + loc_stats.range_cache_misses) > 0:
+        print(f"Web ranges from cache (hits/misses).......: {loc_stats.range_cache_hits:,} / {loc_stats.range_cache_misses:,}")
+    if (loc_stats.filter_negatives + loc_stats.filter_positives) > 0:
+        print(f"Bloom filter (safe w/o db / to db)........: {loc_stats.filter_negatives:,} / {loc_stats.filter_positives:,}")
+    if (loc_stats.hot_tier_hits + loc_stats.hot_tier_misses) > 0:
+        print(f"Hot tier (pwned from memory / to db)......: {loc_stats.hot_tier_hits:,} / {loc_stats.hot_tier_misses:,} ({hotTierHitRatio(loc_stats):.1%} hit ratio)")
+        print(f"Cold tier (pwned / looked up in the db)...: {loc_stats.pwned_passwords_found - loc_stats.hot_tier_hits:,} / {coldTierLookups(loc_stats):,} ({coldTierHitRatio(loc_stats):.1%} hit ratio)")
+    if loc_stats.web_requests_retried > 0:
+        print(f"Web requests retried (throttled/failed)...: {loc_stats.web_requests_retried:,}")
     print(f"Total elapsed time (sec)..................: {loc_stats.elapsed_time:.4f} ({datetime.timedelta(seconds=loc_stats.elapsed_time)})")    
     print("---------------------------------------------------------------")
     print("PWNED - ver. " + loc_stats.PROGRAM_VERSION + " from A.R.")
+    if _metrics_out != "":
+        writeMetrics(_metrics_out, _metrics_format)
     return 
 
 
+def hotTierHitRatio(loc_stats):
+    hot_lookups = loc_stats.hot_tier_hits + loc_stats.hot_tier_misses
+    return (loc_stats.hot_tier_hits / hot_lookups) if hot_lookups > 0 else 0.0
+
+
+def coldTierLookups(loc_stats):
+    """ checks that reached the db: not answered by the hot tier or by the bloom filter """
+    return loc_stats.number_of_password_read - loc_stats.hot_tier_hits - loc_stats.filter_negatives
+
+
+def coldTierHitRatio(loc_stats):
+    cold_lookups = coldTierLookups(loc_stats)
+    return ((loc_stats.pwned_passwords_found - loc_stats.hot_tier_hits) / cold_lookups) if cold_lookups > 0 else 0.0
+
+
+_metrics_out    = ""   #--metrics_out: written by printStats at the end of the run
+_metrics_format = ""
+
+def setMetricsOutput(l_metrics_out, l_metrics_format=""):
+    global _metrics_out, _metrics_format
+    _metrics_out    = l_metrics_out
+    _metrics_format = l_metrics_format
+
+
+def writeMetrics(l_metrics_out, l_metrics_format=""):
+    """ the stats of the run with the stage timers and histograms (see pwned_metrics.py) as JSON or Prometheus text """
+    loc_stats = pstat.PwnedStats()
+    registry = pmetrics.getRegistry()
+    for name, help_text, value in [("pwned_passwords_read_total", "Passwords/hashes read", loc_stats.number_of_password_read),
+                                   ("pwned_passwords_looked_up_total", "Distinct passwords/hashes looked up by the batch engines", loc_stats.unique_passwords_checked),
+                                   ("pwned_passwords_pwned_total", "Passwords/hashes found in the db", loc_stats.pwned_passwords_found),
+                                   ("pwned_passwords_safe_total", "Passwords/hashes not found in the db", loc_stats.safe_passwords_found),
+                                   ("pwned_passwords_invalid_total", "Passwords/hashes that could not be checked", loc_stats.safe_passwords_invalid),
+                                   ("pwned_db_lines_scanned_total", "Lines (or packed digests) read from the local db", loc_stats.scanned_lines_in_db),
+                                   ("pwned_range_cache_hits_total", "Web ranges read from the --cache file", loc_stats.range_cache_hits),
+                                   ("pwned_range_cache_misses_total", "Web ranges downloaded with --cache", loc_stats.range_cache_misses),
+                                   ("pwned_http_retries_total", "Web requests retried (throttled or failed)", loc_stats.web_requests_retried),
+                                   ("pwned_filter_negatives_total", "Checks answered by the bloom filter alone", loc_stats.filter_negatives),
+                                   ("pwned_filter_positives_total", "Checks the bloom filter passed on to the db", loc_stats.filter_positives),
+                                   ("pwned_hot_tier_hits_total", "Checks answered by the in memory hot tier", loc_stats.hot_tier_hits),
+                                   ("pwned_hot_tier_misses_total", "Checks the hot tier passed on to the db", loc_stats.hot_tier_misses)]:
+        registry.counter(name, help_text).set(value)
+    cache_lookups = loc_stats.range_cache_hits + loc_stats.range_cache_misses
+    registry.gauge("pwned_range_cache_hit_ratio", "Web ranges found in the --cache file / ranges asked").set(
+        (loc_stats.range_cache_hits / cache_lookups) if cache_lookups > 0 else 0.0)
+    if (loc_stats.hot_tier_hits + loc_stats.hot_tier_misses) > 0:
+        registry.gauge("pwned_hot_tier_hit_ratio", "Checks found pwned in the hot tier / checks asked to the hot tier").set(hotTierHitRatio(loc_stats))
+        registry.gauge("pwned_cold_tier_hit_ratio", "Checks found pwned in the db / checks that reached the db").set(coldTierHitRatio(loc_stats))
+    registry.gauge("pwned_elapsed_seconds", "Duration of the run").set(loc_stats.elapsed_time)
+    registry.gauge("pwned_passwords_per_second", "Passwords/hashes read per second of the run").set(
+        (loc_stats.number_of_password_read / loc_stats.elapsed_time) if loc_stats.elapsed_time > 0 else 0.0)
+    try:
+        registry.write(l_metrics_out, l_metrics_format)
+    except (OSError, ValueError) as e:
+        alwaysLog("WARNING: cannot write the metrics file " + l_metrics_out + ": " + str(e))
+        return
+    print("Metrics written to: " + l_metrics_out)
+
+
 def debugLog(any_variable, color: str = "gray", calling_function:str="") -> None:
     """ 
     print a stringin color if DEBUG_MODE=True. Also write on file if DEBUG_ON_FILE is True
@@ -226,45 +409,92 @@ def alwaysLog(string_variable):
     return
 
     
-def readTextPasswordFromTextFile(l_cli_password_file, l_inputmode=OM_PLAIN):
-    result = []
-    with open(l_cli_password_file, 'r', encoding='utf-8', errors='ignore') as file:
-        lines = file.readlines()
-    file_line:int=0
+def readTextPasswordFromTextFile(l_cli_password_file, l_inputmode=OM_PLAIN, l_hash_workers=1):
+    return list(iterPasswordsFromTextFile(l_cli_password_file, l_inputmode, l_hash_workers))
+
+
+def iterPasswordsFromTextFile(l_cli_password_file, l_inputmode=OM_PLAIN, l_hash_workers=1):
+    """ same as readTextPasswordFromTextFile but the records are generated one at a time while reading the file """
+    for the_store in iterPasswordBatchesFromTextFile(l_cli_password_file, l_inputmode, l_hash_workers):
+        yield from the_store
+
+
+def iterPasswordBatchesFromTextFile(l_cli_password_file, l_inputmode=OM_PLAIN, l_hash_workers=1, l_keep_passwords=True):
+    """ the records of readTextPasswordFromTextFile in RecordStore batches (see pwned_records.py).
+        Without l_keep_passwords the plain text passwords are not stored (only -o writes them)
+    """
     if l_inputmode==OM_PLAIN:
         debugLog("readTextPasswordFromTextFile - Reading in plain text mode (i.e. expecting plain passwords)")
-        for the_line in lines:
-            the_word: str=the_line.strip()
-            file_line =file_line+1
-            if the_word != "":
-                the_hash = hashlib.sha1()
-                try:
-                    the_hash.update(the_word.encode('utf-8'))  
-                except Exception as e:
-                    debugLog(f"readTextPasswordFromTextFile(OM_PLAIN): Error processing line {file_line}: " + str(e))
-                    the_hash.update(''.encode('utf-8'))
-        
-                rec = password_record(the_word, the_hash.hexdigest().upper(), l_cli_password_file, file_line, False )
-  
-                result.append(rec)
-            else:
-                debugLog("readTextPasswordFromTextFile(OM_PLAIN):Skipping empty line")
-    else:
-        debugLog("readTextPasswordFromTextFile - Reading in Sha1 mode (i.e. expecting sha1 digests of passwords)")
-        for the_line in lines:
-            the_hash: str=the_line.strip()
-            file_line=file_line+1
-            if the_hash != "":
-                rec = password_record("unknown", the_hash, l_cli_password_file, file_line, False )
-                result.append(rec)
-            else:
-                debugLog("readTextPasswordFromTextFile(OM_HASH):Skipping empty line")
 
-    return result
+        def iterWords():
+            file_line:int=0
+            with open(l_cli_password_file, 'r', encoding='utf-8', errors='ignore') as file:
+                for the_line in file:
+                    the_word: str=the_line.strip()
+                    file_line =file_line+1
+                    if the_word != "":
+                        yield the_word, file_line
+                    else:
+                        debugLog("readTextPasswordFromTextFile(OM_PLAIN):Skipping empty line")
+            countInputBytes(l_cli_password_file)
+
+        #hashed in batches (by l_hash_workers processes), see pwned_hashing.py
+        yield from iterHashedStores(iterWords(), l_cli_password_file, l_hash_workers, l_keep_passwords)
+        return
+
+    debugLog("readTextPasswordFromTextFile - Reading in Sha1 mode (i.e. expecting sha1 digests of passwords)")
+
+    def iterStores():
+        file_line:int=0
+        the_store = precords.RecordStore(l_cli_password_file, False)   #src_password is always precords.PASSWORD_NOT_KEPT ("unknown")
+        with open(l_cli_password_file, 'r', encoding='utf-8', errors='ignore') as file:
+            for the_line in file:
+                the_hash: str=the_line.strip()
+                file_line=file_line+1
+                if the_hash != "":
+                    the_store.append(None, file_line, src_hash=the_hash)
+                    if len(the_store) >= phash.HASH_BATCH_SIZE:
+                        yield the_store
+                        the_store = precords.RecordStore(l_cli_password_file, False)
+                else:
+                    debugLog("readTextPasswordFromTextFile(OM_HASH):Skipping empty line")
+            countInputBytes(l_cli_password_file)
+        if len(the_store) > 0:
+            yield the_store
+
+    yield from pmetrics.iterTimed(iterStores(), pmetrics.STAGE_READ)
+
+
+_result_writer = None
+
+def openResultWriter(l_outputfilename, l_output_format=poutput.FORMAT_CSV, l_pwned_only=False, l_append=False):
+    """ from now on the results are written to l_outputfilename by a single buffered writer (see pwned_output.py) """
+    global _result_writer
+    debugLog("openResultWriter(" + l_outputfilename + "," + l_output_format + "," + str(l_pwned_only) + "," + str(l_append) + ")")
+    closeResultWriter()
+    _result_writer = poutput.ResultWriter(l_outputfilename, l_output_format, l_pwned_only, l_append)
+    return _result_writer
+
+
+def getResultWriter(l_outputfilename):
+    """ the writer of l_outputfilename. If it was not opened with openResultWriter it is opened in append mode (csv) """
+    if (_result_writer is None) or (_result_writer.filename != l_outputfilename):
+        openResultWriter(l_outputfilename, l_append=True)
+    return _result_writer
+
+
+def closeResultWriter():
+    global _result_writer
+    if _result_writer is not None:
+        _result_writer.close()
+        _result_writer = None
+
+atexit.register(closeResultWriter)
+
 
 def writeListOfRecords(l_outputfilename, l_list_of_records):
-    for new_current_record in l_list_of_records:
-        writeOneRecord(l_outputfilename, new_current_record)
+    if (l_outputfilename != ""):
+        getResultWriter(l_outputfilename).write_records(l_list_of_records)
     return
 
 def writeOneRecord(l_outputfilename, l_myrecord):
@@ -273,12 +503,11 @@ def writeOneRecord(l_outputfilename, l_myrecord):
 
 
 def writeOnePassword(l_outputfilename, found_filename, src_password, src_hash, found_linenumber, i_ispwned ):
-    debugLog("writeOnePassword("+ l_outputfilename + ", " + found_filename + "," + src_password + ", " + src_hash + ", " + str(found_linenumber) + "," + str(i_ispwned)+ ")")
+    if my_stats.DEBUG_MODE or my_stats.DEBUG_ON_FILE:
+        debugLog("writeOnePassword("+ l_outputfilename + ", " + found_filename + "," + src_password + ", " + src_hash + ", " + str(found_linenumber) + "," + str(i_ispwned)+ ")")
 
     if (l_outputfilename != ""):
-        line_output=found_filename + ", " + str(found_linenumber) + "," + src_password + ", " + src_hash  + "," + str(i_ispwned) + "\n"
-        with open(l_outputfilename, 'a', encoding='utf-8', newline='\n') as l_outfile:
-            l_outfile.writelines(line_output)
+        getResultWriter(l_outputfilename).write(found_filename, found_linenumber, src_password, src_hash, i_ispwned)
     else:
         debugLog("writeOnePassword: No filename provided.")
 
@@ -314,6 +543,10 @@ def showHelpShort():
     print("pwned -p B0399D2029F64D445BD131FFAA399A42D2F8E7DC -s -o thisiswhativefound.txt")
     print("pwned -f file_with_passwords.txt -o thisiswhativefound.txt")
     print("pwned -f file_with_passwords_insha1_format.txt -s -o thisiswhativefound.txt")
+    print("pwned -l sha1_pwned_pwd_file.txt --build_packed_db sha1_pwned_pwd_file.bin")
+    print("pwned -f file_with_passwords.txt -l sha1_pwned_pwd_file.bin -m")
+    print("pwned -l sha1_pwned_pwd_file.txt --build_block_db sha1_pwned_pwd_file.blk")
+    print("pwned -f file_with_passwords.txt -l sha1_pwned_pwd_file.blk -c")
     print("pwned --help")
 
 def showHelp():
@@ -340,16 +573,75 @@ def showHelp():
     print("                                          Tested with the list of SHA1 passwords obtained from:")
     print("                                          https://haveibeenpwned.com/Passwords")
     print(" -z zip_filename      (--zipped)        - if the text file defined with -l is contained in the zip_filename")
+    print("                                          With -f/-t the zip is decompressed only once for all passwords")
     print(" -w secs_number       (--wait)          - when using the web server (i.e. if -l NOT used) requests are delayed waiting secs_number between requests")
     print("                                          (throtthled) by secs_number seconds. Ignored with -l")
+    print("                      (--connections n) - with -f/-t and the web server: number of requests in flight at the same time (default " + str(pweb.DEFAULT_CONNECTIONS) + ")")
+    print("                                          each distinct hash prefix (range) is downloaded only once")
+    print("                      (--rate n)        - maximum number of web requests per second (default " + str(pratelimit.DEFAULT_MAX_RATE) + "). The rate is lowered")
+    print("                                          automatically when the server answers 429 (Retry-After is honored) and raised back when healthy")
+    print("                      (--retries n)     - retries of a throttled (429) or failed (5xx, network error) web request (default " + str(pratelimit.DEFAULT_MAX_RETRIES) + ")")
+    print("                      (--cache filename) - keep the web server responses in a local SQLite file and reuse them in the next runs")
+    print("                      (--cache_ttl hours) - cached responses older than this are downloaded again (default " + str(pcache.DEFAULT_CACHE_TTL_HOURS) + ")")
+    print("                      (--cache_size MB) - maximum size of the cache, least recently used ranges are removed (default " + str(pcache.DEFAULT_CACHE_SIZE_MB) + ")")
     print(" -h                   (--help)          - print this message... override all other parameters")
     print(" -o out_filename      (--output_file )  - Write all passwords and the search result in the file named out_filename.")
-    print("                                          If -s is used no passwords will be in the file")
-    print(" -b                   (--binary_search) - The file containing password hashes (if -l is used) sorted alphabetically. Cannot be used with -z")
+    print("                                          If -s is used no passwords will be in the file. Gzip compressed if the name ends in .gz")
+    print("                      (--output_format csv|jsonl) - format of the output file (default csv)")
+    print("                      (--pwned_only)    - write only the pwned passwords to the output file")
+    print("                      (--metrics_out filename) - at the end write the metrics of the run: counters, time per stage (read, hash,")
+    print("                                          lookup, network, write), db reads per lookup, web latency, cache hit ratio")
+    print("                      (--metrics_format json|prometheus) - default json, prometheus text for names ending in .prom or .txt")
+    print(" -b                   (--binary_search) - The file containing password hashes (if -l is used) sorted alphabetically.")
+    print("                                          With -z: the file inside the zip is sorted, the scan stops after the biggest hash to check")
+    print(" -r                   (--range_dir)     - The path defined with -l is a directory of range files (one XXXXX.txt of SUFFIX:count lines")
+    print("                                          per prefix, as written by the HIBP downloader) or a zip of it. Each range file is read once")
+    print(" -m                   (--packed_db)     - The file defined with -l is a packed binary db (see --build_packed_db). Cannot be used with -z or -b")
+    print(" -c                   (--block_db)      - The file defined with -l is a block compressed db (see --build_block_db): about half the size")
+    print("                                          of the text db, each lookup searches one block. Cannot be used with -z or -b")
+    print("                      (--build_packed_db out_filename)")
+    print("                                        - Convert the HASH:count file defined with -l (and -z if zipped) to a packed binary db")
+    print("                                          (20 bytes digests + counts, about half the size) and exit")
+    print("                      (--build_block_db out_filename)")
+    print("                                        - Convert the HASH:count file defined with -l (and -z if zipped) to a block compressed db")
+    print("                                          and exit. An unsorted file is sorted on disk first (see --sort_db)")
+    print("                      (--block_records n) - hashes per block of --build_block_db (default " + str(pblockdb.BLOCK_DEFAULT_RECORDS) + ")")
+    print("                      (--sort_db out_filename)")
+    print("                                        - Sort the HASH:count file defined with -l (and -z if zipped) into the sorted db needed by -b,")
+    print("                                          in bounded memory (external merge sort, in parallel with --workers). The counts of repeated")
+    print("                                          hashes are summed and the order is verified. With --build_index the index is written too")
+    print("                      (--sort_run_mb n) - MB of input sorted in memory at a time by each --sort_db worker (default " + str(psort.SORT_DEFAULT_RUN_MB) + ",")
+    print("                                          about 8 times that of RAM each)")
+    print("                      (--build_index)   - Build the prefix index of the sorted file defined with -l (saved as <file>.idx) and exit")
+    print("                                          -b uses the index automatically when present: one read per lookup")
+    print("                      (--index_bits n)  - prefix length in bits for --build_index: 16 or 20 (default 20)")
+    print("                      (--build_filter)  - Build the bloom filter of the db defined with -l (text, packed with -m, or zipped with -z)")
+    print("                                          saved as <file>.bloom and used automatically: most safe passwords never touch the db")
+    print("                      (--fp_rate r)     - false positive rate of --build_filter (default " + str(pfilter.FILTER_DEFAULT_FP_RATE) + ", about 1.2 bytes per hash)")
+    print("                      (--build_hot_tier) - Extract the most breached hashes (by count) of the db defined with -l (text, packed with -m,")
+    print("                                          or zipped with -z) to <file>.hot: loaded in memory and checked before the db")
+    print("                      (--hot_tier_size n) - number of hashes of --build_hot_tier (default " + str(phot.HOT_DEFAULT_SIZE) + ", about 90 bytes of memory each)")
+    print("                      (--update_db delta_file) - Merge delta_file (HASH:count lines, e.g. a new release) into the sorted file defined")
+    print("                                          with -l in one pass, patch its .idx/.bloom sidecars and append the changed prefixes")
+    print("                                          to <file>.changelog, then exit")
+    print("                      (--update_out filename) - write the updated db (and its sidecars) to filename instead of replacing the -l file")
+    print("                      (--workers n)     - with -l (not sorted, not zipped) and -f/-t scan the file with n processes in parallel")
+    print("                                          with --sort_db sort the runs with n processes")
+    print("                      (--chunk_size n)  - with -f/-t the input is read, hashed and checked n passwords at a time (memory stays flat)")
+    print("                                          default " + str(LOOKUP_CHUNK_SIZE) + " with the web server and -m, " + str(SCAN_CHUNK_SIZE) + " otherwise (one db pass per chunk).")
+    print("                                          With -b bigger inputs are sorted on disk and the db is still read once")
+    print("                      (--hash_workers n) - with -f/-t hash the plain text passwords with n processes (SHA1 of big files saturates one core)")
+    print("                      (--serve address) - keep the db (-l with -b/-m, or the web server) open and answer checks on address:")
+    print("                                          unix:/path/to/socket or http://127.0.0.1:port. Client: python pwned_serve.py -h")
+    print("                      (--serve_range http://host:port) - answer GET /range/XXXXX like the public api from the db defined with -l")
+    print("                                          (sorted -b, packed -m, block compressed -c or range files -r): a mirror for the other hosts of the LAN")
+    print("                      (--api_url url)   - use the range api at url (e.g. http://host:port of a --serve_range mirror) instead of")
+    print("                                          the public one. Default: the " + API_URL_ENV_VAR + " environment variable, if set")
     print(" -d                   (--debug)         - Start in debug mode (lot of logs)")
     print("-----------------------------------------------------------------------------------------------------------------------")
     print("Output file (if used) is a csv file containing:")
     print("       source_file_name, line_number_in_src_file, plain_text_pwd_if_available, Sha1-version_of_the_pwd, True|False")
+    print("or (--output_format jsonl) one json object per line with the keys: file, line, password, sha1, pwned")
     print("-----------------------------------------------------------------------------------------------------------------------")
 
     showHelpShort()
@@ -362,7 +654,7 @@ def hashMeThis(l_password):
     the_hashed_pwd_string = the_hashed_pwd.hexdigest().upper()
     return the_hashed_pwd_string
 
-def checkSinglePassword(l_password, l_current_input_mode, l_current_db_mode, l_cli_local_db_file, l_cli_local_zip, l_cli_output_file):
+def checkSinglePassword(l_password, l_current_input_mode, l_current_db_mode, l_cli_local_db_file, l_cli_local_zip, l_cli_output_file, l_zip_sorted=False):
 
     debugLog("checkSinglePassword(" + l_password + "," + str(l_current_input_mode) + "," + str(l_current_db_mode) + "," + l_cli_local_db_file + "," + l_cli_local_zip + "," + l_cli_output_file + ")")
 
@@ -382,66 +674,184 @@ def checkSinglePassword(l_password, l_current_input_mode, l_current_db_mode, l_c
         password_in_hash_format = hashMeThis(l_password)
     
     is_pwned = False
-    if (l_current_db_mode == DB_WEB):
-        is_pwned=isHashPwnedRemoteWithPwd(password_in_hash_format, l_password)
-    elif (l_current_db_mode == DB_LOCAL_ZIP):
-        is_pwned=isHashPwnedLocalZip(password_in_hash_format, l_cli_local_db_file, l_cli_local_zip)
-    elif (l_current_db_mode == DB_LOCAL_SORTED):
-        is_pwned=isHashPwnedLocalBinary(password_in_hash_format, l_cli_local_db_file)
-    else:
-        is_pwned=isHashPwnedLocal(password_in_hash_format, l_cli_local_db_file)
+    with pmetrics.getRegistry().stage(pmetrics.STAGE_LOOKUP):
+        if isHashHot(password_in_hash_format, getHotTier(l_current_db_mode, l_cli_local_db_file, l_cli_local_zip)):
+            print(password_in_hash_format + " FOUND (hot tier): the db was not read")
+            pstat.PwnedStats().add(number_of_password_read=1, pwned_passwords_found=1)
+            is_pwned = True
+        elif isHashSurelySafe(password_in_hash_format, getBloomFilter(l_current_db_mode, l_cli_local_db_file, l_cli_local_zip)):
+            print(password_in_hash_format + " NOT FOUND (bloom filter): the db was not read")
+            pstat.PwnedStats().add(number_of_password_read=1, safe_passwords_found=1)
+        elif (l_current_db_mode == DB_WEB):
+            is_pwned=isHashPwnedRemoteWithPwd(password_in_hash_format, l_password)
+        elif (l_current_db_mode == DB_LOCAL_ZIP):
+            is_pwned=isHashPwnedLocalZip(password_in_hash_format, l_cli_local_db_file, l_cli_local_zip, l_zip_sorted)
+        elif (l_current_db_mode == DB_LOCAL_SORTED):
+            is_pwned=isHashPwnedLocalBinary(password_in_hash_format, l_cli_local_db_file)
+        elif (l_current_db_mode == DB_LOCAL_PACKED):
+            is_pwned=isHashPwnedLocalPacked(password_in_hash_format, l_cli_local_db_file)
+        elif (l_current_db_mode == DB_LOCAL_BLOCKS):
+            is_pwned=isHashPwnedLocalBlocks(password_in_hash_format, l_cli_local_db_file)
+        elif (l_current_db_mode == DB_LOCAL_RANGES):
+            is_pwned=isHashPwnedLocalRanges(password_in_hash_format, l_cli_local_db_file)
+        else:
+            is_pwned=isHashPwnedLocal(password_in_hash_format, l_cli_local_db_file)
     
     writeOnePassword(l_cli_output_file, "cli", password_in_text_format, password_in_hash_format, 0, is_pwned )
    
     return
 
-def checkPlainPasswordFile(l_cli_password_file, l_current_db_mode, l_cli_local_db_file, l_cli_output_file, l_inputmode=OM_PLAIN, l_delay_secs=0):
+def checkPlainPasswordFile(l_cli_password_file, l_current_db_mode, l_cli_local_db_file, l_cli_output_file, l_inputmode=OM_PLAIN, l_delay_secs=0, l_workers=1, l_cli_local_zip="", l_zip_sorted=False, l_connections=pweb.DEFAULT_CONNECTIONS, l_chunk_size=0, l_hash_workers=1):
     debugLog("checkPlainPasswordFile(" + l_cli_password_file + "," + str(l_current_db_mode) + "," +l_cli_local_db_file + "," + l_cli_output_file +","+ str(l_inputmode) + "," + str(l_delay_secs)+")")
 
-    loc_stats = pstat.PwnedStats()
-    
-    list_to_check = []  
-    list_to_check = readTextPasswordFromTextFile(l_cli_password_file, l_inputmode)
-    loc_stats.number_of_password_read = len(list_to_check)
-    if (l_current_db_mode == DB_WEB):
-        for current in list_to_check:
-            current.ispwned=isHashPwnedRemoteWithPwd(current.src_hash, current.src_password)
-            writeOneRecord(l_cli_output_file, current)
-            time.sleep(l_delay_secs)
-            debugLog("Throttling requests by secs:" + str(l_delay_secs))
-    elif (l_current_db_mode == DB_LOCAL_SORTED):
-        isHashListPwnedLocalBinary(list_to_check, l_cli_local_db_file, l_cli_output_file, OM_PLAIN)
-    else:
-        #isHashListPwnedLocalMT(list_to_check, l_cli_local_db_file, l_cli_output_file, OM_PLAIN)
-        #below  is the working version...
-        isHashListPwnedLocal(list_to_check, l_cli_local_db_file, l_cli_output_file, OM_PLAIN)
+    #the plain text passwords are kept in memory only if the output file needs them
+    checkRecordStream(lambda: iterPasswordBatchesFromTextFile(l_cli_password_file, l_inputmode, l_hash_workers, l_cli_output_file != ""), l_current_db_mode, l_cli_local_db_file, l_cli_output_file,
+                      l_delay_secs, l_workers, l_cli_local_zip, l_zip_sorted, l_connections, l_chunk_size)
     return 
 
-def checkTextFile(l_word_list, l_current_db_mode, l_cli_local_db_file, l_cli_output_file, l_delay_secs):
+def checkTextFile(l_word_list, l_current_db_mode, l_cli_local_db_file, l_cli_output_file, l_delay_secs, l_workers=1, l_cli_local_zip="", l_zip_sorted=False, l_connections=pweb.DEFAULT_CONNECTIONS, l_chunk_size=0):
     debugLog("checkTextFile(l_word_list, " + str(l_current_db_mode) + "," + l_cli_local_db_file + "," + l_cli_output_file + ")")
     
-    list_to_check = l_word_list
-    loc_stats = pstat.PwnedStats()
-    loc_stats.number_of_password_read = len(list_to_check)
-    if (l_current_db_mode == DB_WEB):
-        for current in list_to_check:
-            current.ispwned=isHashPwnedRemoteWithPwd(current.src_hash, current.src_password)
-            writeOneRecord(l_cli_output_file, current)
-            time.sleep(l_delay_secs)
-            debugLog("Throttling requests by secs:" + str(l_delay_secs))
-    elif (l_current_db_mode == DB_LOCAL_SORTED):
-        isHashListPwnedLocalBinary(list_to_check, l_cli_local_db_file, l_cli_output_file, OM_PLAIN)
+    #l_word_list is a list of records or a function returning a new iterator over them or over RecordStore batches
+    #(e.g. lambda: iterPasswordListBatches(filename))
+    if callable(l_word_list):
+        records_source = l_word_list
     else:
-        isHashListPwnedLocal(list_to_check, l_cli_local_db_file, l_cli_output_file, OM_PLAIN)
+        def records_source():
+            return iter(l_word_list)
+    checkRecordStream(records_source, l_current_db_mode, l_cli_local_db_file, l_cli_output_file,
+                      l_delay_secs, l_workers, l_cli_local_zip, l_zip_sorted, l_connections, l_chunk_size)
     return 
 
+def getDefaultChunkSize(l_current_db_mode):
+    if l_current_db_mode in (DB_WEB, DB_LOCAL_PACKED, DB_LOCAL_RANGES, DB_LOCAL_BLOCKS):
+        return LOOKUP_CHUNK_SIZE
+    return SCAN_CHUNK_SIZE
+
+def checkRecordStream(l_records_source, l_current_db_mode, l_cli_local_db_file, l_cli_output_file, l_delay_secs=0, l_workers=1, l_cli_local_zip="", l_zip_sorted=False, l_connections=pweb.DEFAULT_CONNECTIONS, l_chunk_size=0):
+    """ check the records returned by l_records_source() (a function returning a new iterator each time it is called)
+        l_chunk_size records at a time: only one chunk is in memory and its results are written before the next is read.
+        The batch engines add up their stats chunk after chunk.
+    """
+    if l_chunk_size <= 0:
+        l_chunk_size = getDefaultChunkSize(l_current_db_mode)
+    debugLog("checkRecordStream(" + str(l_current_db_mode) + "," + l_cli_local_db_file + "," + l_cli_output_file + "," + str(l_chunk_size) + ")")
+
+    the_filter = getBloomFilter(l_current_db_mode, l_cli_local_db_file, l_cli_local_zip)
+    the_hot_tier = getHotTier(l_current_db_mode, l_cli_local_db_file, l_cli_local_zip)
+
+    if (l_current_db_mode == DB_LOCAL_SORTED):
+        #the merge join needs all the hashes sorted: see isHashStreamPwnedLocalBinary
+        isHashStreamPwnedLocalBinary(l_records_source, l_cli_local_db_file, l_cli_output_file, OM_PLAIN, l_chunk_size, the_filter, the_hot_tier)
+        return
+
+    if the_hot_tier is not None:
+        #the most breached hashes are answered from memory, before the filter and the db
+        all_records_source = l_records_source
+
+        def cold_records_source():
+            return iterRecordsNotHot(all_records_source(), the_hot_tier, l_cli_output_file)
+        l_records_source = cold_records_source
+
+    if the_filter is not None:
+        #only the hashes the filter cannot rule out reach the db engines
+        unfiltered_source = l_records_source
+
+        def filtered_source():
+            return iterRecordsNotSurelySafe(unfiltered_source(), the_filter, l_cli_output_file)
+        l_records_source = filtered_source
+
+    def check_function(list_records, outputfilename):
+        if (l_current_db_mode == DB_WEB):
+            return isHashListPwnedRemote(list_records, outputfilename, l_connections, l_delay_secs)
+        if (l_current_db_mode == DB_LOCAL_PACKED):
+            return isHashListPwnedLocalPacked(list_records, l_cli_local_db_file, outputfilename, OM_PLAIN)
+        if (l_current_db_mode == DB_LOCAL_BLOCKS):
+            return isHashListPwnedLocalBlocks(list_records, l_cli_local_db_file, outputfilename)
+        if (l_current_db_mode == DB_LOCAL_RANGES):
+            return isHashListPwnedLocalRanges(list_records, l_cli_local_db_file, outputfilename)
+        if (l_current_db_mode == DB_LOCAL_ZIP):
+            return isHashListPwnedLocalZip(list_records, l_cli_local_db_file, l_cli_local_zip, outputfilename, OM_PLAIN, l_zip_sorted)
+        if l_workers > 1:
+            return isHashListPwnedLocalMT(list_records, l_cli_local_db_file, outputfilename, OM_PLAIN, l_workers)
+        return isHashListPwnedLocal(list_records, l_cli_local_db_file, outputfilename, OM_PLAIN)
+
+    for list_to_check in iterRecordChunks(l_records_source(), l_chunk_size):
+        checkRecordsOnce(list_to_check, check_function, l_cli_output_file)
+    return
+
+
+def dedupeRecords(l_records):
+    """ (the records with distinct hashes, for each record the position of its hash in them) of a chunk.
+        (l_records, None) if there are no duplicates
+    """
+    if isinstance(l_records, precords.RecordStore):
+        unique_indexes, fan_out = l_records.unique_indexes()
+        if len(unique_indexes) == len(l_records):
+            return l_records, None
+        return l_records.select(unique_indexes), fan_out
+
+    first_of = {}
+    unique_records = []
+    fan_out = []
+    for current_record in l_records:
+        position = first_of.setdefault(current_record.src_hash, len(unique_records))
+        if position == len(unique_records):
+            unique_records.append(current_record)
+        fan_out.append(position)
+    if len(unique_records) == len(l_records):
+        return l_records, None
+    return unique_records, fan_out
+
+
+def checkRecordsOnce(l_records, l_check_function, l_outputfilename):
+    """ l_check_function(records, outputfilename) (a batch engine) on one record per distinct hash of l_records:
+        the result is then copied to the other records with the same hash (-t text often repeats the same word),
+        counted, and all the records are written
+    """
+    loc_stats = pstat.PwnedStats()
+    unique_records, fan_out = dedupeRecords(l_records)
+    loc_stats.add(unique_passwords_checked=len(unique_records))
+    if fan_out is None:
+        with pmetrics.getRegistry().stage(pmetrics.STAGE_LOOKUP):
+            return l_check_function(l_records, l_outputfilename)
+
+    debugLog("checkRecordsOnce: " + str(len(l_records)) + " records, " + str(len(unique_records)) + " distinct hashes")
+    with pmetrics.getRegistry().stage(pmetrics.STAGE_LOOKUP):
+        result = l_check_function(unique_records, "")   #written below, with the duplicates
+    unique_results = [current_record.ispwned for current_record in unique_records]
+    pwned_records = 0
+    for current_record, position in zip(l_records, fan_out):
+        current_record.ispwned = unique_results[position]
+        if current_record.ispwned:
+            pwned_records = pwned_records + 1
+
+    duplicate_records = len(l_records) - len(unique_records)
+    pwned_duplicates  = pwned_records - sum(unique_results)
+    loc_stats.add(number_of_password_read=duplicate_records, pwned_passwords_found=pwned_duplicates,
+                  safe_passwords_found=duplicate_records - pwned_duplicates)
+    writeListOfRecords(l_outputfilename, l_records)
+    return result
+
+def getDbProbesHistogram():
+    return pmetrics.getRegistry().histogram("pwned_db_probes_per_lookup", "Db lines (or packed digests) read to look up one hash", pmetrics.PROBE_BUCKETS)
+
+
+def countSingleLookup(l_result, l_scanned_lines=None):
+    """ stats of the lookup of one hash, thread safe. l_scanned_lines (db lines or digests read) is None when not known """
+    pstat.PwnedStats().add(number_of_password_read=1, pwned_passwords_found=1 if l_result else 0,
+                           safe_passwords_found=0 if l_result else 1, scanned_lines_in_db=l_scanned_lines or 0)
+    if l_scanned_lines is not None:
+        getDbProbesHistogram().observe(l_scanned_lines)
+
+
 #added on 2021/12/27 to read from a zipped file....
-def isHashPwnedLocalZip(l_hash, l_local_db_file, l_local_zip_file):
-    debugLog("isHashPwnedLocalZip(" + l_hash + "," + l_local_db_file + ", " + l_local_zip_file + ")")
+def isHashPwnedLocalZip(l_hash, l_local_db_file, l_local_zip_file, l_sorted=False):
+    debugLog("isHashPwnedLocalZip(" + l_hash + "," + l_local_db_file + ", " + l_local_zip_file + ", " + str(l_sorted) + ")")
     result= False
     line_number=0
-    loc_stats = pstat.PwnedStats()
 
+    import zipfile   #zip and network modules are only loaded when their db mode is used
     with zipfile.ZipFile(l_local_zip_file) as z:
         #surround with try catch
         try:
@@ -451,14 +861,14 @@ def isHashPwnedLocalZip(l_hash, l_local_db_file, l_local_zip_file):
                     line_number = line_number + 1
                     line_hash = the_line.strip().split(b":")[0]
                     if (l_hash.encode() == line_hash):
-                        loc_stats.number_of_password_read = 1
-                        loc_stats.pwned_passwords_found   = 1
-                        loc_stats.safe_passwords_found    = loc_stats.number_of_password_read - loc_stats.pwned_passwords_found 
-                        loc_stats.scanned_lines_in_db     = line_number 
                         result=True
+                        countSingleLookup(result, line_number)
                         print(l_hash + " FOUND on line " + str(line_number) + " of file " + l_local_db_file)
                         debugLog("isHashPwnedLocalZip result=" + str(result))
                         return result
+                    if l_sorted and (line_hash > l_hash.encode()):
+                        debugLog("isHashPwnedLocalZip: sorted file, " + l_hash + " can not be after line " + str(line_number))
+                        break
                     if (line_number % 100000) == 0:
                         #last_digit = (last_digit+1) % 10
                         #print(str(last_digit), end='', flush= True)
@@ -468,10 +878,59 @@ def isHashPwnedLocalZip(l_hash, l_local_db_file, l_local_zip_file):
             debugLog("isHashPwnedLocalZip: Exception: " + str(e))
             print("\nERROR: " + l_local_db_file + " file NOT FOUND inside " + l_local_zip_file + ". Exiting...") 
     
-    loc_stats.number_of_password_read = 1
-    loc_stats.pwned_passwords_found   = 0
-    loc_stats.safe_passwords_found    = loc_stats.number_of_password_read - loc_stats.pwned_passwords_found
-    loc_stats.scanned_lines_in_db     = line_number                 
+    countSingleLookup(result, line_number)
+    return result
+
+
+#same as isHashListPwnedLocal but the zipped file is decompressed (streamed) only once for all the records
+def isHashListPwnedLocalZip(list_records, l_local_db_file, l_local_zip_file, l_outputfilename, l_input_mode, l_sorted=False):
+    debugLog("isHashListPwnedLocalZip(" + "list_records" + "," + l_local_db_file + "," + l_local_zip_file + "," + l_outputfilename + "," + str(l_input_mode) + "," + str(l_sorted) + ")")
+    result= False #True if at least one password is found
+    line_number=0
+
+    total_records = len(list_records)
+    true_records  = 0
+    loc_stats = pstat.PwnedStats()
+
+    records_to_find = {}
+    for the_hash, same_hash_records in groupRecordsByHash(list_records).items():
+        records_to_find[the_hash.encode("utf-8")] = same_hash_records
+    #if the zipped file is sorted nothing can be found after the biggest hash
+    biggest_hash = max(records_to_find) if records_to_find else b""
+
+    import zipfile
+    with zipfile.ZipFile(l_local_zip_file) as z:
+        try:
+            member = z.open(l_local_db_file)
+        except KeyError:
+            raise FileNotFoundError(l_local_db_file + " file NOT FOUND inside " + l_local_zip_file) from None
+        with member as f:
+            for the_line in f:
+                if not records_to_find:
+                    debugLog("isHashListPwnedLocalZip: exit and return... no more passwords to check. Total scanned lines: " + str(line_number))
+                    break
+                line_number = line_number + 1
+                line_hash = the_line.split(b":", 1)[0].strip()
+                found_records = records_to_find.pop(line_hash, None)
+                if found_records is not None:
+                    result = True
+                    true_records = true_records + len(found_records)
+                    for current_record in found_records:
+                        current_record.ispwned = True
+                        print(current_record.found_filename + "(" + str(current_record.found_linenumber) + ") -" +
+                        current_record.src_password + " -" + current_record.src_hash + " FOUND on line " + str(line_number) +
+                        " of file " + l_local_db_file + " - " + str(total_records-true_records) + " pwds to check...")
+                elif l_sorted and (line_hash > biggest_hash):
+                    debugLog("isHashListPwnedLocalZip: sorted file, nothing more to find after line " + str(line_number))
+                    break
+
+                if (line_number % 100000) == 0:
+                    print("Scanned lines:", "{:,}".format(line_number), end="\r")
+        print("isHashListPwnedLocalZip - All passwords checked. Total scanned lines: " + str(line_number))
+
+    writeListOfRecords(l_outputfilename, list_records)
+    loc_stats.add(number_of_password_read=total_records, pwned_passwords_found=true_records,
+                  safe_passwords_found=total_records - true_records, scanned_lines_in_db=line_number)   #if local db option used
     return result
 
 
@@ -480,18 +939,14 @@ def isHashPwnedLocal(l_hash, l_local_db_file):
     
     result= False
     line_number=0
-    loc_stats = pstat.PwnedStats()
 
     with open(l_local_db_file, 'r', encoding='utf-8') as read_obj:
         for the_line in read_obj:
             line_number = line_number + 1
             line_hash = the_line.strip().split(":")[0]
             if (l_hash == line_hash):
-                loc_stats.number_of_password_read = 1
-                loc_stats.pwned_passwords_found   = 1
-                loc_stats.safe_passwords_found    = loc_stats.number_of_password_read - loc_stats.pwned_passwords_found
-                loc_stats.scanned_lines_in_db     = line_number
                 result=True
+                countSingleLookup(result, line_number)
                 print("")
                 print(l_hash + " FOUND on line " + str(line_number) + " of file " + l_local_db_file)
                 return result
@@ -501,90 +956,553 @@ def isHashPwnedLocal(l_hash, l_local_db_file):
                 #print(str(last_digit), end='', flush= True)
                 print(f"Scanned lines: {line_number:,}", end="\r")
 
-    loc_stats.number_of_password_read = 1
-    loc_stats.pwned_passwords_found   = 0
-    loc_stats.safe_passwords_found    = loc_stats.number_of_password_read - loc_stats.pwned_passwords_found
-    loc_stats.scanned_lines_in_db     = line_number                 
+    countSingleLookup(result, line_number)
     return result
 
+def getPrefixIndex(l_local_db_file):
+    """ the sidecar index (see --build_index) of l_local_db_file if present and valid, otherwise None """
+    try:
+        return pidx.getIndexFor(l_local_db_file)
+    except (pidx.PrefixIndexError, OSError) as e:
+        alwaysLog("WARNING: ignoring index of " + l_local_db_file + ": " + str(e))
+        return None
+
+
+def getBloomFilter(l_current_db_mode, l_local_db_file, l_local_zip_file=""):
+    """ the sidecar bloom filter (see --build_filter) of the local db (of the zip with -z) if present and valid, otherwise None """
+    if l_current_db_mode == DB_WEB:
+        return None
+    attached_file = l_local_zip_file if l_current_db_mode == DB_LOCAL_ZIP else l_local_db_file
+    try:
+        return pfilter.getFilterFor(attached_file)
+    except (pfilter.BloomFilterError, OSError) as e:
+        alwaysLog("WARNING: ignoring bloom filter of " + attached_file + ": " + str(e))
+        return None
+
+
+def isHashSurelySafe(l_hash, l_filter, l_digest=None):
+    """ True if l_filter (may be None) proves that l_hash (or the raw l_digest, if known) is not in the db: no need to read the db """
+    if l_filter is None:
+        return False
+    loc_stats = pstat.PwnedStats()
+    if l_filter.might_contain(l_digest) if l_digest is not None else l_filter.might_contain_hex(l_hash):
+        loc_stats.add(filter_positives=1)
+        return False
+    loc_stats.add(filter_negatives=1)
+    return True
+
+
+def isRecordSurelySafe(l_record, l_filter):
+    """ isHashSurelySafe on the raw digest of the record when there is one (no hex string built) """
+    if l_record.src_digest is not None:
+        return isHashSurelySafe(None, l_filter, l_record.src_digest)
+    return isHashSurelySafe(l_record.src_hash, l_filter)
+
+
+def recordMightBeInDb(l_record, l_filter):
+    """ not isRecordSurelySafe, without counting: for the loops that count a whole chunk at once """
+    src_digest = l_record.src_digest
+    if src_digest is not None:
+        return l_filter.might_contain(src_digest)
+    return l_filter.might_contain_hex(l_record.src_hash)
+
+
+def iterRecordsNotSurelySafe(l_records, l_filter, l_outputfilename):
+    """ the records (or RecordStore batches, filtered in turn) the db must check: the ones the filter proves safe are written (and counted) here """
+    for current_record in l_records:
+        if isinstance(current_record, precords.RecordStore):
+            yield selectRecordsNotSurelySafe(current_record, l_filter, l_outputfilename)
+        elif not writeIfSurelySafe(current_record, l_filter, l_outputfilename):
+            yield current_record
+
+
+def writeIfSurelySafe(l_record, l_filter, l_outputfilename):
+    """ True if the filter proves the record safe: then it is also counted and written """
+    if not isRecordSurelySafe(l_record, l_filter):
+        return False
+    l_record.ispwned = False
+    pstat.PwnedStats().add(number_of_password_read=1, safe_passwords_found=1)
+    writeOneRecord(l_outputfilename, l_record)
+    return True
+
+
+def selectRecordsNotSurelySafe(l_records, l_filter, l_outputfilename):
+    """ same as iterRecordsNotSurelySafe on a whole chunk: returns a RecordStore for a RecordStore, a list otherwise """
+    if l_filter is None:
+        return l_records
+    if isinstance(l_records, precords.RecordStore):
+        selected_indexes = []
+        for index, current_record in enumerate(l_records):
+            if recordMightBeInDb(current_record, l_filter):
+                selected_indexes.append(index)
+            else:
+                current_record.ispwned = False
+                writeOneRecord(l_outputfilename, current_record)
+        safe_records = len(l_records) - len(selected_indexes)
+        pstat.PwnedStats().add(number_of_password_read=safe_records, safe_passwords_found=safe_records,
+                               filter_negatives=safe_records, filter_positives=len(selected_indexes))
+        return l_records.select(selected_indexes)
+    return list(iterRecordsNotSurelySafe(l_records, l_filter, l_outputfilename))
+
+
+def getHotTier(l_current_db_mode, l_local_db_file, l_local_zip_file=""):
+    """ the sidecar hot tier (see --build_hot_tier) of the local db (of the zip with -z) if present and valid, otherwise None """
+    if l_current_db_mode == DB_WEB:
+        return None
+    attached_file = l_local_zip_file if l_current_db_mode == DB_LOCAL_ZIP else l_local_db_file
+    try:
+        return phot.getHotTierFor(attached_file)
+    except (phot.HotTierError, OSError) as e:
+        alwaysLog("WARNING: ignoring hot tier of " + attached_file + ": " + str(e))
+        return None
+
+
+def isHashHot(l_hash, l_hot_tier, l_digest=None):
+    """ True if l_hash (or the raw l_digest, if known) is in l_hot_tier (may be None): pwned, no need to read the db """
+    if l_hot_tier is None:
+        return False
+    loc_stats = pstat.PwnedStats()
+    if l_hot_tier.contains(l_digest) if l_digest is not None else l_hot_tier.contains_hex(l_hash):
+        loc_stats.add(hot_tier_hits=1)
+        return True
+    loc_stats.add(hot_tier_misses=1)
+    return False
+
+
+def isRecordHot(l_record, l_hot_tier):
+    """ isHashHot on the raw digest of the record when there is one (no hex string built) """
+    if l_record.src_digest is not None:
+        return isHashHot(None, l_hot_tier, l_record.src_digest)
+    return isHashHot(l_record.src_hash, l_hot_tier)
+
+
+def printHotRecord(l_record):
+    print(l_record.found_filename + "(" + str(l_record.found_linenumber) + ") -" + l_record.src_password + " -" + l_record.src_hash + " FOUND in the hot tier")
+
+
+def iterRecordsNotHot(l_records, l_hot_tier, l_outputfilename):
+    """ the records (or RecordStore batches, filtered in turn) the db must check: the ones in the hot tier are written (and counted) here """
+    for current_record in l_records:
+        if isinstance(current_record, precords.RecordStore):
+            yield selectRecordsNotHot(current_record, l_hot_tier, l_outputfilename)
+        elif not writeIfHot(current_record, l_hot_tier, l_outputfilename):
+            yield current_record
+
+
+def writeIfHot(l_record, l_hot_tier, l_outputfilename):
+    """ True if the record is in the hot tier: then it is also counted and written """
+    if not isRecordHot(l_record, l_hot_tier):
+        return False
+    l_record.ispwned = True
+    pstat.PwnedStats().add(number_of_password_read=1, pwned_passwords_found=1)
+    printHotRecord(l_record)
+    writeOneRecord(l_outputfilename, l_record)
+    return True
+
+
+def selectRecordsNotHot(l_records, l_hot_tier, l_outputfilename):
+    """ same as iterRecordsNotHot on a whole chunk: returns a RecordStore for a RecordStore, a list otherwise """
+    if l_hot_tier is None:
+        return l_records
+    if isinstance(l_records, precords.RecordStore):
+        selected_indexes = []
+        for index, current_record in enumerate(l_records):
+            src_digest = current_record.src_digest
+            if l_hot_tier.contains(src_digest) if src_digest is not None else l_hot_tier.contains_hex(current_record.src_hash):
+                current_record.ispwned = True
+                printHotRecord(current_record)
+                writeOneRecord(l_outputfilename, current_record)
+            else:
+                selected_indexes.append(index)
+        hot_records = len(l_records) - len(selected_indexes)
+        pstat.PwnedStats().add(number_of_password_read=hot_records, pwned_passwords_found=hot_records,
+                               hot_tier_hits=hot_records, hot_tier_misses=len(selected_indexes))
+        if hot_records == 0:
+            return l_records
+        return l_records.select(selected_indexes)
+    return list(iterRecordsNotHot(l_records, l_hot_tier, l_outputfilename))
+
+
+def buildHotTier(l_local_db_file, l_local_zip_file, l_size):
+    debugLog("buildHotTier(" + l_local_db_file + "," + l_local_zip_file + "," + str(l_size) + ")")
+    print("Building the hot tier of " + l_local_db_file + ((" inside " + l_local_zip_file) if l_local_zip_file else "") + f" (top {l_size:,} hashes by count)...")
+    try:
+        hot_filename = phot.buildHotTier(l_local_db_file, l_size, l_local_zip_file)
+        the_tier = phot.HotTier(l_local_zip_file or l_local_db_file, hot_filename)
+    except (phot.HotTierError, pbindb.PackedDBError, pblockdb.BlockDBError, OSError) as e:
+        alwaysLog("ERROR: cannot build the hot tier: " + str(e) + ". Exiting...")
+        sys.exit(ERR_OTHERS)
+    print(f"Hot tier written to {hot_filename}: {len(the_tier):,} hashes breached at least {the_tier.min_count:,} times. It will be used automatically")
+    return hot_filename
+
+
+def buildBloomFilter(l_local_db_file, l_local_zip_file, l_fp_rate):
+    debugLog("buildBloomFilter(" + l_local_db_file + "," + l_local_zip_file + "," + str(l_fp_rate) + ")")
+    print("Building the bloom filter of " + l_local_db_file + ((" inside " + l_local_zip_file) if l_local_zip_file else "") + f" ({l_fp_rate:.2%} false positives)...")
+    try:
+        filter_filename = pfilter.buildFilter(l_local_db_file, l_fp_rate, l_local_zip_file)
+    except (pfilter.BloomFilterError, pbindb.PackedDBError, pblockdb.BlockDBError, OSError) as e:
+        alwaysLog("ERROR: cannot build the bloom filter: " + str(e) + ". Exiting...")
+        sys.exit(ERR_OTHERS)
+    print(f"Bloom filter written to {filter_filename} ({os.path.getsize(filter_filename):,} bytes). It will be used automatically")
+    return filter_filename
+
+
 #write a function like isHashPwnedLocal but using binary search in the l_local_db_file
 def isHashPwnedLocalBinary(l_hash, l_local_db_file):
     debugLog("isHashPwnedLocalBinary(" + l_hash + "," + l_local_db_file + ")")
-    loc_stats = pstat.PwnedStats()
+
+    #with the sidecar index only one bucket is read
+    the_index = getPrefixIndex(l_local_db_file)
+    if the_index is not None:
+        reads_before = the_index.reads
+        result = the_index.lookup(l_hash)
+        countSingleLookup(result, the_index.reads - reads_before)
+        return result
 
     #binary search of l_hash in l_local_db_file
-    
-    loc_stats.scanned_lines_in_db = 0
     with open(l_local_db_file, 'r', encoding='utf-8') as f:
-        left = 0
-        right = f.seek(0, 2) # Seek to end of file
-        while left < right:
-            loc_stats.scanned_lines_in_db = loc_stats.scanned_lines_in_db + 1
-            print("Lines scanned:", loc_stats.scanned_lines_in_db, end="\r")
-            mid = (left + right) // 2
-            f.seek(mid)
-            f.readline() # Discard the partial line (we may have landed mid-line)
-            pos = f.tell()
-            line = f.readline().strip()
-            if not line:
-                # We've gone past the end of file
-                right = mid
-                continue
-            # Extract just the hash portion (lines are formatted as HASH:count)
-            line_hash = line.split(":")[0]
-            if line_hash == l_hash:
-                loc_stats.number_of_password_read = 1
-                loc_stats.pwned_passwords_found   = 1
-                loc_stats.safe_passwords_found    = 0
-                return True
-            elif line_hash < l_hash:
-                left = pos + len(line) + 1
-            else:
-                right = mid
+        result, lines_read = binarySearchSortedDb(f, l_hash)
 
-    loc_stats.number_of_password_read = 1
-    loc_stats.pwned_passwords_found   = 0
-    loc_stats.safe_passwords_found    = 1
-    return False
+    countSingleLookup(result, lines_read)
+    return result
+
+
+def binarySearchSortedDb(f, l_hash):
+    """ binary search of l_hash in the sorted db already open (text mode) as f. Returns (True if found, lines read) """
+    lines_read = 0
+    left = 0
+    right = f.seek(0, 2) # Seek to end of file
+    while left < right:
+        lines_read = lines_read + 1
+        mid = (left + right) // 2
+        if mid > 0:
+            f.seek(mid - 1)
+            f.readline() # Discard the partial line (we may have landed mid-line). A line starting at mid is kept
+        else:
+            f.seek(0)
+        pos = f.tell()
+        line = f.readline().strip()
+        if not line:
+            # We've gone past the end of file
+            right = mid
+            continue
+        # Extract just the hash portion (lines are formatted as HASH:count)
+        line_hash = line.split(":")[0]
+        if line_hash == l_hash:
+            return True, lines_read
+        elif line_hash < l_hash:
+            left = pos + len(line) + 1
+        else:
+            right = mid
+    return False, lines_read
   
 
 #isHashListPwnedLocalBinary(list_records, l_local_db_file, l_outputfilename, l_input_mode)
 def isHashListPwnedLocalBinary(list_records, l_local_db_file, l_outputfilename, l_input_mode):
     debugLog("isHashListPwnedLocalBinary(" + "list_records" + "," + l_local_db_file + "," + l_outputfilename + "," + str(l_input_mode) + ")")
     result= False #True if at least one password is found
-    local_result = False
     total_records = len(list_records)
     true_records  = 0
-    total_scanned_lines = 0
 
     loc_stats = pstat.PwnedStats()
 
-    loc_stats.number_of_password_read = 0
-    #for all objects in list_records call isHashPwnedLocalBinary
+    #all hashes are sorted once and the db is read a single time, forward only (merge join)
+    found_hashes, total_scanned_lines = pjoin.mergeJoinSortedDb((current_record.src_hash for current_record in list_records),
+                                                                l_local_db_file, getPrefixIndex(l_local_db_file))
     for current_record in list_records:
-        loc_stats.number_of_password_read = loc_stats.number_of_password_read +1
-        local_result = isHashPwnedLocalBinary(current_record.src_hash, l_local_db_file)
-        total_scanned_lines += loc_stats.scanned_lines_in_db
-        result = result or local_result
-        if (local_result):
+        current_record.ispwned = current_record.src_hash in found_hashes
+        if current_record.ispwned:
+            result = True
             true_records = true_records + 1
-
-            current_record.ispwned=True
-            print("\n" + current_record.found_filename + "(" + str(current_record.found_linenumber) + ") -" +
+            print(current_record.found_filename + "(" + str(current_record.found_linenumber) + ") -" +
             current_record.src_password + " -" + current_record.src_hash + " FOUND" +
-            " in file " + l_local_db_file + " - " + str(total_records-true_records) + " pwds to check...")
+            " in file " + l_local_db_file)
+
+    loc_stats.add(number_of_password_read=total_records, pwned_passwords_found=true_records,
+                  safe_passwords_found=total_records - true_records, scanned_lines_in_db=total_scanned_lines)
+    writeListOfRecords(l_outputfilename, list_records)
+    return result
+
+
+#same as isHashListPwnedLocalBinary for inputs bigger than one chunk: the hashes are spilled to disk in sorted runs
+#merged back during the (single) db pass. The hashes found are kept in a temporary packed db and the input is read
+#again, chunk by chunk, to write the results. Hashes ruled out by l_filter (bloom filter, may be None) are not joined.
+def isHashStreamPwnedLocalBinary(l_records_source, l_local_db_file, l_outputfilename, l_input_mode, l_chunk_size=SCAN_CHUNK_SIZE, l_filter=None, l_hot_tier=None):
+    debugLog("isHashStreamPwnedLocalBinary(" + "l_records_source" + "," + l_local_db_file + "," + l_outputfilename + "," + str(l_input_mode) + "," + str(l_chunk_size) + ")")
+    chunks = iterRecordChunks(l_records_source(), l_chunk_size)
+    first_chunk  = next(chunks, [])
+    second_chunk = next(chunks, None)
+    if second_chunk is None:
+        records_to_check = selectRecordsNotSurelySafe(selectRecordsNotHot(first_chunk, l_hot_tier, l_outputfilename), l_filter, l_outputfilename)
+        return checkRecordsOnce(records_to_check, lambda list_records, outputfilename: isHashListPwnedLocalBinary(list_records, l_local_db_file, outputfilename, l_input_mode),
+                                l_outputfilename)
+
+    result= False #True if at least one password is found
+    loc_stats = pstat.PwnedStats()
+
+    with tempfile.TemporaryDirectory(prefix="pwned_") as work_dir:
+        all_hashes = (current_record.src_hash for list_records in itertools.chain([first_chunk, second_chunk], chunks) for current_record in list_records
+                      if not isRecordHot(current_record, l_hot_tier) and not isRecordSurelySafe(current_record, l_filter))
+        first_chunk = second_chunk = None
+        run_files = pjoin.spillSortedRuns(all_hashes, l_chunk_size, work_dir)
+        debugLog("isHashStreamPwnedLocalBinary: input spilled to " + str(len(run_files)) + " sorted runs in " + work_dir)
+
+        def iterCountedTargets():
+            #the merged runs hold each distinct hash once
+            for target in pjoin.iterMergedRuns(run_files):
+                loc_stats.add(unique_passwords_checked=1)
+                yield target
+
+        found_text_file = os.path.join(work_dir, "found.txt")
+        with open(found_text_file, "wb") as found_file, pmetrics.getRegistry().stage(pmetrics.STAGE_LOOKUP):
+            total_scanned_lines = pjoin.joinSortedTargets(iterCountedTargets(), l_local_db_file, getPrefixIndex(l_local_db_file),
+                                                          lambda target: found_file.write(target + b"\n"))
+        for run_filename in run_files:
+            os.remove(run_filename)
+
+        def iterFoundDigests():
+            with open(found_text_file, "rb") as found_file:
+                for the_line in found_file:
+                    try:
+                        yield bytes.fromhex(the_line.strip().decode("ascii")), 1
+                    except ValueError:
+                        pass
+        found_db_file = os.path.join(work_dir, "found.bin")
+        pbindb.writePackedDb(found_db_file, iterFoundDigests())
+
+        with pbindb.PackedHashDB(found_db_file) as found_db:
+            for list_records in iterRecordChunks(l_records_source(), l_chunk_size):
+                true_records = 0
+                for current_record in list_records:
+                    current_record.ispwned = isInHotTier(current_record, l_hot_tier) or found_db.lookup_hex(current_record.src_hash)
+                    if current_record.ispwned:
+                        result = True
+                        true_records = true_records + 1
+                        print(current_record.found_filename + "(" + str(current_record.found_linenumber) + ") -" +
+                        current_record.src_password + " -" + current_record.src_hash + " FOUND" +
+                        " in file " + l_local_db_file)
+                writeListOfRecords(l_outputfilename, list_records)
+                loc_stats.add(number_of_password_read=len(list_records), pwned_passwords_found=true_records,
+                              safe_passwords_found=len(list_records) - true_records)
+
+    loc_stats.add(scanned_lines_in_db=total_scanned_lines)
+    return result
+
+
+def isInHotTier(l_record, l_hot_tier):
+    """ membership of the record in l_hot_tier (may be None), not counted: same answer as isRecordHot """
+    if l_hot_tier is None:
+        return False
+    if l_record.src_digest is not None:
+        return l_record.src_digest in l_hot_tier
+    return phot.digestOfHex(l_record.src_hash) in l_hot_tier
+
+
+def isHashPwnedLocalPacked(l_hash, l_local_db_file):
+    debugLog("isHashPwnedLocalPacked(" + l_hash + "," + l_local_db_file + ")")
+
+    with pbindb.PackedHashDB(l_local_db_file) as packed_db:
+        result = isHashInHashDb(l_hash, packed_db)
+
+    if result:
+        print(l_hash + " FOUND in packed db " + l_local_db_file)
+    return result
+
+
+def isHashPwnedLocalBlocks(l_hash, l_local_db_file):
+    debugLog("isHashPwnedLocalBlocks(" + l_hash + "," + l_local_db_file + ")")
+
+    with pblockdb.BlockHashDB(l_local_db_file) as block_db:
+        result = isHashInHashDb(l_hash, block_db)
+
+    if result:
+        print(l_hash + " FOUND in block compressed db " + l_local_db_file)
+    return result
+
+
+def isHashInHashDb(l_hash, the_db):
+    """ single lookup in an opened packed (pwned_bindb.py) or block compressed (pwned_blockdb.py) db """
+    result = the_db.lookup_hex(l_hash)
+    countSingleLookup(result, the_db.probes)
+    return result
+
+
+#same as isHashListPwnedLocalBinary but the packed db is opened (and mapped) only once for all records
+def isHashListPwnedLocalPacked(list_records, l_local_db_file, l_outputfilename, l_input_mode):
+    debugLog("isHashListPwnedLocalPacked(" + "list_records" + "," + l_local_db_file + "," + l_outputfilename + "," + str(l_input_mode) + ")")
+    with pbindb.PackedHashDB(l_local_db_file) as packed_db:
+        return isHashListInHashDb(list_records, packed_db, l_local_db_file, l_outputfilename)
+
+
+def isHashListPwnedLocalBlocks(list_records, l_local_db_file, l_outputfilename):
+    debugLog("isHashListPwnedLocalBlocks(" + "list_records" + "," + l_local_db_file + "," + l_outputfilename + ")")
+    with pblockdb.BlockHashDB(l_local_db_file) as block_db:
+        return isHashListInHashDb(list_records, block_db, l_local_db_file, l_outputfilename)
+
+
+def isHashListInHashDb(list_records, the_db, l_local_db_file, l_outputfilename):
+    """ check the records against an opened packed or block compressed db, one lookup each """
+    result= False #True if at least one password is found
+    total_records = len(list_records)
+    true_records  = 0
+
+    loc_stats = pstat.PwnedStats()
+
+    probes_per_lookup = collections.Counter()
+    for current_record in list_records:
+        probes_before = the_db.probes
+        if current_record.src_digest is not None:
+            current_record.ispwned = the_db.find(current_record.src_digest) >= 0
         else:
-            loc_stats.safe_passwords_found = loc_stats.safe_passwords_found + 1
-            current_record.ispwned=False
+            current_record.ispwned = the_db.lookup_hex(current_record.src_hash)
+        probes_per_lookup[the_db.probes - probes_before] += 1
+        if current_record.ispwned:
+            result = True
+            true_records = true_records + 1
+            print(current_record.found_filename + "(" + str(current_record.found_linenumber) + ") -" +
+            current_record.src_password + " -" + current_record.src_hash + " FOUND" +
+            " in file " + l_local_db_file)
+    getDbProbesHistogram().observe_counts(probes_per_lookup)
 
-    loc_stats.number_of_password_read = total_records
-    loc_stats.pwned_passwords_found   = true_records
-    loc_stats.safe_passwords_found    = loc_stats.number_of_password_read - loc_stats.pwned_passwords_found
-    loc_stats.scanned_lines_in_db     = total_scanned_lines
+    loc_stats.add(number_of_password_read=total_records, pwned_passwords_found=true_records,
+                  safe_passwords_found=total_records - true_records, scanned_lines_in_db=the_db.probes)
     writeListOfRecords(l_outputfilename, list_records)
     return result
 
 
+def buildPackedDb(l_local_db_file, l_local_zip_file, l_packed_db_file):
+    debugLog("buildPackedDb(" + l_local_db_file + "," + l_local_zip_file + "," + l_packed_db_file + ")")
+    print("Converting " + l_local_db_file + ((" inside " + l_local_zip_file) if l_local_zip_file else "") + " to packed db " + l_packed_db_file + "...")
+    try:
+        number_of_records = pbindb.buildPackedDb(l_local_db_file, l_packed_db_file, l_local_zip_file)
+    except (pbindb.PackedDBError, OSError) as e:
+        alwaysLog("ERROR: cannot build packed db: " + str(e) + ". Exiting...")
+        sys.exit(ERR_OTHERS)
+    print(f"Packed db {l_packed_db_file} written with {number_of_records:,} hashes")
+    pstat.PwnedStats().scanned_lines_in_db = number_of_records
+    return number_of_records
+
+
+def sortDb(l_local_db_file, l_local_zip_file, l_sorted_db_file, l_workers=1, l_run_mb=psort.SORT_DEFAULT_RUN_MB, l_index_bits=0):
+    """ external merge sort of the db into l_sorted_db_file (see --sort_db), with its index if l_index_bits is not 0 """
+    debugLog("sortDb(" + l_local_db_file + "," + l_local_zip_file + "," + l_sorted_db_file + "," + str(l_workers) + "," + str(l_run_mb) + "," + str(l_index_bits) + ")")
+    print("Sorting " + l_local_db_file + ((" inside " + l_local_zip_file) if l_local_zip_file else "") + " into " + l_sorted_db_file +
+          " (" + str(l_workers) + " worker(s), " + str(l_run_mb) + " MB runs)...")
+    try:
+        summary = psort.sortDb(l_local_db_file, l_sorted_db_file, l_local_zip_file, l_workers, l_run_mb, l_index_bits)
+    except (psort.SortError, pbindb.PackedDBError, pidx.PrefixIndexError, OSError, ValueError) as e:
+        alwaysLog("ERROR: cannot sort the db: " + str(e) + ". Exiting...")
+        sys.exit(ERR_OTHERS)
+    pstat.PwnedStats().scanned_lines_in_db = summary.lines_read
+    print(f"Sorted db {l_sorted_db_file} written and verified: {summary.hashes_written:,} hashes ({summary.duplicates_merged:,} repeated hashes merged,"
+          f" {summary.invalid_lines:,} invalid lines skipped) from {summary.runs:,} runs in {summary.merge_passes} merge pass(es)")
+    if summary.input_sorted:
+        print("The input was already sorted")
+    if summary.index_filename:
+        print("Index written to " + summary.index_filename + ". It will be used automatically with -b")
+    return summary
+
+
+def buildBlockDb(l_local_db_file, l_local_zip_file, l_block_db_file, l_records_per_block=pblockdb.BLOCK_DEFAULT_RECORDS, l_workers=1):
+    debugLog("buildBlockDb(" + l_local_db_file + "," + l_local_zip_file + "," + l_block_db_file + "," + str(l_records_per_block) + ")")
+    print("Converting " + l_local_db_file + ((" inside " + l_local_zip_file) if l_local_zip_file else "") + " to block compressed db " + l_block_db_file + "...")
+    try:
+        number_of_records = pblockdb.buildBlockDb(l_local_db_file, l_block_db_file, l_local_zip_file, l_records_per_block, pblockdb.BLOCK_DEFAULT_LEVEL, l_workers)
+    except (pblockdb.BlockDBError, pbindb.PackedDBError, psort.SortError, OSError) as e:
+        alwaysLog("ERROR: cannot build block compressed db: " + str(e) + ". Exiting...")
+        sys.exit(ERR_OTHERS)
+    print(f"Block compressed db {l_block_db_file} written with {number_of_records:,} hashes ({os.path.getsize(l_block_db_file):,} bytes)")
+    pstat.PwnedStats().scanned_lines_in_db = number_of_records
+    return number_of_records
+
+
+def buildPrefixIndex(l_local_db_file, l_prefix_bits):
+    debugLog("buildPrefixIndex(" + l_local_db_file + "," + str(l_prefix_bits) + ")")
+    print("Building " + str(l_prefix_bits) + " bits prefix index of " + l_local_db_file + "...")
+    try:
+        index_filename = pidx.buildIndex(l_local_db_file, l_prefix_bits)
+    except (pidx.PrefixIndexError, ValueError, OSError) as e:
+        alwaysLog("ERROR: cannot build the index: " + str(e) + ". Is " + l_local_db_file + " sorted? Exiting...")
+        sys.exit(ERR_OTHERS)
+    print("Index written to " + index_filename + ". It will be used automatically with -b")
+    return index_filename
+
+
+def updateSortedDb(l_local_db_file, l_delta_file, l_out_file=""):
+    """ merge l_delta_file into the sorted db (see --update_db), written to l_out_file (default: replace l_local_db_file),
+        and patch the sidecars instead of rebuilding them
+    """
+    debugLog("updateSortedDb(" + l_local_db_file + "," + l_delta_file + "," + l_out_file + ")")
+    out_file = l_out_file or l_local_db_file
+    print("Updating " + l_local_db_file + " with " + l_delta_file + ((" into " + out_file) if out_file != l_local_db_file else "") + "...")
+    old_db_size = os.path.getsize(l_local_db_file)
+    the_index = getPrefixIndex(l_local_db_file)
+    index_filename = the_index.index_filename if the_index is not None else ""
+
+    #new hashes go straight in the filter: its bits are only ever set, so it stays valid for the old db if anything fails
+    filter_patcher = None
+    if os.path.isfile(pfilter.filterFilenameFor(l_local_db_file)):
+        try:
+            filter_patcher = pfilter.BloomFilterPatcher(pfilter.filterFilenameFor(l_local_db_file), old_db_size, pfilter.filterFilenameFor(out_file))
+        except (pfilter.BloomFilterError, OSError) as e:
+            alwaysLog("WARNING: the bloom filter will not be updated (rebuild it with --build_filter): " + str(e))
+    on_added = filter_patcher.add if filter_patcher is not None else None
+    filter_count_before = filter_patcher.count if filter_patcher is not None else 0
+
+    temp_file = out_file + ".tmp"
+    try:
+        try:
+            summary = pupdate.mergeDelta(l_local_db_file, pupdate.iterDeltaRecords(l_delta_file), temp_file, the_index, on_added)
+        except pupdate.DeltaNotSortedError:
+            debugLog(l_delta_file + " is not sorted: sorting it in memory")
+            if filter_patcher is not None:
+                #the hashes added by the aborted pass are added again: their bits are already set, only the count must not grow twice
+                filter_patcher.count = filter_count_before
+            summary = pupdate.mergeDelta(l_local_db_file, pupdate.sortedDeltaRecords(l_delta_file), temp_file, the_index, on_added)
+        pidx.closeIndexes()
+        pfilter.closeFilters()
+        os.replace(temp_file, out_file)
+    except (pupdate.UpdateError, OSError) as e:
+        if filter_patcher is not None:
+            filter_patcher.abort()
+        if os.path.isfile(temp_file):
+            os.remove(temp_file)
+        alwaysLog("ERROR: cannot update the db: " + str(e) + ". Exiting...")
+        sys.exit(ERR_OTHERS)
+    new_db_size = os.path.getsize(out_file)
+
+    if index_filename:
+        try:
+            pidx.patchIndex(index_filename, summary.bytes_by_prefix, old_db_size, new_db_size, pidx.indexFilenameFor(out_file))
+        except (pidx.PrefixIndexError, OSError) as e:
+            alwaysLog("WARNING: the index was not updated (rebuild it with --build_index): " + str(e))
+    if filter_patcher is not None:
+        filter_patcher.close(new_db_size)
+    if os.path.isfile(phot.hotTierFilenameFor(l_local_db_file)):
+        #a new release never removes hashes: the hot tier is still correct for the new db
+        try:
+            phot.restampHotTier(phot.hotTierFilenameFor(l_local_db_file), new_db_size, phot.hotTierFilenameFor(out_file))
+        except (phot.HotTierError, OSError) as e:
+            alwaysLog("WARNING: the hot tier was not updated (rebuild it with --build_hot_tier): " + str(e))
+    changelog_filename = pupdate.appendChangelog(out_file, l_delta_file, summary)
+
+    pstat.PwnedStats().scanned_lines_in_db = summary.lines_read
+    print(f"{out_file} updated: {summary.added:,} hashes added, {summary.updated:,} counts updated, {summary.unchanged:,} unchanged")
+    print("Changed prefixes appended to " + changelog_filename)
+    if filter_patcher is not None:
+        print(f"Bloom filter updated: now about {filter_patcher.estimated_fp_rate():.2%} false positives")
+    return summary
+
+
+def groupRecordsByHash(list_records):
+    """ dictionary hash -> list of the records (same password may be in the input more than once) with that hash """
+    records_by_hash = {}
+    for current_record in list_records:
+        records_by_hash.setdefault(current_record.src_hash, []).append(current_record)
+    return records_by_hash
+
+
 def isHashListPwnedLocal(list_records, l_local_db_file, l_outputfilename, l_input_mode):
     debugLog("isHashListPwnedLocal(" + "list_records" + "," + l_local_db_file + "," + l_outputfilename + "," + str(l_input_mode) + ")")
     result= False #True if at least one password is found
@@ -594,137 +1512,230 @@ def isHashListPwnedLocal(list_records, l_local_db_file, l_outputfilename, l_inpu
     true_records  = 0
     loc_stats = pstat.PwnedStats()    
 
+    #each db line is parsed once and probed once in the dictionary, whatever the number of records
+    records_to_find = groupRecordsByHash(current_record for current_record in list_records if not current_record.ispwned)
+    true_records = total_records - sum(len(same_hash_records) for same_hash_records in records_to_find.values())
+
     with open(l_local_db_file, 'r', encoding='utf-8') as read_obj:
         for the_line in read_obj:
+            if not records_to_find:
+                debugLog("isHashListPwnedLocal: exit and return... no more passwords to check. Total scanned lines: " + str(line_number))
+                break
             line_number = line_number + 1
-            for current_record in list_records:
-                if (true_records < total_records):
-                    if current_record.ispwned is False:
-                        line_hash = the_line.strip().split(":")[0]
-                        if (current_record.src_hash == line_hash):
-                            result=result or True
-                            true_records = true_records + 1
-                            current_record.ispwned = True
-                            print("\n", end="")
-                            print(current_record.found_filename, end="")
-                            print("(" + str(current_record.found_linenumber) + ") -", end="")
-                            print(current_record.src_password, end="")
-                            print(" -" + current_record.src_hash + " FOUND on line " + str(line_number), end="")
-                            print(" of file " + l_local_db_file + " - " + str(total_records-true_records) + " pwds to check...")
+            found_records = records_to_find.pop(the_line.split(":", 1)[0].strip(), None)
+            if found_records is not None:
+                result = True
+                true_records = true_records + len(found_records)
+                for current_record in found_records:
+                    current_record.ispwned = True
+                    print("\n", end="")
+                    print(current_record.found_filename, end="")
+                    print("(" + str(current_record.found_linenumber) + ") -", end="")
+                    print(current_record.src_password, end="")
+                    print(" -" + current_record.src_hash + " FOUND on line " + str(line_number), end="")
+                    print(" of file " + l_local_db_file + " - " + str(total_records-true_records) + " pwds to check...")
 
-                else:
-                    debugLog("isHashListPwnedLocal: exit and return... no more passwords to check. Total scanned lines: " + str(line_number))
-                    writeListOfRecords(l_outputfilename, list_records)
-                    loc_stats.number_of_password_read = total_records
-                    loc_stats.pwned_passwords_found   = true_records
-                    loc_stats.safe_passwords_found    = loc_stats.number_of_password_read - loc_stats.pwned_passwords_found
-                    loc_stats.scanned_lines_in_db     = line_number #if local db option used
-                    return
             if (line_number % 100000) == 0:
                 #last_digit = (last_digit+1) % 10
                 #print(str(last_digit), end='', flush= True)
                 print("Scanned lines:", "{:,}".format(line_number), end="\r") 
-        print("isHashListPwnedLocal - All passwords checked. Total scanned lines: " + str(line_number))
+        else:
+            print("isHashListPwnedLocal - All passwords checked. Total scanned lines: " + str(line_number))
     writeListOfRecords(l_outputfilename, list_records)
-    loc_stats.number_of_password_read = total_records
-    loc_stats.pwned_passwords_found   = true_records
-    loc_stats.safe_passwords_found    = loc_stats.number_of_password_read - loc_stats.pwned_passwords_found
-    loc_stats.scanned_lines_in_db     = line_number #if local db option used
+    loc_stats.add(number_of_password_read=total_records, pwned_passwords_found=true_records,
+                  safe_passwords_found=total_records - true_records, scanned_lines_in_db=line_number)   #if local db option used
     return result
 
-_mt_lock = threading.Lock()
-
-def checkListAgainstLineMT(list_records, l_line, thread_name, found_counter):
-    debugLog("checkListAgainstLineMT(" + "list_records" + "," + l_line+ "," + thread_name)
-
-    l_line_hash = l_line.strip().split(":")[0]
-    for current_record in list_records:
-        with _mt_lock:
-            already_found = current_record.ispwned
-        if not already_found:
-            if (current_record.src_hash == l_line_hash):
-                with _mt_lock:
-                    current_record.ispwned = True
-                    found_counter.append(1)
-                print("\n" + thread_name + ": " + current_record.found_filename + "(" + str(current_record.found_linenumber) + ") -"
-                    + current_record.src_password + " -" + current_record.src_hash + " FOUND")
-
-#Same as before but multi-threaded
-# NOTE: This spawns one thread per DB line which is very resource-intensive for large files.
-# Consider using a thread pool (concurrent.futures.ThreadPoolExecutor) for production use.
-def isHashListPwnedLocalMT(list_records, l_local_db_file, l_outputfilename, l_input_mode):
-    debugLog("isHashListPwnedLocalMT(" + "list_records" + "," + l_local_db_file + "," + l_outputfilename + "," + str(l_input_mode) + ")")
-    line_number=0
-
+#Same as isHashListPwnedLocal but the db is split in l_workers ranges scanned by as many processes (see pwned_parallel.py)
+def isHashListPwnedLocalMT(list_records, l_local_db_file, l_outputfilename, l_input_mode, l_workers=os.cpu_count()):
+    debugLog("isHashListPwnedLocalMT(" + "list_records" + "," + l_local_db_file + "," + l_outputfilename + "," + str(l_input_mode) + "," + str(l_workers) + ")")
+    result= False #True if at least one password is found
     total_records = len(list_records)
-    found_counter = []  # thread-safe list to count found records
-    list_of_threads = []
+    true_records  = 0
     loc_stats = pstat.PwnedStats()
 
-    with open(l_local_db_file, 'r', encoding='utf-8') as read_obj:
-        for the_line in read_obj:
-            line_number = line_number + 1
-            t = threading.Thread(target=checkListAgainstLineMT, args=(list_records, the_line, str(line_number), found_counter))
-            t.start()
-            list_of_threads.append(t)
-
-            if (line_number % 100000) == 0:
-                print("Scanned lines:", "{:,}".format(line_number), end="\r")
-
-        for ttt in list_of_threads:
-            ttt.join()
-
-        print("isHashListPwnedLocalMT - All passwords checked. Total scanned lines: " + str(line_number))
+    found_hashes, line_number = pparallel.scanDbParallel((current_record.src_hash for current_record in list_records), l_local_db_file, l_workers)
+    for current_record in list_records:
+        current_record.ispwned = current_record.src_hash in found_hashes
+        if current_record.ispwned:
+            result = True
+            true_records = true_records + 1
+            print(current_record.found_filename + "(" + str(current_record.found_linenumber) + ") -" +
+            current_record.src_password + " -" + current_record.src_hash + " FOUND" +
+            " in file " + l_local_db_file)
+    print("isHashListPwnedLocalMT - All passwords checked by " + str(l_workers) + " workers. Total scanned lines: " + str(line_number))
 
-    true_records = len(found_counter)
     writeListOfRecords(l_outputfilename, list_records)
-    loc_stats.number_of_password_read = total_records
-    loc_stats.pwned_passwords_found   = true_records
-    loc_stats.safe_passwords_found    = loc_stats.number_of_password_read - loc_stats.pwned_passwords_found
-    loc_stats.scanned_lines_in_db     = line_number #if local db option used
-    return true_records > 0
+    loc_stats.add(number_of_password_read=total_records, pwned_passwords_found=true_records,
+                  safe_passwords_found=total_records - true_records, scanned_lines_in_db=line_number)   #if local db option used
+    return result
 
 def isHashPwnedRemote(l_hash):
     return isHashPwnedRemoteWithPwd(l_hash, "test_pwd") 
 
+_range_client = None
+_range_cache  = None
+#connections, delay_secs, max_rate and max_retries of _range_client
+DEFAULT_RANGE_CLIENT_SETTINGS = (pweb.DEFAULT_CONNECTIONS, 0, pratelimit.DEFAULT_MAX_RATE, pratelimit.DEFAULT_MAX_RETRIES)
+_range_client_settings = DEFAULT_RANGE_CLIENT_SETTINGS
+
+def openRangeCache(l_cache_file, l_ttl_hours=pcache.DEFAULT_CACHE_TTL_HOURS, l_max_size_mb=pcache.DEFAULT_CACHE_SIZE_MB):
+    """ from now on the web api responses are kept in (and read from) l_cache_file """
+    global _range_cache
+    debugLog("openRangeCache(" + l_cache_file + "," + str(l_ttl_hours) + "," + str(l_max_size_mb) + ")")
+    _range_cache = pcache.RangeCache(l_cache_file, l_ttl_hours, l_max_size_mb)
+    return _range_cache
+
+
+def getRangeClient(l_connections=None, l_delay_secs=None, l_max_rate=None, l_max_retries=None):
+    """ the web api client shared by all the requests of the run (keeps its connections open). Parameters left to None keep
+        the ones of the current client (or the defaults); asking for other ones replaces the client, keeping its --cache """
+    global _range_client, _range_client_settings
+    settings = tuple(current if wanted is None else wanted
+                     for wanted, current in zip((l_connections, l_delay_secs, l_max_rate, l_max_retries), _range_client_settings))
+    if (_range_client is not None) and (settings != _range_client_settings):
+        debugLog("getRangeClient: new client for " + str(settings))
+        pstat.PwnedStats().add(web_requests_retried=_range_client.retries)
+        _range_client.cache = None   #still used by the new client
+        _range_client.close()
+        _range_client = None
+    if _range_client is None:
+        _range_client = pweb.RangeClient(BASE_PWD_SEARCH_URL, settings[0], pstat.PwnedStats().SSL_CHECK, settings[1], _range_cache,
+                                         settings[2], settings[3])
+        _range_client_settings = settings
+    return _range_client
+
+
+def setRangeApiUrl(l_url):
+    """ from now on the web mode queries the range api at l_url (see pweb.normalizeApiUrl). Raises ValueError on a bad url """
+    global BASE_PWD_SEARCH_URL
+    BASE_PWD_SEARCH_URL = pweb.normalizeApiUrl(l_url)
+    debugLog("setRangeApiUrl(" + l_url + "): " + BASE_PWD_SEARCH_URL)
+    if _range_client is not None:
+        _range_client.base_url = BASE_PWD_SEARCH_URL
+    return BASE_PWD_SEARCH_URL
+
+
+def closeRangeClient():
+    global _range_client, _range_cache, _range_client_settings
+    loc_stats = pstat.PwnedStats()
+    if _range_cache is not None:
+        loc_stats.range_cache_hits   = _range_cache.hits
+        loc_stats.range_cache_misses = _range_cache.misses
+    if _range_client is not None:
+        loc_stats.add(web_requests_retried=_range_client.retries)
+        _range_client.close()
+    elif _range_cache is not None:
+        _range_cache.close()
+    _range_client = None
+    _range_cache  = None
+    _range_client_settings = DEFAULT_RANGE_CLIENT_SETTINGS
+
+
 def isHashPwnedRemoteWithPwd(l_hash, l_password):
     debugLog("isHashPwnedRemote(" + l_hash + ")")
     result = False
-    the_hashed_prefix = l_hash[0:(HASH_PREFIX_LENGTH)]
-    the_hashed_suffix = l_hash[HASH_PREFIX_LENGTH:len(l_hash)]
+    the_hashed_prefix, the_hashed_suffix = pweb.splitHash(l_hash, HASH_PREFIX_LENGTH)
     loc_stats = pstat.PwnedStats()
 
-    final_url = BASE_PWD_SEARCH_URL + the_hashed_prefix
-
     #WARNING_ verify=false added only on this local copy to avoid checking ssl certificate
-    response = requests.get(final_url, timeout=10, verify=loc_stats.SSL_CHECK)
+    range_result = getRangeClient().fetch_range(the_hashed_prefix)
 
-    if response.status_code == 200:
+    if range_result.is_valid():
         print('Web service returned success status 200')
-        #debugLog(response.text + "\n")
-        if (the_hashed_suffix in response.text):
+        if (the_hashed_suffix in range_result.suffixes):
             print(l_password + " (Hash = " + l_hash + ") FOUND! This password is PWNED")
             result = True
-            loc_stats.pwned_passwords_found    = loc_stats.pwned_passwords_found + 1
+            loc_stats.add(number_of_password_read=1, pwned_passwords_found=1)
         else:
             print(l_password + " (Hash = " + l_hash + ") NOT FOUND! This password is SAFE")
             result = False
-            loc_stats.safe_passwords_found    = loc_stats.safe_passwords_found + 1 
-    elif response.status_code == 404:
-        print('ERROR 404 - Page not Found.')
-        loc_stats.safe_passwords_invalid = loc_stats.safe_passwords_invalid+1
-    elif response.status_code == 429:
-        print('ERROR 429 - rate limit exceeded. No Retry')
-        loc_stats.safe_passwords_invalid = loc_stats.safe_passwords_invalid+1
-    elif response.status_code == 400:
-        print('ERROR 400 - The hash prefix was not valid hexadecimal')
-        loc_stats.safe_passwords_invalid = loc_stats.safe_passwords_invalid+1
+            loc_stats.add(number_of_password_read=1, safe_passwords_found=1)
     else:
-        print('ERROR Unknown: ' + str(response.status_code) + ' ' + response.text)
+        print(range_result.message)
+        loc_stats.add(number_of_password_read=1, safe_passwords_invalid=1)
     
     return result
 
 
+#batch version of isHashPwnedRemoteWithPwd: each distinct prefix is downloaded once, l_connections requests at a time
+def isHashListPwnedRemote(list_records, l_outputfilename, l_connections=pweb.DEFAULT_CONNECTIONS, l_delay_secs=0):
+    debugLog("isHashListPwnedRemote(" + "list_records" + "," + l_outputfilename + "," + str(l_connections) + "," + str(l_delay_secs) + ")")
+    result = checkRecordsByRange(list_records, getRangeClient(l_connections, l_delay_secs))
+    writeListOfRecords(l_outputfilename, list_records)
+    return result
+
+
+def checkRecordsByRange(list_records, l_range_source):
+    """ group the records by prefix and check each group against its range, l_range_source.fetch_ranges (web client
+        or range files) gives each distinct range once. Sets ispwned and counts; True if at least one password is found
+    """
+    result= False #True if at least one password is found
+    loc_stats = pstat.PwnedStats()
+
+    records_by_prefix = {}
+    for current_record in list_records:
+        the_hashed_prefix = pweb.splitHash(current_record.src_hash, HASH_PREFIX_LENGTH)[0]
+        records_by_prefix.setdefault(the_hashed_prefix, []).append(current_record)
+    debugLog("checkRecordsByRange: " + str(len(list_records)) + " passwords in " + str(len(records_by_prefix)) + " distinct ranges")
+
+    def checkRange(range_result):
+        nonlocal result
+        for current_record in records_by_prefix[range_result.prefix]:
+            if not range_result.is_valid():
+                current_record.ispwned = False
+                print(current_record.src_password + " (Hash = " + current_record.src_hash + ") " + range_result.message)
+                loc_stats.add(safe_passwords_invalid=1)
+            elif pweb.splitHash(current_record.src_hash, HASH_PREFIX_LENGTH)[1] in range_result.suffixes:
+                current_record.ispwned = True
+                result = True
+                print(current_record.src_password + " (Hash = " + current_record.src_hash + ") FOUND! This password is PWNED")
+                loc_stats.add(pwned_passwords_found=1)
+            else:
+                current_record.ispwned = False
+                print(current_record.src_password + " (Hash = " + current_record.src_hash + ") NOT FOUND! This password is SAFE")
+                loc_stats.add(safe_passwords_found=1)
+
+    loc_stats.add(number_of_password_read=len(list_records))
+    l_range_source.fetch_ranges(records_by_prefix.keys(), checkRange)
+    return result
+
+
+def warnMissingRanges(l_range_directory, l_missing_before):
+    if l_range_directory.missing_files > l_missing_before:
+        alwaysLog("WARNING: " + str(l_range_directory.missing_files - l_missing_before) + " range files not found in " + l_range_directory.path +
+                  ": their hashes are reported as NOT pwned. Is the directory complete?")
+
+
+def isHashPwnedLocalRanges(l_hash, l_range_dir):
+    debugLog("isHashPwnedLocalRanges(" + l_hash + "," + l_range_dir + ")")
+    the_hashed_prefix, the_hashed_suffix = pweb.splitHash(l_hash, HASH_PREFIX_LENGTH)
+    the_directory = pranges.getRangeDirectoryFor(l_range_dir)
+    missing_before = the_directory.missing_files
+    range_result = the_directory.fetch_range(the_hashed_prefix)
+    warnMissingRanges(the_directory, missing_before)
+    if not range_result.is_valid():
+        print(range_result.message)
+        pstat.PwnedStats().add(number_of_password_read=1, safe_passwords_invalid=1)
+        return False
+    result = the_hashed_suffix in range_result.suffixes
+    countSingleLookup(result, len(range_result.suffixes))
+    if result:
+        print(l_hash + " FOUND in range " + the_hashed_prefix + " of " + l_range_dir)
+    return result
+
+
+#same as isHashListPwnedRemote on the range files of l_range_dir: each distinct range file is read once
+def isHashListPwnedLocalRanges(list_records, l_range_dir, l_outputfilename):
+    debugLog("isHashListPwnedLocalRanges(" + "list_records" + "," + l_range_dir + "," + l_outputfilename + ")")
+    the_directory = pranges.getRangeDirectoryFor(l_range_dir)
+    lines_before, missing_before = the_directory.lines_read, the_directory.missing_files
+    result = checkRecordsByRange(list_records, the_directory)
+    warnMissingRanges(the_directory, missing_before)
+    pstat.PwnedStats().add(scanned_lines_in_db=the_directory.lines_read - lines_before)
+    writeListOfRecords(l_outputfilename, list_records)
+    return result
+
 
 def isPasswordPwned(password_to_check):
     result = False
@@ -737,6 +1748,7 @@ def isPasswordPwned(password_to_check):
 
     final_url: str = BASE_PWD_SEARCH_URL + the_hashed_prefix
 
+    import requests
     response: requests.Response = requests.get(final_url, timeout=5)
         
     if response.status_code == 200:
@@ -756,216 +1768,781 @@ def isPasswordPwned(password_to_check):
     return result
 
 
+class PwnedChecker:
+    """ Library entry point: checks passwords or SHA1 hashes against one db (any DB_* mode) keeping it open
+        (file handle, prefix index, packed db mapping or web session) across the calls.
+
+            import pwned
+            with pwned.PwnedChecker(pwned.DB_LOCAL_SORTED, "pwned-passwords-sha1-ordered.txt") as checker:
+                if checker.is_password_pwned("password123"):
+                    ...
+
+        Single checks (is_hash_pwned, is_password_pwned) are thread safe: the local lookups and their counters run under
+        one lock, the web ones run concurrently. Checks on the sorted (-b), packed (-m, -c), range (-r) and web dbs print nothing.
+        Batches (check_records) use the same engines as -f/-t. Raises FileNotFoundError if the local db (or zip) does not exist.
+    """
+
+    def __init__(self, db_mode=DB_WEB, local_db_file="", local_zip_file="", zip_sorted=False, workers=1,
+                 connections=pweb.DEFAULT_CONNECTIONS, delay_secs=0):
+        self.db_mode = db_mode
+        self.local_db_file = local_db_file
+        self.local_zip_file = local_zip_file
+        self.zip_sorted = zip_sorted
+        self.workers = workers
+        self.connections = connections
+        self.delay_secs = delay_secs
+        self._db_file = None      #DB_LOCAL_SORTED without index
+        self._index = None        #DB_LOCAL_SORTED with index
+        self._packed_db = None    #DB_LOCAL_PACKED and DB_LOCAL_BLOCKS (same lookups)
+        self._range_client = None #DB_WEB
+        self._ranges = None       #DB_LOCAL_RANGES
+        self._filter = None       #sidecar bloom filter, any local db
+        self._hot_tier = None     #sidecar hot tier, any local db
+        self._lock = threading.Lock()   #the local lookups seek a shared handle or count probes on a shared db
+
+        if db_mode == DB_LOCAL_ZIP:
+            if not os.path.isfile(local_zip_file):
+                raise FileNotFoundError(local_zip_file)
+        elif db_mode == DB_LOCAL_RANGES:
+            if not os.path.exists(local_db_file):
+                raise FileNotFoundError(local_db_file)
+        elif db_mode != DB_WEB:
+            if not os.path.isfile(local_db_file):
+                raise FileNotFoundError(local_db_file)
+
+        self._filter = getBloomFilter(db_mode, local_db_file, local_zip_file)
+        self._hot_tier = getHotTier(db_mode, local_db_file, local_zip_file)
+        if db_mode == DB_LOCAL_PACKED:
+            self._packed_db = pbindb.PackedHashDB(local_db_file)
+        elif db_mode == DB_LOCAL_BLOCKS:
+            self._packed_db = pblockdb.BlockHashDB(local_db_file)
+        elif db_mode == DB_LOCAL_SORTED:
+            self._index = getPrefixIndex(local_db_file)
+            if self._index is None:
+                self._db_file = open(local_db_file, 'r', encoding='utf-8')
+        elif db_mode == DB_LOCAL_RANGES:
+            self._ranges = pranges.getRangeDirectoryFor(local_db_file)
+        elif db_mode == DB_WEB:
+            self._range_client = getRangeClient(connections, delay_secs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        if self._db_file is not None:
+            self._db_file.close()
+            self._db_file = None
+        if self._packed_db is not None:
+            self._packed_db.close()
+            self._packed_db = None
+        if self._range_client is not None:
+            closeRangeClient()
+            self._range_client = None
+        if self._ranges is not None:
+            pranges.closeRangeDirectories()
+            self._ranges = None
+
+    def is_hash_pwned(self, l_hash:str) -> bool:
+        """ True if the SHA1 hash (40 hex chars) is in the db """
+        l_hash = l_hash.strip().upper()
+        if self._range_client is not None:
+            #not serialized: the range client is thread safe and the checks wait on the network
+            the_hashed_prefix, the_hashed_suffix = pweb.splitHash(l_hash, HASH_PREFIX_LENGTH)
+            range_result = self._range_client.fetch_range(the_hashed_prefix)
+            if not range_result.is_valid():
+                pstat.PwnedStats().add(safe_passwords_invalid=1)
+                raise ConnectionError(range_result.message)
+            result = the_hashed_suffix in range_result.suffixes
+            countSingleLookup(result)
+            return result
+
+        with self._lock:
+            lines_read = None
+            if isHashHot(l_hash, self._hot_tier):
+                result = True
+                lines_read = 0
+            elif isHashSurelySafe(l_hash, self._filter):
+                result = False
+                lines_read = 0
+            elif self._packed_db is not None:
+                probes_before = self._packed_db.probes
+                result = self._packed_db.lookup_hex(l_hash)
+                lines_read = self._packed_db.probes - probes_before
+            elif self._index is not None:
+                reads_before = self._index.reads
+                result = self._index.lookup(l_hash)
+                lines_read = self._index.reads - reads_before
+            elif self._db_file is not None:
+                result, lines_read = binarySearchSortedDb(self._db_file, l_hash)
+            elif self._ranges is not None:
+                the_hashed_prefix, the_hashed_suffix = pweb.splitHash(l_hash, HASH_PREFIX_LENGTH)
+                range_result = self._ranges.fetch_range(the_hashed_prefix)
+                if not range_result.is_valid():
+                    pstat.PwnedStats().add(safe_passwords_invalid=1)
+                    raise FileNotFoundError(range_result.message)
+                result = the_hashed_suffix in range_result.suffixes
+                lines_read = len(range_result.suffixes)
+            elif self.db_mode == DB_LOCAL_ZIP:
+                return isHashPwnedLocalZip(l_hash, self.local_db_file, self.local_zip_file, self.zip_sorted)
+            else:
+                return isHashPwnedLocal(l_hash, self.local_db_file)
+
+        countSingleLookup(result, lines_read)
+        return result
+
+    def is_password_pwned(self, l_password:str) -> bool:
+        return self.is_hash_pwned(hashMeThis(l_password))
+
+    def check_records(self, list_records, l_outputfilename="", l_chunk_size=0):
+        """ check password_record objects (see readTextPasswordFromTextFile, getPasswordList), setting their ispwned """
+        checkRecordStream(lambda: iter(list_records), self.db_mode, self.local_db_file, l_outputfilename, self.delay_secs,
+                          self.workers, self.local_zip_file, self.zip_sorted, self.connections, l_chunk_size)
+        return list_records
+
+
+def serveDb(l_address, l_current_db_mode, l_cli_local_db_file, l_cli_local_zip="", l_zip_sorted=False, l_connections=pweb.DEFAULT_CONNECTIONS):
+    """ answer checks on l_address (see pwned_serve.py) until Ctrl-C, keeping the db open """
+    debugLog("serveDb(" + l_address + "," + str(l_current_db_mode) + "," + l_cli_local_db_file + "," + l_cli_local_zip + ")")
+    if l_current_db_mode in (DB_LOCAL, DB_LOCAL_ZIP):
+        alwaysLog("WARNING: -l without -b or -m (or with -z) reads the whole db for each check. Use a sorted (-b) or packed (-m) db to serve")
+    with PwnedChecker(l_current_db_mode, l_cli_local_db_file, l_cli_local_zip, l_zip_sorted, 1, l_connections) as checker:
+        service = pserve.LookupService(checker.is_hash_pwned)
+        try:
+            server = pserve.makeServer(l_address, service)
+        except (pserve.ServeError, OSError) as e:
+            alwaysLog("ERROR: cannot listen on " + l_address + ": " + str(e) + ". Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        print("Serving checks on " + l_address + ". Press Ctrl-C to stop...")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nStopping...")
+        finally:
+            server.server_close()
+            if l_address.startswith("unix:") and os.path.exists(l_address[len("unix:"):]):
+                os.remove(l_address[len("unix:"):])
+    the_stats = service.stats()
+    print(f"Requests served: {the_stats['requests']:,} ({the_stats['hashes_checked']:,} hashes, {the_stats['hashes_pwned']:,} pwned)")
+    print(f"Latency (ms) p50 {the_stats['p50_ms']} - p90 {the_stats['p90_ms']} - p99 {the_stats['p99_ms']} - max {the_stats['max_ms']}")
+    return service
+
+
+def getRangeReader(l_current_db_mode, l_cli_local_db_file):
+    """ the pwned_rangeserve.py reader of the ranges of the local db, None if the db mode cannot serve ranges """
+    if l_current_db_mode == DB_LOCAL_SORTED:
+        return prangeserve.SortedDbRanges(l_cli_local_db_file, getPrefixIndex(l_cli_local_db_file))
+    if l_current_db_mode == DB_LOCAL_PACKED:
+        return prangeserve.PackedDbRanges(l_cli_local_db_file)
+    if l_current_db_mode == DB_LOCAL_BLOCKS:
+        return prangeserve.PackedDbRanges(l_cli_local_db_file, pblockdb.BlockHashDB)
+    if l_current_db_mode == DB_LOCAL_RANGES:
+        return prangeserve.RangeFilesRanges(pranges.RangeDirectory(l_cli_local_db_file))
+    return None
+
+
+def serveRanges(l_address, l_current_db_mode, l_cli_local_db_file):
+    """ answer GET /range/XXXXX on l_address (http://host:port) from the local db until Ctrl-C, see pwned_rangeserve.py """
+    debugLog("serveRanges(" + l_address + "," + str(l_current_db_mode) + "," + l_cli_local_db_file + ")")
+    try:
+        ranges = getRangeReader(l_current_db_mode, l_cli_local_db_file)
+    except (OSError, ValueError, pranges.RangeDirectoryError, pbindb.PackedDBError, pblockdb.BlockDBError) as e:
+        alwaysLog("ERROR: cannot open " + l_cli_local_db_file + ": " + str(e) + ". Exiting...")
+        sys.exit(ERR_WRONG_PARAMETERS)
+    if ranges is None:
+        alwaysLog("ERROR: --serve_range needs a sorted (-l with -b), packed (-l with -m), block compressed (-l with -c) or range files (-l with -r) db. Exiting...")
+        sys.exit(ERR_WRONG_PARAMETERS)
+    service = prangeserve.RangeService(ranges)
+    try:
+        server = prangeserve.makeRangeServer(l_address, service)
+    except (pserve.ServeError, OSError) as e:
+        ranges.close()
+        alwaysLog("ERROR: cannot listen on " + l_address + ": " + str(e) + ". Exiting...")
+        sys.exit(ERR_WRONG_PARAMETERS)
+    print("Serving the range api on " + prangeserve.rangeUrlOf(server) + "XXXXX. Press Ctrl-C to stop...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping...")
+    finally:
+        server.server_close()
+        ranges.close()
+    the_stats = service.stats()
+    print(f"Ranges served: {the_stats['requests']:,} ({the_stats['hashes_served']:,} hashes, {the_stats['errors']:,} errors)")
+    print(f"Latency (ms) p50 {the_stats['p50_ms']} - p90 {the_stats['p90_ms']} - p99 {the_stats['p99_ms']} - max {the_stats['max_ms']}")
+    return service
+
+
 #*********************************************
 #          MAIN is HERE
 #*********************************************
-g_start_time:float = my_stats.start_time
-debugLog(str(g_start_time) + 'This program is now in DEBUG mode. To change put DEBUG_MODE = False at the beginning of the file.')
-print("PWNED - ver. " + my_stats.PROGRAM_VERSION + " from A.R. is starting...")
-debugLog("WARNING - SSL Check is now " + str(my_stats.SSL_CHECK) + ". To change update value on SSL_CHECK variable")
-
-#Global operation modes and variables - by default the WEB service is used and input assumed in PLAIN TEXT mode
-current_operation_mode  = IM_UNKNOWN_MODE
-cli_password       = ""
-cli_password_file  = ""
-cli_text_file      = ""
-
-cli_input_mode = OM_PLAIN
-
-cli_db_mode    = DB_WEB
-cli_local_db_file  = ""
-cli_local_zip      = ""
-
-cli_output_file    = ""
-cli_delay_secs     = 0
-# Remove 1st argument from the list of command line arguments
-argumentList = sys.argv[1:]
-# Options
-options = "p:f:t:l:o:w:z:sbdh"
-# Long options
-long_options = ["password=", "password_file=", "text_file=", "local_sha1_file=", "output_file=", "delay=", "sha1_format", "zipped=", "binary_search", "debug", "help"]
-
-try:
-    debugLog("Parsing command line arguments....\n" + str(argumentList))
-    # Parsing argument
-    arguments, values = getopt.getopt(argumentList, options, long_options)
-    local_hashfile_name_found = False
-    # checking each argument
-    for currentArgument, currentValue in arguments:
-        if currentArgument in ("-p", "--password"):   
-            debugLog("-p " + currentValue + " found")
-            if current_operation_mode == IM_TEXT_FILE:
-                debugLog("-p " + currentValue + " found - Ignoring due to -t parameter found first....")
-                alwaysLog("WARNING: -p parameter found after -t parameter. Ignoring -p parameter....")
-            elif current_operation_mode == IM_PASSWORD_FILE:
-                debugLog("-p " + currentValue + " found - Ignoring due to -f parameter found first....")
-                alwaysLog("WARNING: -p parameter found after -f parameter. Ignoring -p parameter....")
-            else:
-                cli_password   = currentValue.strip()
-                current_operation_mode = IM_SINGLE_PASSOWRD
-                if cli_password == "":
-                    alwaysLog("WARNING: -p parameter found but NO password provided...Exiting")
+def main(argv=None):
+    """ the command line: python pwned.py -h """
+    my_stats.start_timer()
+    g_start_time:float = my_stats.start_time
+    debugLog(str(g_start_time) + 'This program is now in DEBUG mode. To change put DEBUG_MODE = False at the beginning of the file.')
+    print("PWNED - ver. " + my_stats.PROGRAM_VERSION + " from A.R. is starting...")
+    debugLog("WARNING - SSL Check is now " + str(my_stats.SSL_CHECK) + ". To change update value on SSL_CHECK variable")
+
+    #Global operation modes and variables - by default the WEB service is used and input assumed in PLAIN TEXT mode
+    current_operation_mode  = IM_UNKNOWN_MODE
+    cli_password       = ""
+    cli_password_file  = ""
+    cli_text_file      = ""
+
+    cli_input_mode = OM_PLAIN
+
+    cli_db_mode    = DB_WEB
+    cli_local_db_file  = ""
+    cli_local_zip      = ""
+    cli_zip_sorted     = False  #-b and -z together: the file inside the zip is sorted
+
+    cli_output_file    = ""
+    cli_delay_secs     = 0
+
+    cli_tool_mode      = TM_NONE
+    cli_packed_db_file = ""
+    cli_index_bits     = pidx.INDEX_DEFAULT_BITS
+    cli_workers        = 1
+    cli_connections    = pweb.DEFAULT_CONNECTIONS
+    cli_cache_file     = ""
+    cli_cache_ttl      = pcache.DEFAULT_CACHE_TTL_HOURS
+    cli_cache_size     = pcache.DEFAULT_CACHE_SIZE_MB
+    cli_max_rate       = pratelimit.DEFAULT_MAX_RATE
+    cli_max_retries    = pratelimit.DEFAULT_MAX_RETRIES
+    cli_serve_address  = ""
+    cli_fp_rate        = pfilter.FILTER_DEFAULT_FP_RATE
+    cli_chunk_size     = 0      #0: default of the db mode (see getDefaultChunkSize)
+    cli_hash_workers   = 1
+    cli_output_format  = poutput.FORMAT_CSV
+    cli_pwned_only     = False
+    cli_metrics_out    = ""
+    cli_metrics_format = ""     #"": from the --metrics_out extension (see pmetrics.formatFromFilename)
+    cli_delta_file     = ""
+    cli_hot_tier_size  = phot.HOT_DEFAULT_SIZE
+    cli_update_out     = ""
+    cli_api_url        = os.environ.get(API_URL_ENV_VAR, "")
+    cli_sorted_db_file = ""
+    cli_sort_run_mb    = psort.SORT_DEFAULT_RUN_MB
+    cli_sort_index     = False  #--sort_db with --build_index
+    cli_block_db_file  = ""
+    cli_block_records  = pblockdb.BLOCK_DEFAULT_RECORDS
+    # Remove 1st argument from the list of command line arguments
+    argumentList = sys.argv[1:] if argv is None else argv
+    # Options
+    options = "p:f:t:l:o:w:z:sbmcrdh"
+    # Long options
+    long_options = ["password=", "password_file=", "text_file=", "local_sha1_file=", "output_file=", "delay=", "sha1_format", "zipped=", "binary_search", "packed_db", "block_db", "range_dir", "build_packed_db=", "build_block_db=", "block_records=", "build_index", "sort_db=", "sort_run_mb=", "index_bits=", "workers=", "connections=", "cache=", "cache_ttl=", "cache_size=", "rate=", "retries=", "chunk_size=", "hash_workers=", "output_format=", "pwned_only", "metrics_out=", "metrics_format=", "serve=", "serve_range=", "api_url=", "build_filter", "fp_rate=", "update_db=", "update_out=", "build_hot_tier", "hot_tier_size=", "debug", "help"]
+
+    try:
+        debugLog("Parsing command line arguments....\n" + str(argumentList))
+        # Parsing argument
+        arguments = getopt.getopt(argumentList, options, long_options)[0]
+        # checking each argument
+        for currentArgument, currentValue in arguments:
+            if currentArgument in ("-p", "--password"):   
+                debugLog("-p " + currentValue + " found")
+                if current_operation_mode == IM_TEXT_FILE:
+                    debugLog("-p " + currentValue + " found - Ignoring due to -t parameter found first....")
+                    alwaysLog("WARNING: -p parameter found after -t parameter. Ignoring -p parameter....")
+                elif current_operation_mode == IM_PASSWORD_FILE:
+                    debugLog("-p " + currentValue + " found - Ignoring due to -f parameter found first....")
+                    alwaysLog("WARNING: -p parameter found after -f parameter. Ignoring -p parameter....")
+                else:
+                    cli_password   = currentValue.strip()
+                    current_operation_mode = IM_SINGLE_PASSOWRD
+                    if cli_password == "":
+                        alwaysLog("WARNING: -p parameter found but NO password provided...Exiting")
+                        sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument in ("-f", "--password_file"):
+                debugLog("-f " + currentValue + " found")
+                if current_operation_mode == IM_SINGLE_PASSOWRD:
+                    debugLog("-f " + currentValue + " found - Ignoring due to -p parameter found first....")
+                    alwaysLog("WARNING: -f parameter found after -p parameter. Ignoring -f parameter....")
+                elif current_operation_mode == IM_PASSWORD_FILE:
+                    debugLog("-f " + currentValue + " found - Ignoring due to -t parameter found first....")
+                    alwaysLog("WARNING: -f parameter found after -t parameter. Ignoring -f parameter....")
+                else:
+                    cli_password           = ""
+                    current_operation_mode = IM_PASSWORD_FILE
+                    cli_password_file      = currentValue.strip()
+                    if (not os.path.isfile(cli_password_file)):
+                        alwaysLog("ERROR: -f " + cli_password_file + " not found. Exiting...")
+                        sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument in ("-t", "--text_file"):
+                debugLog("-t " + currentValue + " found")
+                if current_operation_mode == IM_SINGLE_PASSOWRD:
+                    debugLog("-t " + currentValue + " found - Ignoring due to -p parameter found first....")
+                    alwaysLog("WARNING: -t parameter found after -p parameter. Ignoring -t parameter....")
+                elif current_operation_mode == IM_PASSWORD_FILE:
+                    debugLog("-t " + currentValue + " found - Ignoring due to -f parameter found first....")
+                    alwaysLog("WARNING: -t parameter found after -f parameter. Ignoring -t parameter....")
+                else:
+                    cli_password           = ""
+                    current_operation_mode = IM_TEXT_FILE  
+                    cli_text_file          = currentValue.strip()
+                    if (not os.path.isfile(cli_text_file)):
+                        alwaysLog("ERROR: -t " + cli_text_file + " not found. Exiting...")
+                        sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument in ("-s", "--sha1_format"):
+                debugLog("-s found... assuming everyhing in SHA1 mode from now on...")
+                cli_input_mode = OM_HASH
+
+            elif currentArgument in ("-w", "--wait"):
+                debugLog("-w secs_number found... each web request will be throttled by " + str(currentValue) + "seconds")
+                cli_delay_secs = int(currentValue.strip())
+
+            elif currentArgument in ("-l", "--local_sha1_file"):
+                debugLog("-l " + currentValue + " found")
+                if cli_db_mode not in (DB_LOCAL_ZIP, DB_LOCAL_SORTED, DB_LOCAL_PACKED, DB_LOCAL_RANGES, DB_LOCAL_BLOCKS):
+                    cli_db_mode    = DB_LOCAL
+                cli_local_db_file  = currentValue.strip()
+
+
+            elif currentArgument in ("-z", "--zipped"):
+                debugLog("-z " + currentValue + " found. Using zipped file")
+                cli_local_zip  = currentValue.strip()
+                if cli_db_mode in (DB_LOCAL_PACKED, DB_LOCAL_BLOCKS):
+                    debugLog("-z " + cli_local_zip + " found - Ignoring due to -m/-c parameter found first....")
+                    alwaysLog("WARNING: -z parameter found after -m or -c parameter. Ignoring -z...")
+                elif (cli_db_mode != DB_LOCAL_SORTED):
+                    cli_db_mode  = DB_LOCAL_ZIP
+                else:
+                    debugLog("-z " + cli_local_zip + " found after -b. The file inside the zip is sorted")
+                    cli_db_mode    = DB_LOCAL_ZIP
+                    cli_zip_sorted = True
+
+            elif currentArgument in ("-b", "--binary_search"):
+                debugLog("-b " + currentValue + " found. Using binary search")
+                if cli_db_mode in (DB_LOCAL_PACKED, DB_LOCAL_BLOCKS):
+                    debugLog("-b " + currentValue + " found - Ignoring due to -m/-c parameter found first....")
+                    alwaysLog("WARNING: -b parameter found after -m or -c parameter. Ignoring -b...")
+                elif (cli_db_mode != DB_LOCAL_ZIP):
+                    cli_db_mode  = DB_LOCAL_SORTED
+                else:
+                    debugLog("-b " + currentValue + " found after -z. The file inside the zip is sorted")
+                    cli_zip_sorted = True
+
+            elif currentArgument in ("-m", "--packed_db"):
+                debugLog("-m found. Using packed binary db")
+                if (cli_db_mode == DB_LOCAL_ZIP) or (cli_db_mode == DB_LOCAL_SORTED):
+                    alwaysLog("WARNING: -m parameter found after -z or -b parameter. Ignoring -z/-b...")
+                cli_db_mode  = DB_LOCAL_PACKED
+
+            elif currentArgument in ("-c", "--block_db"):
+                debugLog("-c found. Using block compressed db")
+                if cli_db_mode in (DB_LOCAL_ZIP, DB_LOCAL_SORTED, DB_LOCAL_PACKED):
+                    alwaysLog("WARNING: -c parameter found after -z, -b or -m parameter. Ignoring -z/-b/-m...")
+                cli_db_mode  = DB_LOCAL_BLOCKS
+
+            elif currentArgument in ("-r", "--range_dir"):
+                debugLog("-r found. Using a directory (or zip) of range files")
+                if cli_db_mode in (DB_LOCAL_ZIP, DB_LOCAL_SORTED, DB_LOCAL_PACKED, DB_LOCAL_BLOCKS):
+                    alwaysLog("WARNING: -r parameter found after -z, -b, -m or -c parameter. Ignoring -z/-b/-m/-c...")
+                cli_db_mode  = DB_LOCAL_RANGES
+
+            elif currentArgument == "--build_packed_db":
+                debugLog("--build_packed_db " + currentValue + " found")
+                cli_tool_mode      = TM_BUILD_PACKED_DB
+                cli_packed_db_file = currentValue.strip()
+                if cli_packed_db_file == "":
+                    alwaysLog("ERROR: --build_packed_db parameter found but NO output file name provided...Exiting")
                     sys.exit(ERR_WRONG_PARAMETERS)
 
-        elif currentArgument in ("-f", "--password_file"):
-            debugLog("-f " + currentValue + " found")
-            if current_operation_mode == IM_SINGLE_PASSOWRD:
-                debugLog("-f " + currentValue + " found - Ignoring due to -p parameter found first....")
-                alwaysLog("WARNING: -f parameter found after -p parameter. Ignoring -f parameter....")
-            elif current_operation_mode == IM_PASSWORD_FILE:
-                debugLog("-f " + currentValue + " found - Ignoring due to -t parameter found first....")
-                alwaysLog("WARNING: -f parameter found after -t parameter. Ignoring -f parameter....")
-            else:
-                cli_password           = ""
-                current_operation_mode = IM_PASSWORD_FILE
-                cli_password_file      = currentValue.strip()
-                if (not os.path.isfile(cli_password_file)):
-                    alwaysLog("ERROR: -f " + cli_password_file + " not found. Exiting...")
+            elif currentArgument == "--build_block_db":
+                debugLog("--build_block_db " + currentValue + " found")
+                cli_tool_mode      = TM_BUILD_BLOCK_DB
+                cli_block_db_file  = currentValue.strip()
+                if cli_block_db_file == "":
+                    alwaysLog("ERROR: --build_block_db parameter found but NO output file name provided...Exiting")
                     sys.exit(ERR_WRONG_PARAMETERS)
 
-        elif currentArgument in ("-t", "--text_file"):
-            debugLog("-t " + currentValue + " found")
-            if current_operation_mode == IM_SINGLE_PASSOWRD:
-                debugLog("-t " + currentValue + " found - Ignoring due to -p parameter found first....")
-                alwaysLog("WARNING: -t parameter found after -p parameter. Ignoring -t parameter....")
-            elif current_operation_mode == IM_PASSWORD_FILE:
-                debugLog("-t " + currentValue + " found - Ignoring due to -f parameter found first....")
-                alwaysLog("WARNING: -t parameter found after -f parameter. Ignoring -t parameter....")
-            else:
-                cli_password           = ""
-                current_operation_mode = IM_TEXT_FILE  
-                cli_text_file          = currentValue.strip()
-                if (not os.path.isfile(cli_text_file)):
-                    alwaysLog("ERROR: -t " + cli_text_file + " not found. Exiting...")
+            elif currentArgument == "--block_records":
+                debugLog("--block_records " + currentValue + " found")
+                cli_block_records = int(currentValue.strip())
+                if cli_block_records < 1:
+                    alwaysLog("ERROR: --block_records must be at least 1. Exiting...")
                     sys.exit(ERR_WRONG_PARAMETERS)
 
-        elif currentArgument in ("-s", "--sha1_format"):
-            debugLog("-s found... assuming everyhing in SHA1 mode from now on...")
-            cli_input_mode = OM_HASH
-
-        elif currentArgument in ("-w", "--wait"):
-            debugLog("-w secs_number found... each web request will be throttled by " + str(currentValue) + "seconds")
-            cli_delay_secs = int(currentValue.strip())
-             
-        elif currentArgument in ("-l", "--local_sha1_file"):
-            debugLog("-l " + currentValue + " found")
-            if (cli_db_mode != DB_LOCAL_ZIP) and (cli_db_mode != DB_LOCAL_SORTED):
-                cli_db_mode    = DB_LOCAL
-            cli_local_db_file  = currentValue.strip()
-            if cli_local_db_file:
-                local_hashfile_name_found = True
-
-
-        elif currentArgument in ("-z", "--zipped"):
-            debugLog("-z " + currentValue + " found. Using zipped file")
-            cli_local_zip  = currentValue.strip()
-            if (cli_db_mode != DB_LOCAL_SORTED):
-                cli_db_mode  = DB_LOCAL_ZIP
-            else:
-                debugLog("-z " + cli_local_zip + " found - Ignoring due to -b parameter found first....")
-                alwaysLog("WARNING: -z parameter found after -b parameter. Ignoring -z...")
-                
-        elif currentArgument in ("-b", "--binary_search"):
-            debugLog("-b " + currentValue + " found. Using binary search")
-            if (cli_db_mode != DB_LOCAL_ZIP):
-                cli_db_mode  = DB_LOCAL_SORTED
+            elif currentArgument == "--serve":
+                debugLog("--serve " + currentValue + " found")
+                cli_tool_mode     = TM_SERVE
+                cli_serve_address = currentValue.strip()
+                try:
+                    pserve.parseAddress(cli_serve_address)
+                except pserve.ServeError as e:
+                    alwaysLog("ERROR: --serve " + str(e) + ". Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--serve_range":
+                debugLog("--serve_range " + currentValue + " found")
+                cli_tool_mode     = TM_SERVE_RANGE
+                cli_serve_address = currentValue.strip()
+                if not cli_serve_address.startswith("http://"):
+                    alwaysLog("ERROR: --serve_range needs an http://host:port address. Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+                try:
+                    pserve.parseAddress(cli_serve_address)
+                except pserve.ServeError as e:
+                    alwaysLog("ERROR: --serve_range " + str(e) + ". Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--api_url":
+                debugLog("--api_url " + currentValue + " found")
+                cli_api_url = currentValue.strip()
+
+            elif currentArgument == "--build_filter":
+                debugLog("--build_filter found")
+                cli_tool_mode = TM_BUILD_FILTER
+
+            elif currentArgument == "--fp_rate":
+                debugLog("--fp_rate " + currentValue + " found")
+                cli_fp_rate = float(currentValue.strip())
+                if not 0 < cli_fp_rate < 1:
+                    alwaysLog("ERROR: --fp_rate must be between 0 and 1 (e.g. 0.01 for 1%). Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--build_hot_tier":
+                debugLog("--build_hot_tier found")
+                cli_tool_mode = TM_BUILD_HOT_TIER
+
+            elif currentArgument == "--hot_tier_size":
+                debugLog("--hot_tier_size " + currentValue + " found")
+                cli_hot_tier_size = int(currentValue.strip())
+                if cli_hot_tier_size < 1:
+                    alwaysLog("ERROR: --hot_tier_size must be at least 1. Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--update_db":
+                debugLog("--update_db " + currentValue + " found")
+                cli_tool_mode  = TM_UPDATE_DB
+                cli_delta_file = currentValue.strip()
+                if not os.path.isfile(cli_delta_file):
+                    alwaysLog("ERROR: --update_db " + cli_delta_file + " not found. Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--update_out":
+                debugLog("--update_out " + currentValue + " found")
+                cli_update_out = currentValue.strip()
+
+            elif currentArgument == "--build_index":
+                debugLog("--build_index found")
+                if cli_tool_mode == TM_SORT_DB:
+                    cli_sort_index = True   #written by the last pass of the sort
+                else:
+                    cli_tool_mode = TM_BUILD_INDEX
+
+            elif currentArgument == "--sort_db":
+                debugLog("--sort_db " + currentValue + " found")
+                if cli_tool_mode == TM_BUILD_INDEX:
+                    cli_sort_index = True
+                cli_tool_mode      = TM_SORT_DB
+                cli_sorted_db_file = currentValue.strip()
+                if cli_sorted_db_file == "":
+                    alwaysLog("ERROR: --sort_db parameter found but NO output file name provided...Exiting")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--sort_run_mb":
+                debugLog("--sort_run_mb " + currentValue + " found")
+                cli_sort_run_mb = int(currentValue.strip())
+                if cli_sort_run_mb < 1:
+                    alwaysLog("ERROR: --sort_run_mb must be at least 1. Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--index_bits":
+                debugLog("--index_bits " + currentValue + " found")
+                cli_index_bits = int(currentValue.strip())
+                if cli_index_bits not in pidx.INDEX_ALLOWED_BITS:
+                    alwaysLog("ERROR: --index_bits must be one of " + str(pidx.INDEX_ALLOWED_BITS) + ". Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--workers":
+                debugLog("--workers " + currentValue + " found")
+                cli_workers = int(currentValue.strip())
+                if cli_workers < 1:
+                    alwaysLog("ERROR: --workers must be at least 1. Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--connections":
+                debugLog("--connections " + currentValue + " found")
+                cli_connections = int(currentValue.strip())
+                if cli_connections < 1:
+                    alwaysLog("ERROR: --connections must be at least 1. Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--cache":
+                debugLog("--cache " + currentValue + " found")
+                cli_cache_file = currentValue.strip()
+
+            elif currentArgument == "--cache_ttl":
+                debugLog("--cache_ttl " + currentValue + " found")
+                cli_cache_ttl = float(currentValue.strip())
+
+            elif currentArgument == "--cache_size":
+                debugLog("--cache_size " + currentValue + " found")
+                cli_cache_size = float(currentValue.strip())
+
+            elif currentArgument == "--rate":
+                debugLog("--rate " + currentValue + " found")
+                cli_max_rate = float(currentValue.strip())
+                if cli_max_rate <= 0:
+                    alwaysLog("ERROR: --rate must be greater than 0. Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--retries":
+                debugLog("--retries " + currentValue + " found")
+                cli_max_retries = int(currentValue.strip())
+
+            elif currentArgument == "--chunk_size":
+                debugLog("--chunk_size " + currentValue + " found")
+                cli_chunk_size = int(currentValue.strip())
+                if cli_chunk_size < 1:
+                    alwaysLog("ERROR: --chunk_size must be at least 1. Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--hash_workers":
+                debugLog("--hash_workers " + currentValue + " found")
+                cli_hash_workers = int(currentValue.strip())
+                if cli_hash_workers < 1:
+                    alwaysLog("ERROR: --hash_workers must be at least 1. Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument in ("-o", "--output_file"):
+                debugLog("-o " + currentValue + " found")
+                cli_output_file  = currentValue.strip()  #the file is (re)created by openResultWriter before starting
+
+            elif currentArgument == "--output_format":
+                debugLog("--output_format " + currentValue + " found")
+                cli_output_format = currentValue.strip().lower()
+                if cli_output_format not in poutput.OUTPUT_FORMATS:
+                    alwaysLog("ERROR: --output_format must be one of " + str(poutput.OUTPUT_FORMATS) + ". Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument == "--pwned_only":
+                debugLog("--pwned_only found. Only pwned passwords are written to the output file")
+                cli_pwned_only = True
+
+            elif currentArgument == "--metrics_out":
+                debugLog("--metrics_out " + currentValue + " found")
+                cli_metrics_out = currentValue.strip()
+
+            elif currentArgument == "--metrics_format":
+                debugLog("--metrics_format " + currentValue + " found")
+                cli_metrics_format = currentValue.strip().lower()
+                if cli_metrics_format not in pmetrics.METRICS_FORMATS:
+                    alwaysLog("ERROR: --metrics_format must be one of " + str(pmetrics.METRICS_FORMATS) + ". Exiting...")
+                    sys.exit(ERR_WRONG_PARAMETERS)
+
+            elif currentArgument in ("-d", "--debug"):
+                my_stats.DEBUG_MODE = True
+                debugLog("-d found. continuing in DEBUG MODE")
+
+            elif currentArgument in ("-h", "--help"):
+                showHelp()
+                alwaysLog("-h or --help found - Ignoring other parameters...")
+                print("PWNED - ver. " + my_stats.PROGRAM_VERSION + " from A.R.")
+                sys.exit(ERR_NO_ERROR)
+
             else:
-                debugLog("-b " + currentValue + " found - Ignoring due to -z parameter found first....")
-                alwaysLog("WARNING: -b parameter found after -z parameter. Ignoring -b...")
-            
-        elif currentArgument in ("-o", "--output_file"):
-            debugLog("-o " + currentValue + " found")
-            cli_output_file  = currentValue.strip()
-            if cli_output_file != "": #erase the file if it exists
-                outfile = open(cli_output_file, 'w', encoding='utf-8', newline='\n')
-                outfile.close()
-
-        elif currentArgument in ("-d", "--debug"):
-            my_stats.DEBUG_MODE = True
-            debugLog("-d found. continuing in DEBUG MODE")
-
-        elif currentArgument in ("-h", "--help"):
-            showHelp()
-            alwaysLog("-h or --help found - Ignoring other parameters...")
-            print("PWNED - ver. " + my_stats.PROGRAM_VERSION + " from A.R.")
-            sys.exit(ERR_NO_ERROR)
-        
-        else:
-            print("Unknow parameter")
-            showHelp()
-            print("PWNED - ver. " + my_stats.PROGRAM_VERSION + " from A.R.")
+                print("Unknow parameter")
+                showHelp()
+                print("PWNED - ver. " + my_stats.PROGRAM_VERSION + " from A.R.")
+                sys.exit(ERR_WRONG_PARAMETERS)
+            debugLog("cli_input_mode="+ str(cli_input_mode) + " - cli_db_mode=" + str(cli_db_mode) + " - current_operation_mode=" + str(current_operation_mode))
+
+    except getopt.error as err:
+        # output error, and return with an error code
+        print("Argument parsing error: " + str(err))
+        #showHelp()
+        print("PWNED - ver. " + my_stats.PROGRAM_VERSION + " from A.R.")
+        sys.exit(ERR_WRONG_PARAMETERS)
+
+    #anykey("Press 'q' or Ctrl-C to quit or anything else to continue....")
+
+    #all local db options require a filename to be specified. check if cli_local_db_file is not empty and existing
+    if cli_db_mode in (DB_LOCAL, DB_LOCAL_SORTED, DB_LOCAL_PACKED, DB_LOCAL_BLOCKS):
+        if (cli_local_db_file == ""):
+            alwaysLog("ERROR: -l parameter not found or local_password_file name not provided. Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        elif (not os.path.isfile(cli_local_db_file)):
+            alwaysLog("ERROR: " + cli_local_db_file + " not found. Exiting...")
             sys.exit(ERR_WRONG_PARAMETERS)
-        debugLog("cli_input_mode="+ str(cli_input_mode) + " - cli_db_mode=" + str(cli_db_mode) + " - current_operation_mode=" + str(current_operation_mode))
 
-except getopt.error as err:
-    # output error, and return with an error code
-    print("Argument parsing error: " + str(err))
-    #showHelp()
-    print("PWNED - ver. " + my_stats.PROGRAM_VERSION + " from A.R.")
-    sys.exit(ERR_WRONG_PARAMETERS)
+    if (cli_db_mode == DB_LOCAL_RANGES):
+        if (cli_local_db_file == ""):
+            alwaysLog("ERROR: -r needs the directory (or zip) of range files provided with -l. Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        try:
+            pranges.getRangeDirectoryFor(cli_local_db_file)
+        except (pranges.RangeDirectoryError, OSError) as e:
+            alwaysLog("ERROR: " + str(e) + ". Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
 
-#anykey("Press 'q' or Ctrl-C to quit or anything else to continue....")
+    #if -z provided then check if cli_local_zip is not empty and existig
+    if (cli_db_mode == DB_LOCAL_ZIP):
+        if (cli_local_zip == ""):
+            alwaysLog("ERROR: -z parameter provided but with no zip file name. Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        elif (not os.path.isfile(cli_local_zip)):
+            alwaysLog("ERROR: " + cli_local_zip + " not found. Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)  
 
-#all local db options require a filename to be specified. check if cli_local_db_file is not empty and existing
-if (cli_db_mode == DB_LOCAL) or (cli_db_mode == DB_LOCAL_SORTED):
-    if (cli_local_db_file == ""):
-        alwaysLog("ERROR: -l parameter not found or local_password_file name not provided. Exiting...")
-        sys.exit(ERR_WRONG_PARAMETERS)
-    elif (not os.path.isfile(cli_local_db_file)):
-        alwaysLog("ERROR: " + cli_local_db_file + " not found. Exiting...")
-        sys.exit(ERR_WRONG_PARAMETERS)
 
-#if -z provided then check if cli_local_zip is not empty and existig
-if (cli_db_mode == DB_LOCAL_ZIP):
-    if (cli_local_zip == ""):
-        alwaysLog("ERROR: -z parameter provided but with no zip file name. Exiting...")
-        sys.exit(ERR_WRONG_PARAMETERS)
-    elif (not os.path.isfile(cli_local_zip)):
-        alwaysLog("ERROR: " + cli_local_zip + " not found. Exiting...")
-        sys.exit(ERR_WRONG_PARAMETERS)  
+    #here we really start....
 
+    if cli_metrics_out != "":
+        setMetricsOutput(cli_metrics_out, cli_metrics_format)
 
-#here we really start....
+    if (cli_output_file != "") and (cli_tool_mode == TM_NONE):
+        try:
+            openResultWriter(cli_output_file, cli_output_format, cli_pwned_only)
+        except OSError as e:
+            alwaysLog("ERROR: cannot write the output file " + cli_output_file + ": " + str(e) + ". Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
 
-if current_operation_mode == IM_SINGLE_PASSOWRD:
-    # We are in single password mode
-    assert not cli_password==""
-    print("Searching for a single password...: " + cli_password)
-    my_stats.number_of_password_read = 1
-    checkSinglePassword(cli_password, cli_input_mode, cli_db_mode, cli_local_db_file, cli_local_zip, cli_output_file)
-    printStats()
+    if cli_api_url != "":
+        try:
+            setRangeApiUrl(cli_api_url)
+        except ValueError as e:
+            alwaysLog("ERROR: --api_url (or " + API_URL_ENV_VAR + ") " + str(e) + ". Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
 
-elif current_operation_mode == IM_PASSWORD_FILE:
-    assert cli_password_file!=""
-    if (not os.path.isfile(cli_password_file)):
-        alwaysLog("ERROR: -f " + cli_password_file + " not found. Exiting...")
-        sys.exit(ERR_WRONG_PARAMETERS)
+    if (cli_db_mode == DB_WEB):
+        if (cli_cache_file != ""):
+            openRangeCache(cli_cache_file, cli_cache_ttl, cli_cache_size)
+        getRangeClient(cli_connections, cli_delay_secs, cli_max_rate, cli_max_retries)
 
-    print("Searching for password file: " + cli_password_file)
-    checkPlainPasswordFile(cli_password_file, cli_db_mode, cli_local_db_file, cli_output_file, cli_input_mode, cli_delay_secs)
-    printStats()
+    if cli_tool_mode == TM_BUILD_PACKED_DB:
+        if (cli_local_db_file == ""):
+            alwaysLog("ERROR: --build_packed_db needs the source db provided with -l (and -z if zipped). Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        buildPackedDb(cli_local_db_file, cli_local_zip, cli_packed_db_file)
+        printStats()
+        sys.exit(ERR_NO_ERROR)
 
-elif current_operation_mode == IM_TEXT_FILE: 
-    assert cli_text_file!=""
-    if (not os.path.isfile(cli_text_file)):
-        alwaysLog("ERROR: -l " + cli_text_file + " not found. Exiting...")
-        sys.exit(ERR_WRONG_PARAMETERS)
+    if cli_tool_mode == TM_BUILD_BLOCK_DB:
+        if (cli_local_db_file == "") or (cli_db_mode in (DB_LOCAL_PACKED, DB_LOCAL_BLOCKS, DB_LOCAL_RANGES)):
+            alwaysLog("ERROR: --build_block_db needs the HASH:count text db provided with -l (and -z if zipped). Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        buildBlockDb(cli_local_db_file, cli_local_zip if cli_db_mode == DB_LOCAL_ZIP else "", cli_block_db_file, cli_block_records, cli_workers)
+        printStats()
+        sys.exit(ERR_NO_ERROR)
 
-    print("Searching for text file: " + cli_text_file)
-    word_to_check_list=getPasswordList(cli_text_file)
-    checkTextFile(word_to_check_list, cli_db_mode, cli_local_db_file, cli_output_file, cli_delay_secs)
-    printStats()
-else:
-    print("UNKNOWN operation mode. this should NEVER happen. Need one of -p -f -t parameters. Use -h or --help to see usage")
-    print("current arguments: "+ str(argumentList))
-    printStats()
-    showHelpShort()
-    sys.exit(ERR_OPMODE_UNKNOWN)
+    if cli_tool_mode == TM_SORT_DB:
+        if (cli_local_db_file == ""):
+            alwaysLog("ERROR: --sort_db needs the source db provided with -l (and -z if zipped). Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        sortDb(cli_local_db_file, cli_local_zip if cli_db_mode == DB_LOCAL_ZIP else "", cli_sorted_db_file, cli_workers, cli_sort_run_mb,
+               cli_index_bits if cli_sort_index else 0)
+        printStats()
+        sys.exit(ERR_NO_ERROR)
+
+    if cli_tool_mode == TM_BUILD_INDEX:
+        if (cli_local_db_file == "") or (cli_db_mode in (DB_LOCAL_ZIP, DB_LOCAL_PACKED, DB_LOCAL_BLOCKS, DB_LOCAL_RANGES)):
+            alwaysLog("ERROR: --build_index needs the sorted text db provided with -l (not -z, -m, -c or -r). Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        buildPrefixIndex(cli_local_db_file, cli_index_bits)
+        printStats()
+        sys.exit(ERR_NO_ERROR)
+
+    if cli_tool_mode == TM_BUILD_FILTER:
+        if (cli_local_db_file == ""):
+            alwaysLog("ERROR: --build_filter needs the db provided with -l (and -z if zipped). Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        buildBloomFilter(cli_local_db_file, cli_local_zip if cli_db_mode == DB_LOCAL_ZIP else "", cli_fp_rate)
+        printStats()
+        sys.exit(ERR_NO_ERROR)
+
+    if cli_tool_mode == TM_BUILD_HOT_TIER:
+        if (cli_local_db_file == ""):
+            alwaysLog("ERROR: --build_hot_tier needs the db provided with -l (and -z if zipped). Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        buildHotTier(cli_local_db_file, cli_local_zip if cli_db_mode == DB_LOCAL_ZIP else "", cli_hot_tier_size)
+        printStats()
+        sys.exit(ERR_NO_ERROR)
+
+    if cli_tool_mode == TM_UPDATE_DB:
+        if (cli_local_db_file == "") or (cli_db_mode in (DB_LOCAL_ZIP, DB_LOCAL_PACKED, DB_LOCAL_BLOCKS, DB_LOCAL_RANGES)):
+            alwaysLog("ERROR: --update_db needs the sorted text db provided with -l (not -z, -m, -c or -r). Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        updateSortedDb(cli_local_db_file, cli_delta_file, cli_update_out)
+        printStats()
+        sys.exit(ERR_NO_ERROR)
+
+    if cli_tool_mode == TM_SERVE:
+        serveDb(cli_serve_address, cli_db_mode, cli_local_db_file, cli_local_zip, cli_zip_sorted, cli_connections)
+        closeRangeClient()
+        printStats()
+        sys.exit(ERR_NO_ERROR)
+
+    if cli_tool_mode == TM_SERVE_RANGE:
+        if (cli_local_db_file == ""):
+            alwaysLog("ERROR: --serve_range needs the db provided with -l (sorted with -b, packed with -m, block compressed with -c or range files with -r). Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        serveRanges(cli_serve_address, cli_db_mode, cli_local_db_file)
+        printStats()
+        sys.exit(ERR_NO_ERROR)
+
+    if current_operation_mode == IM_SINGLE_PASSOWRD:
+        # We are in single password mode
+        assert not cli_password==""
+        print("Searching for a single password...: " + cli_password)
+        checkSinglePassword(cli_password, cli_input_mode, cli_db_mode, cli_local_db_file, cli_local_zip, cli_output_file, cli_zip_sorted)
+        closeRangeClient()
+        closeResultWriter()
+        printStats()
+
+    elif current_operation_mode == IM_PASSWORD_FILE:
+        assert cli_password_file!=""
+        if (not os.path.isfile(cli_password_file)):
+            alwaysLog("ERROR: -f " + cli_password_file + " not found. Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+
+        print("Searching for password file: " + cli_password_file)
+        try:
+            checkPlainPasswordFile(cli_password_file, cli_db_mode, cli_local_db_file, cli_output_file, cli_input_mode, cli_delay_secs, cli_workers, cli_local_zip, cli_zip_sorted, cli_connections, cli_chunk_size, cli_hash_workers)
+        except FileNotFoundError as e:
+            alwaysLog("ERROR: " + str(e) + ". Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        closeRangeClient()
+        closeResultWriter()
+        printStats()
+
+    elif current_operation_mode == IM_TEXT_FILE: 
+        assert cli_text_file!=""
+        if (not os.path.isfile(cli_text_file)):
+            alwaysLog("ERROR: -l " + cli_text_file + " not found. Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+
+        print("Searching for text file: " + cli_text_file)
+        #the text file is read (and hashed) while checking, chunk by chunk
+        try:
+            checkTextFile(lambda: iterPasswordListBatches(cli_text_file, cli_hash_workers, cli_output_file != ""), cli_db_mode, cli_local_db_file, cli_output_file, cli_delay_secs, cli_workers, cli_local_zip, cli_zip_sorted, cli_connections, cli_chunk_size)
+        except FileNotFoundError as e:
+            alwaysLog("ERROR: " + str(e) + ". Exiting...")
+            sys.exit(ERR_WRONG_PARAMETERS)
+        closeRangeClient()
+        closeResultWriter()
+        printStats()
+    else:
+        print("UNKNOWN operation mode. this should NEVER happen. Need one of -p -f -t parameters. Use -h or --help to see usage")
+        print("current arguments: "+ str(argumentList))
+        printStats()
+        showHelpShort()
+        sys.exit(ERR_OPMODE_UNKNOWN)
+
+    if cli_output_file != "":
+        print("Passwords and status are recorded to: " + cli_output_file)
+        print("Remember to REMOVE THIS FILE!!!!!!!! it MAY contains your passwords.... ")
+    else:
+        debugLog("Password not recorded. To record use the cli option: -o outputfilename")
+    sys.exit(ERR_NO_ERROR)
 
-if cli_output_file != "":
-    print("Passwords and status are recorded to: " + cli_output_file)
-    print("Remember to REMOVE THIS FILE!!!!!!!! it MAY contains your passwords.... ")
-else:
-    debugLog("Password not recorded. To record use the cli option: -o outputfilename")
-sys.exit(ERR_NO_ERROR)
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Reproducible benchmarks of the pwned.py db modes, offline.
+#
+#   python pwned_bench.py --lines 1000000 --inputs 100000 --hit_ratio 0.3 --results bench.json
+#   python pwned_bench.py --compare before.json --results after.json
+#
+# Synthetic HASH:count dbs are generated from known passwords ("bench<seed>-<n>", n < lines), sorted
+# (external sort, see pwned_join.spillSortedRuns) and unsorted, plain, zipped and packed. Input files mix
+# db passwords and misses at the requested hit ratio. The generated files are reused by later runs with
+# the same parameters. The web mode runs against a local range api (pwned_rangeserve.py) answering from the packed db.
+#
+# Every case (single lookups and -f batch of each db mode) runs in a fresh process: results hold throughput,
+# latency percentiles, peak RSS and the pwned count (checked against the expected one) in a JSON file.
+# Out of scope: the sidecar files of a db (prefix index, bloom filter and the like) and the db formats not in MODES.
+# A new db format gets measured by adding its mode here, with its generator and its case.
+import contextlib
+import getopt
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import zipfile
+
+import pwned_bindb as pbindb
+import pwned_join as pjoin
+import pwned_rangeserve as prangeserve
+import pwned_serve as pserve
+
+BENCH_VERSION:int        = 1
+DEFAULT_LINES:int        = 100000
+DEFAULT_INPUTS:int       = 10000
+DEFAULT_HIT_RATIO:float  = 0.3
+DEFAULT_LOOKUPS:int      = 20       #single lookups per db mode (a miss in an unsorted db reads it all)
+DEFAULT_SEED:int         = 1
+SORT_RUN_SIZE:int        = 1000000  #hashes sorted in memory at a time while generating the sorted db
+WRITE_BATCH:int          = 10000
+REGRESSION_THRESHOLD     = 0.10     #--compare flags cases more than 10% slower
+MODES                    = ["local", "local_mt", "sorted", "zip", "zip_sorted", "packed", "web"]
+SINGLE_LOOKUP_MODES      = ["local", "sorted", "zip", "packed", "web"]
+
+
+def benchPassword(seed:int, n:int) -> str:
+    return "bench" + str(seed) + "-" + str(n)
+
+
+def benchHash(password:str) -> str:
+    return hashlib.sha1(password.encode("utf-8")).hexdigest().upper()
+
+
+def benchCount(the_hash:str) -> int:
+    """ breach count of a generated line: derived from the hash, so sorted and unsorted dbs hold the same lines """
+    return int(the_hash[:4], 16) % 997 + 1
+
+
+def writeDbLines(filename:str, hashes) -> int:
+    lines = 0
+    with open(filename, "w", encoding="ascii", newline="\n") as db_file:
+        batch = []
+        for the_hash in hashes:
+            batch.append(the_hash + ":" + str(benchCount(the_hash)) + "\n")
+            if len(batch) >= WRITE_BATCH:
+                db_file.writelines(batch)
+                lines += len(batch)
+                batch = []
+        db_file.writelines(batch)
+        lines += len(batch)
+    return lines
+
+
+def generateUnsortedDb(filename:str, lines:int, seed:int=DEFAULT_SEED) -> int:
+    return writeDbLines(filename, (benchHash(benchPassword(seed, n)) for n in range(lines)))
+
+
+def generateSortedDb(filename:str, lines:int, seed:int=DEFAULT_SEED, work_dir:str="") -> int:
+    """ same lines as generateUnsortedDb, sorted on disk: memory stays flat up to 1e9 lines """
+    work_dir = work_dir or os.path.dirname(os.path.abspath(filename))
+    run_files = pjoin.spillSortedRuns((benchHash(benchPassword(seed, n)) for n in range(lines)), SORT_RUN_SIZE, work_dir)
+    try:
+        return writeDbLines(filename, (the_hash.decode("ascii") for the_hash in pjoin.iterMergedRuns(run_files)))
+    finally:
+        for run_filename in run_files:
+            os.remove(run_filename)
+
+
+def zipDb(text_filename:str, zip_filename:str) -> None:
+    with zipfile.ZipFile(zip_filename, "w", zipfile.ZIP_DEFLATED) as the_zip:
+        the_zip.write(text_filename, os.path.basename(text_filename))
+
+
+def generateInput(filename:str, size:int, hit_ratio:float, lines:int, seed:int=DEFAULT_SEED) -> int:
+    """ plain text passwords, about hit_ratio of them in the db. Returns the number of hits """
+    rnd = random.Random(seed * 7919 + size)
+    hits = 0
+    with open(filename, "w", encoding="utf-8", newline="\n") as input_file:
+        for n in range(size):
+            if lines > 0 and rnd.random() < hit_ratio:
+                input_file.write(benchPassword(seed, rnd.randrange(lines)) + "\n")
+                hits += 1
+            else:
+                input_file.write("miss" + str(seed) + "-" + str(n) + "\n")
+    return hits
+
+
+class BenchFiles:
+    """ names of the generated files of a set of parameters """
+
+    def __init__(self, work_dir:str, lines:int, inputs:int, hit_ratio:float, seed:int):
+        stem = os.path.join(work_dir, "bench-" + str(lines) + "-" + str(seed))
+        self.work_dir = work_dir
+        self.unsorted_db = stem + "-unsorted.txt"
+        self.sorted_db = stem + "-sorted.txt"
+        self.unsorted_zip = stem + "-unsorted.zip"
+        self.sorted_zip = stem + "-sorted.zip"
+        self.packed_db = stem + ".bin"
+        self.input_file = stem + "-input-" + str(inputs) + "-" + str(hit_ratio) + ".txt"
+        self.input_meta = self.input_file + ".json"
+
+
+def prepareFiles(files:BenchFiles, lines:int, inputs:int, hit_ratio:float, seed:int) -> dict:
+    """ generate what is missing. Returns the generation timings and the expected hits """
+    timings = {}
+
+    def timed(name, target, function):
+        if not os.path.isfile(target):
+            start = time.perf_counter()
+            function()
+            timings[name] = round(time.perf_counter() - start, 3)
+
+    timed("unsorted_db", files.unsorted_db, lambda: generateUnsortedDb(files.unsorted_db, lines, seed))
+    timed("sorted_db", files.sorted_db, lambda: generateSortedDb(files.sorted_db, lines, seed, files.work_dir))
+    timed("unsorted_zip", files.unsorted_zip, lambda: zipDb(files.unsorted_db, files.unsorted_zip))
+    timed("sorted_zip", files.sorted_zip, lambda: zipDb(files.sorted_db, files.sorted_zip))
+    timed("packed_db", files.packed_db, lambda: pbindb.buildPackedDb(files.sorted_db, files.packed_db))
+    if not os.path.isfile(files.input_meta):
+        hits = generateInput(files.input_file, inputs, hit_ratio, lines, seed)
+        with open(files.input_meta, "w", encoding="utf-8") as meta_file:
+            json.dump({"hits": hits}, meta_file)
+    with open(files.input_meta, encoding="utf-8") as meta_file:
+        expected_hits = json.load(meta_file)["hits"]
+    return {"generation_secs": timings, "expected_hits": expected_hits}
+
+
+@contextlib.contextmanager
+def mockRangeServer(packed_db_file:str):
+    """ base url of a local range api (pwned_rangeserve.py) serving the hashes of the packed db """
+    server = prangeserve.makeRangeServer("http://127.0.0.1:0", prangeserve.RangeService(prangeserve.PackedDbRanges(packed_db_file)))
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    try:
+        yield prangeserve.rangeUrlOf(server)
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.service.ranges.close()
+
+
+def peakRssKb():
+    try:
+        import resource
+    except ImportError:
+        return None   #not available on Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak   #bytes on macOS, KB elsewhere
+
+
+def runCase(case:dict) -> dict:
+    """ run one benchmark case in this (fresh) process: see main """
+    import pwned
+    import pwned_stats as pstat
+    files = BenchFiles(case["work_dir"], case["lines"], case["inputs"], case["hit_ratio"], case["seed"])
+    mode = case["mode"]
+    db_mode, db_file, zip_file, zip_sorted, workers = {
+        "local":      (pwned.DB_LOCAL, files.unsorted_db, "", False, 1),
+        "local_mt":   (pwned.DB_LOCAL, files.unsorted_db, "", False, case["workers"]),
+        "sorted":     (pwned.DB_LOCAL_SORTED, files.sorted_db, "", False, 1),
+        "zip":        (pwned.DB_LOCAL_ZIP, os.path.basename(files.unsorted_db), files.unsorted_zip, False, 1),
+        "zip_sorted": (pwned.DB_LOCAL_ZIP, os.path.basename(files.sorted_db), files.sorted_zip, True, 1),
+        "packed":     (pwned.DB_LOCAL_PACKED, files.packed_db, "", False, 1),
+        "web":        (pwned.DB_WEB, "", "", False, 1),
+    }[mode]
+    loc_stats = pstat.PwnedStats()
+    result = {"name": case["kind"] + "/" + mode, "kind": case["kind"], "mode": mode}
+
+    with contextlib.ExitStack() as stack:
+        if mode == "web":
+            pwned.setRangeApiUrl(stack.enter_context(mockRangeServer(files.packed_db)))
+            pwned.getRangeClient(case["connections"], 0, case["max_rate"])
+        if not case["verbose"]:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w", encoding="utf-8"))))
+
+        if case["kind"] == "single":
+            rnd = random.Random(case["seed"])
+            passwords = [benchPassword(case["seed"], rnd.randrange(case["lines"])) if n % 2 == 0 else "miss-single-" + str(n)
+                         for n in range(case["lookups"])]
+            latency = pserve.LatencyRecorder(max(1, len(passwords)))
+            pwned_count = 0
+            start = time.perf_counter()
+            for the_password in passwords:
+                the_hash = benchHash(the_password)
+                lookup_start = time.perf_counter()
+                if db_mode == pwned.DB_LOCAL_ZIP:
+                    found = pwned.isHashPwnedLocalZip(the_hash, db_file, zip_file, zip_sorted)
+                elif db_mode == pwned.DB_LOCAL_SORTED:
+                    found = pwned.isHashPwnedLocalBinary(the_hash, db_file)
+                elif db_mode == pwned.DB_LOCAL_PACKED:
+                    found = pwned.isHashPwnedLocalPacked(the_hash, db_file)
+                elif db_mode == pwned.DB_WEB:
+                    found = pwned.isHashPwnedRemoteWithPwd(the_hash, the_password)
+                else:
+                    found = pwned.isHashPwnedLocal(the_hash, db_file)
+                latency.add(time.perf_counter() - lookup_start)
+                pwned_count += 1 if found else 0
+            elapsed = time.perf_counter() - start
+            result.update(records=len(passwords), expected_pwned=(len(passwords) + 1) // 2)
+            the_percentiles = latency.percentiles()
+            del the_percentiles["requests"]   #already in records
+            result.update(the_percentiles)
+        else:
+            start = time.perf_counter()
+            pwned.checkPlainPasswordFile(files.input_file, db_mode, db_file, "", pwned.OM_PLAIN, 0, workers, zip_file, zip_sorted,
+                                         case["connections"], case["chunk_size"], case["hash_workers"])
+            elapsed = time.perf_counter() - start
+            pwned_count = loc_stats.pwned_passwords_found
+            result.update(records=loc_stats.number_of_password_read, expected_pwned=case["expected_hits"])
+        pwned.closeRangeClient()
+
+    result.update(seconds=round(elapsed, 4), throughput_per_sec=round(result["records"] / elapsed, 1) if elapsed > 0 else 0.0,
+                  pwned=pwned_count, correct=(pwned_count == result["expected_pwned"]),
+                  scanned_lines_in_db=loc_stats.scanned_lines_in_db, peak_rss_kb=peakRssKb())
+    return result
+
+
+def runCaseInSubprocess(case:dict) -> dict:
+    """ fresh interpreter for each case: no state (stats, caches, peak RSS) carried over from the previous one """
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--run_case", json.dumps(case)],
+                               capture_output=True, text=True, check=False, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        return {"name": case["kind"] + "/" + case["mode"], "kind": case["kind"], "mode": case["mode"],
+                "error": (completed.stderr.strip().splitlines() or ["exit code " + str(completed.returncode)])[-1]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def gitCommit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compareResults(old_results:dict, new_results:dict, threshold:float=REGRESSION_THRESHOLD) -> list:
+    """ (name, old throughput, new throughput, ratio, regression) of the cases present in both """
+    old_by_name = {case["name"]: case for case in old_results.get("cases", []) if "throughput_per_sec" in case}
+    comparison = []
+    for case in new_results.get("cases", []):
+        old_case = old_by_name.get(case["name"])
+        if old_case is None or "throughput_per_sec" not in case or not old_case["throughput_per_sec"]:
+            continue
+        ratio = case["throughput_per_sec"] / old_case["throughput_per_sec"]
+        comparison.append((case["name"], old_case["throughput_per_sec"], case["throughput_per_sec"], ratio, ratio < 1 - threshold))
+    return comparison
+
+
+def showHelp():
+    print("pwned_bench.py - benchmarks of the pwned.py db modes on synthetic dbs")
+    print("  --lines n          lines of the generated dbs (default " + str(DEFAULT_LINES) + ")")
+    print("  --inputs n         passwords of the -f input file (default " + str(DEFAULT_INPUTS) + ")")
+    print("  --hit_ratio r      fraction of the input passwords in the db (default " + str(DEFAULT_HIT_RATIO) + ")")
+    print("  --lookups n        single password lookups per db mode (default " + str(DEFAULT_LOOKUPS) + ")")
+    print("  --modes m1,m2      db modes to run among " + ",".join(MODES) + " (default all)")
+    print("  --no_single        skip the single lookups, --no_batch skip the -f batches")
+    print("  --workers n        processes of local_mt (default 2), --hash_workers n for the batches (default 1)")
+    print("  --chunk_size n     -f chunk size (default: the one of each db mode)")
+    print("  --connections n    web requests in flight (default 8), --rate n max web requests/sec (default unlimited)")
+    print("  --seed n           seed of the generated files (default " + str(DEFAULT_SEED) + ")")
+    print("  --work_dir dir     where the generated files are kept and reused (default ./bench_data)")
+    print("  --results file     JSON results file (default bench_results.json)")
+    print("  --compare file     compare the throughput with an older results file")
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["--run_case"]:
+        print(json.dumps(runCase(json.loads(argv[1]))))
+        return 0
+    try:
+        arguments, _ = getopt.getopt(argv, "h", ["lines=", "inputs=", "hit_ratio=", "lookups=", "modes=", "no_single", "no_batch", "workers=",
+                                                 "hash_workers=", "chunk_size=", "connections=", "rate=", "seed=", "work_dir=", "results=",
+                                                 "compare=", "verbose", "help"])
+    except getopt.error as err:
+        print("Argument parsing error: " + str(err))
+        return 1
+    options = {"lines": DEFAULT_LINES, "inputs": DEFAULT_INPUTS, "hit_ratio": DEFAULT_HIT_RATIO, "lookups": DEFAULT_LOOKUPS,
+               "workers": 2, "hash_workers": 1, "chunk_size": 0, "connections": 8, "max_rate": 1e9, "seed": DEFAULT_SEED,
+               "verbose": False}
+    modes = list(MODES)
+    kinds = ["single", "batch"]
+    work_dir = "bench_data"
+    results_file = "bench_results.json"
+    compare_file = ""
+    try:
+        for currentArgument, currentValue in arguments:
+            if currentArgument in ("--lines", "--inputs", "--lookups", "--workers", "--hash_workers", "--chunk_size", "--connections", "--seed"):
+                options[currentArgument[2:]] = int(currentValue)
+            elif currentArgument == "--hit_ratio":
+                options["hit_ratio"] = float(currentValue)
+            elif currentArgument == "--rate":
+                options["max_rate"] = float(currentValue)
+            elif currentArgument == "--modes":
+                modes = [mode.strip() for mode in currentValue.split(",") if mode.strip()]
+                if not set(modes) <= set(MODES):
+                    print("ERROR: unknown mode in " + currentValue + " (use " + ",".join(MODES) + ")")
+                    return 1
+            elif currentArgument == "--no_single":
+                kinds.remove("single")
+            elif currentArgument == "--no_batch":
+                kinds.remove("batch")
+            elif currentArgument == "--work_dir":
+                work_dir = currentValue
+            elif currentArgument == "--results":
+                results_file = currentValue
+            elif currentArgument == "--compare":
+                compare_file = currentValue
+            elif currentArgument == "--verbose":
+                options["verbose"] = True
+            else:
+                showHelp()
+                return 0
+    except ValueError as e:
+        print("ERROR: " + str(e))
+        return 1
+    if options["lines"] < 1 or options["inputs"] < 1 or not 0 <= options["hit_ratio"] <= 1:
+        print("ERROR: --lines and --inputs must be at least 1, --hit_ratio between 0 and 1")
+        return 1
+
+    os.makedirs(work_dir, exist_ok=True)
+    work_dir = os.path.abspath(work_dir)
+    files = BenchFiles(work_dir, options["lines"], options["inputs"], options["hit_ratio"], options["seed"])
+    print("Preparing the files in " + work_dir + "...")
+    prepared = prepareFiles(files, options["lines"], options["inputs"], options["hit_ratio"], options["seed"])
+
+    results = {"bench_version": BENCH_VERSION, "commit": gitCommit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+               "parameters": dict(options, modes=modes, kinds=kinds), "generation_secs": prepared["generation_secs"], "cases": []}
+    for kind in kinds:
+        for mode in modes:
+            if kind == "single" and mode not in SINGLE_LOOKUP_MODES:
+                continue
+            case = dict(options, kind=kind, mode=mode, work_dir=work_dir, expected_hits=prepared["expected_hits"])
+            case_result = runCaseInSubprocess(case)
+            results["cases"].append(case_result)
+            if "error" in case_result:
+                print(f"{case_result['name']:<18} ERROR {case_result['error']}")
+            else:
+                latency = f"p99 {case_result['p99_ms']:>10.3f} ms" if "p99_ms" in case_result else " " * 17
+                print(f"{case_result['name']:<18} {case_result['throughput_per_sec']:>14,.1f} /s  {latency}  "
+                      f"rss {case_result['peak_rss_kb'] or 0:>9,} KB  {'ok' if case_result['correct'] else 'WRONG pwned count'}")
+
+    with open(results_file, "w", encoding="utf-8") as the_file:
+        json.dump(results, the_file, indent=2)
+    print("Results written to " + results_file)
+
+    if compare_file:
+        with open(compare_file, encoding="utf-8") as the_file:
+            old_results = json.load(the_file)
+        print("Compared with " + compare_file + " (commit " + str(old_results.get("commit", "")) + "):")
+        for name, old_throughput, new_throughput, ratio, regression in compareResults(old_results, results):
+            print(f"{name:<18} {old_throughput:>14,.1f} -> {new_throughput:>14,.1f} /s  x{ratio:.2f}{'  REGRESSION' if regression else ''}")
+    return 0 if all(case.get("correct") for case in results["cases"]) else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Packed binary hash DB used by pwned.py (-m switch).
+#
+# File layout (all integers little endian):
+#   header : 8 bytes magic "PWNBIN01" + 8 bytes number of records (N)
+#   digests: N * 20 bytes, raw SHA1 digests sorted ascending
+#   counts : N * 4 bytes, unsigned breach counts (saturated at 0xFFFFFFFF)
+#
+# The digest column is searched directly in the memory-mapped file, so a lookup
+# is a binary search of byte comparisons with no text decoding at all.
+import binascii
+import mmap
+import shutil
+import struct
+import tempfile
+
+PACKED_MAGIC:bytes      = b"PWNBIN01"
+PACKED_HEADER           = struct.Struct("<8sQ")
+PACKED_COUNT            = struct.Struct("<I")
+PACKED_DIGEST_SIZE:int  = 20
+PACKED_MAX_COUNT:int    = 0xFFFFFFFF
+
+
+class PackedDBError(Exception):
+    """ Raised when a file is not a valid packed hash DB, or cannot be built. """
+
+
+def parseDbLine(the_line: bytes):
+    """ Split a 'HASH:count' line (bytes) into (20 bytes digest, count). Returns None for lines to skip. """
+    the_line = the_line.strip()
+    if not the_line:
+        return None
+    parts = the_line.split(b":")
+    try:
+        digest = binascii.unhexlify(parts[0])
+    except (binascii.Error, ValueError):
+        return None
+    if len(digest) != PACKED_DIGEST_SIZE:
+        return None
+    count = 0
+    if len(parts) > 1:
+        try:
+            count = int(parts[1])
+        except ValueError:
+            count = 0
+    return digest, min(count, PACKED_MAX_COUNT)
+
+
+def openTextDb(l_local_db_file:str, l_local_zip_file:str=""):
+    """ Open the text DB (plain or inside a zip) as a binary line iterator. """
+    if l_local_zip_file:
+        import zipfile   #only loaded when a zipped db is used
+        the_zip = zipfile.ZipFile(l_local_zip_file)
+        try:
+            return _ZipMember(the_zip, the_zip.open(l_local_db_file))
+        except KeyError as e:
+            the_zip.close()
+            raise PackedDBError(l_local_db_file + " file NOT FOUND inside " + l_local_zip_file) from e
+    return open(l_local_db_file, "rb")
+
+
+class _ZipMember:
+    """ Keep the ZipFile alive (and close it) together with the opened member. """
+    def __init__(self, the_zip, the_member):
+        self.the_zip = the_zip
+        self.the_member = the_member
+
+    def __iter__(self):
+        return iter(self.the_member)
+
+    def read(self, size:int=-1) -> bytes:
+        return self.the_member.read(size)
+
+    def readline(self) -> bytes:
+        return self.the_member.readline()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.the_member.close()
+        self.the_zip.close()
+
+
+def writePackedDb(out_filename:str, sorted_records) -> int:
+    """ Write an iterable of (digest, count) already sorted by digest. Duplicated digests are merged summing counts.
+        Returns the number of records written. Raises PackedDBError if the input is not sorted.
+    """
+    number_of_records:int = 0
+    with open(out_filename, "wb") as out_file, tempfile.TemporaryFile() as counts_file:
+        out_file.write(PACKED_HEADER.pack(PACKED_MAGIC, 0))
+        last_digest = None
+        last_count:int = 0
+        for digest, count in sorted_records:
+            if last_digest is not None:
+                if digest == last_digest:
+                    last_count = min(last_count + count, PACKED_MAX_COUNT)
+                    continue
+                if digest < last_digest:
+                    raise PackedDBError("input is not sorted")
+                out_file.write(last_digest)
+                counts_file.write(PACKED_COUNT.pack(last_count))
+                number_of_records += 1
+            last_digest = digest
+            last_count = count
+        if last_digest is not None:
+            out_file.write(last_digest)
+            counts_file.write(PACKED_COUNT.pack(last_count))
+            number_of_records += 1
+
+        counts_file.seek(0)
+        shutil.copyfileobj(counts_file, out_file)
+        out_file.seek(0)
+        out_file.write(PACKED_HEADER.pack(PACKED_MAGIC, number_of_records))
+    return number_of_records
+
+
+def buildPackedDb(l_local_db_file:str, out_filename:str, l_local_zip_file:str="") -> int:
+    """ Convert a HASH:count text DB (plain or zipped) to the packed binary format.
+        A sorted input is converted in a single streaming pass, otherwise it is sorted in memory.
+    """
+    def iterRecords():
+        with openTextDb(l_local_db_file, l_local_zip_file) as db_file:
+            for the_line in db_file:
+                record = parseDbLine(the_line)
+                if record is not None:
+                    yield record
+
+    try:
+        return writePackedDb(out_filename, iterRecords())
+    except PackedDBError as e:
+        if str(e) != "input is not sorted":
+            raise
+    # not sorted (i.e. the "ordered by prevalence" download): sort in memory and retry
+    all_records = sorted(iterRecords(), key=lambda record: record[0])
+    return writePackedDb(out_filename, all_records)
+
+
+class PackedHashDB:
+    """ Read only, memory mapped view of a packed binary hash DB. """
+
+    def __init__(self, filename:str):
+        self.filename:str = filename
+        self._file = open(filename, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            self._file.close()
+            raise PackedDBError(filename + " is not a packed hash DB (empty file)") from e
+
+        if len(self._map) < PACKED_HEADER.size:
+            self.close()
+            raise PackedDBError(filename + " is not a packed hash DB (file too short)")
+        magic, self.number_of_records = PACKED_HEADER.unpack_from(self._map, 0)
+        expected_size = PACKED_HEADER.size + self.number_of_records * (PACKED_DIGEST_SIZE + PACKED_COUNT.size)
+        if magic != PACKED_MAGIC or len(self._map) != expected_size:
+            self.close()
+            raise PackedDBError(filename + " is not a packed hash DB (bad header)")
+
+        self._digests_offset:int = PACKED_HEADER.size
+        self._counts_offset:int  = PACKED_HEADER.size + self.number_of_records * PACKED_DIGEST_SIZE
+        self.probes:int = 0   #number of digests compared, cumulative
+
+    def __len__(self) -> int:
+        return self.number_of_records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, digest:bytes) -> bool:
+        return self.find(digest) >= 0
+
+    def close(self) -> None:
+        if getattr(self, "_map", None) is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def digest_at(self, index:int) -> bytes:
+        offset = self._digests_offset + index * PACKED_DIGEST_SIZE
+        return self._map[offset:offset + PACKED_DIGEST_SIZE]
+
+    def count_at(self, index:int) -> int:
+        return PACKED_COUNT.unpack_from(self._map, self._counts_offset + index * PACKED_COUNT.size)[0]
+
+    def find(self, digest:bytes, low:int=0) -> int:
+        """ Binary search of a 20 bytes digest. Returns its index or -1 if not present. """
+        high = self.number_of_records
+        the_map = self._map
+        base = self._digests_offset
+        while low < high:
+            self.probes += 1
+            mid = (low + high) // 2
+            offset = base + mid * PACKED_DIGEST_SIZE
+            current = the_map[offset:offset + PACKED_DIGEST_SIZE]
+            if current < digest:
+                low = mid + 1
+            elif current > digest:
+                high = mid
+            else:
+                return mid
+        return -1
+
+    def lower_bound(self, digest:bytes) -> int:
+        """ index of the first digest >= digest (len(self) if none): the start of a range of prefixes """
+        low, high = 0, self.number_of_records
+        the_map = self._map
+        base = self._digests_offset
+        while low < high:
+            mid = (low + high) // 2
+            offset = base + mid * PACKED_DIGEST_SIZE
+            if the_map[offset:offset + PACKED_DIGEST_SIZE] < digest:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def get_count(self, digest:bytes) -> int:
+        """ Breach count of digest, 0 if not present. """
+        index = self.find(digest)
+        if index < 0:
+            return 0
+        return self.count_at(index)
+
+    def lookup_hex(self, hex_hash:str) -> bool:
+        """ Same as 'in' but taking the 40 chars hex representation used everywhere else in pwned.py """
+        try:
+            digest = binascii.unhexlify(hex_hash)
+        except (binascii.Error, ValueError, TypeError):
+            return False
+        if len(digest) != PACKED_DIGEST_SIZE:
+            return False
+        return self.find(digest) >= 0
+
+    def iter_records(self):
+        """ (digest, count) of every record, in order """
+        for i in range(self.number_of_records):
+            yield self.digest_at(i), self.count_at(i)
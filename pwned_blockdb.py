@@ -0,0 +1,372 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Block compressed, seekable hash DB used by pwned.py (-c switch), built with --build_block_db.
+#
+# File layout (all integers little endian):
+#   header : 8 bytes magic "PWNBLK01" + 8 bytes number of records (N) + 4 bytes records per block (R)
+#            + 4 bytes zlib level + 8 bytes number of blocks (B)
+#   blocks : B blocks of R sorted records (the last one may be shorter), each one:
+#            1 byte K, the length of the prefix shared by all its digests (front coding)
+#            + the 20 - K bytes suffixes of its digests, ascending
+#            + the zlib compressed 4 bytes unsigned counts of its records (saturated at 0xFFFFFFFF)
+#   index  : B * 20 bytes first digest of each block + (B + 1) * 8 bytes offset of each block (the last one is
+#            the offset of the index itself)
+#
+# SHA1 digests are random bytes that zlib cannot shrink: they are stored without their shared prefix only, while the
+# counts compress well. About 20 bytes per hash (18 for the full HIBP db) against 45 of the text db.
+# The index (28 bytes per block) is read in memory when the db is opened. A lookup is a binary search in the index,
+# then a binary search among the suffixes of one block in the memory mapped file: no decompression at all. Only the
+# breach counts need to decompress the counts of their block; the last ones are kept (BLOCK_CACHE_SIZE).
+import binascii
+import collections
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+
+import pwned_bindb as pbindb
+
+BLOCK_MAGIC:bytes           = b"PWNBLK01"
+BLOCK_HEADER                = struct.Struct("<8sQIIQ")
+BLOCK_OFFSET_SIZE:int       = 8
+BLOCK_DEFAULT_RECORDS:int   = 4096     #records per block: 16 KB of counts decompressed per count lookup
+BLOCK_DEFAULT_LEVEL:int     = 6
+BLOCK_CACHE_SIZE:int        = 8
+DIGEST_SIZE:int             = pbindb.PACKED_DIGEST_SIZE
+MAX_COUNT:int               = pbindb.PACKED_MAX_COUNT
+
+
+class BlockDBError(Exception):
+    """ Raised when a file is not a valid block compressed hash DB, or cannot be built. """
+
+
+class InputNotSortedError(BlockDBError):
+    """ Raised by writeBlockDb: buildBlockDb sorts the input and tries again. """
+
+
+def sharedPrefixLength(first:bytes, last:bytes) -> int:
+    length = 0
+    while length < DIGEST_SIZE - 1 and first[length] == last[length]:
+        length += 1
+    return length
+
+
+def encodeBlock(digests:list, counts:array, level:int) -> bytes:
+    shared = sharedPrefixLength(digests[0], digests[-1])
+    if sys.byteorder != "little":
+        counts = array("I", counts)
+        counts.byteswap()
+    return bytes((shared,)) + b"".join(digest[shared:] for digest in digests) + zlib.compress(counts.tobytes(), level)
+
+
+def writeBlockDb(out_filename:str, sorted_records, records_per_block:int=BLOCK_DEFAULT_RECORDS, level:int=BLOCK_DEFAULT_LEVEL) -> int:
+    """ Write an iterable of (digest, count) already sorted by digest. Duplicated digests are merged summing counts.
+        Returns the number of records written. Raises InputNotSortedError if the input is not sorted.
+    """
+    if records_per_block < 1:
+        raise BlockDBError("records per block must be at least 1")
+    number_of_records:int = 0
+    first_digests = bytearray()
+    offsets = array("Q")
+    digests = []
+    counts = array("I")
+
+    with open(out_filename, "wb") as out_file:
+        out_file.write(BLOCK_HEADER.pack(BLOCK_MAGIC, 0, records_per_block, level, 0))
+
+        def flushBlock():
+            first_digests.extend(digests[0])
+            offsets.append(out_file.tell())
+            out_file.write(encodeBlock(digests, counts, level))
+            digests.clear()
+            del counts[:]
+
+        def addRecord(digest, count):
+            nonlocal number_of_records
+            digests.append(digest)
+            counts.append(count)
+            number_of_records += 1
+            if len(digests) >= records_per_block:
+                flushBlock()
+
+        last_digest = None
+        last_count:int = 0
+        for digest, count in sorted_records:
+            if last_digest is not None:
+                if digest == last_digest:
+                    last_count = min(last_count + count, MAX_COUNT)
+                    continue
+                if digest < last_digest:
+                    raise InputNotSortedError("input is not sorted")
+                addRecord(last_digest, last_count)
+            last_digest = digest
+            last_count = min(count, MAX_COUNT)
+        if last_digest is not None:
+            addRecord(last_digest, last_count)
+        if digests:
+            flushBlock()
+
+        offsets.append(out_file.tell())
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        out_file.write(first_digests)
+        out_file.write(offsets.tobytes())
+        out_file.seek(0)
+        out_file.write(BLOCK_HEADER.pack(BLOCK_MAGIC, number_of_records, records_per_block, level, len(first_digests) // DIGEST_SIZE))
+    return number_of_records
+
+
+def iterTextDbRecords(l_local_db_file:str, l_local_zip_file:str=""):
+    with pbindb.openTextDb(l_local_db_file, l_local_zip_file) as db_file:
+        for the_line in db_file:
+            record = pbindb.parseDbLine(the_line)
+            if record is not None:
+                yield record
+
+
+def buildBlockDb(l_local_db_file:str, out_filename:str, l_local_zip_file:str="", records_per_block:int=BLOCK_DEFAULT_RECORDS,
+                 level:int=BLOCK_DEFAULT_LEVEL, workers:int=1) -> int:
+    """ Convert a HASH:count text DB (plain or inside l_local_zip_file) to a block compressed DB.
+        A db that is not sorted is first sorted on disk (pwned_sort.py). Returns the number of records written.
+    """
+    try:
+        return writeBlockDb(out_filename, iterTextDbRecords(l_local_db_file, l_local_zip_file), records_per_block, level)
+    except InputNotSortedError:
+        pass
+    import pwned_sort as psort   #only needed for unsorted dbs (e.g. the "ordered by prevalence" download)
+    sorted_filename = out_filename + ".sorted.tmp"
+    try:
+        psort.sortDb(l_local_db_file, sorted_filename, l_local_zip_file, workers)
+        return writeBlockDb(out_filename, iterTextDbRecords(sorted_filename), records_per_block, level)
+    finally:
+        if os.path.isfile(sorted_filename):
+            os.remove(sorted_filename)
+
+
+def openBinaryDb(l_db_file:str):
+    """ The PackedHashDB (pwned_bindb.py) or BlockHashDB of l_db_file, None if it is neither (a text db) """
+    try:
+        return pbindb.PackedHashDB(l_db_file)
+    except pbindb.PackedDBError:
+        pass
+    try:
+        return BlockHashDB(l_db_file)
+    except BlockDBError:
+        return None
+
+
+class BlockHashDB:
+    """ Read only, memory mapped view of a block compressed hash DB: same lookups as pwned_bindb.PackedHashDB. """
+
+    def __init__(self, filename:str):
+        self.filename:str = filename
+        self._file = open(filename, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            self._file.close()
+            raise BlockDBError(filename + " is not a block compressed hash DB (empty file)") from e
+
+        if len(self._map) < BLOCK_HEADER.size:
+            self.close()
+            raise BlockDBError(filename + " is not a block compressed hash DB (file too short)")
+        magic, self.number_of_records, self.records_per_block, self.level, self.number_of_blocks = BLOCK_HEADER.unpack_from(self._map, 0)
+        index_size = self.number_of_blocks * (DIGEST_SIZE + BLOCK_OFFSET_SIZE) + BLOCK_OFFSET_SIZE
+        index_start = len(self._map) - index_size
+        if magic != BLOCK_MAGIC or self.records_per_block < 1 or index_start < BLOCK_HEADER.size or \
+           self.number_of_blocks != (self.number_of_records + self.records_per_block - 1) // self.records_per_block:
+            self.close()
+            raise BlockDBError(filename + " is not a block compressed hash DB (bad header)")
+        self._first_digests:bytes = self._map[index_start:index_start + self.number_of_blocks * DIGEST_SIZE]
+        self._offsets = array("Q")
+        self._offsets.frombytes(self._map[index_start + self.number_of_blocks * DIGEST_SIZE:])
+        if sys.byteorder != "little":
+            self._offsets.byteswap()
+        if self._offsets[-1] != index_start or (self.number_of_blocks and self._offsets[0] != BLOCK_HEADER.size):
+            self.close()
+            raise BlockDBError(filename + " is not a block compressed hash DB (bad index)")
+
+        self._counts_cache = collections.OrderedDict()   #block number -> counts array, least recently used first
+        self._lock = threading.Lock()
+        self.probes:int = 0        #number of digests compared, cumulative
+        self.blocks_read:int = 0   #number of count columns decompressed, cumulative
+
+    def __len__(self) -> int:
+        return self.number_of_records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, digest:bytes) -> bool:
+        return self.find(digest) >= 0
+
+    def close(self) -> None:
+        if getattr(self, "_map", None) is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._counts_cache = collections.OrderedDict()
+
+    def first_digest_of(self, block_number:int) -> bytes:
+        start = block_number * DIGEST_SIZE
+        return self._first_digests[start:start + DIGEST_SIZE]
+
+    def block_of(self, digest:bytes) -> int:
+        """ number of the only block that can contain digest, -1 if it is before the first one """
+        low, high = 0, self.number_of_blocks
+        while low < high:
+            self.probes += 1
+            mid = (low + high) // 2
+            if self.first_digest_of(mid) <= digest:
+                low = mid + 1
+            else:
+                high = mid
+        return low - 1
+
+    def records_in(self, block_number:int) -> int:
+        if block_number < self.number_of_blocks - 1:
+            return self.records_per_block
+        return self.number_of_records - block_number * self.records_per_block
+
+    def _suffixes_of(self, block_number:int):
+        """ (shared prefix length, offset of the suffixes in the file, offset of the compressed counts) """
+        start = self._offsets[block_number]
+        shared = self._map[start]
+        suffixes_start = start + 1
+        return shared, suffixes_start, suffixes_start + self.records_in(block_number) * (DIGEST_SIZE - shared)
+
+    def counts_of(self, block_number:int) -> array:
+        """ breach counts of the records of a block: the only part of the db that is decompressed """
+        with self._lock:
+            counts = self._counts_cache.get(block_number)
+            if counts is not None:
+                self._counts_cache.move_to_end(block_number)
+                return counts
+        counts_start = self._suffixes_of(block_number)[2]
+        try:
+            data = zlib.decompress(self._map[counts_start:self._offsets[block_number + 1]])
+        except zlib.error as e:
+            raise BlockDBError(self.filename + ": corrupted block " + str(block_number) + ": " + str(e)) from e
+        counts = array("I")
+        counts.frombytes(data)
+        if sys.byteorder != "little":
+            counts.byteswap()
+        if len(counts) != self.records_in(block_number):
+            raise BlockDBError(self.filename + ": corrupted block " + str(block_number))
+        with self._lock:
+            self.blocks_read += 1
+            self._counts_cache[block_number] = counts
+            if len(self._counts_cache) > BLOCK_CACHE_SIZE:
+                self._counts_cache.popitem(last=False)
+        return counts
+
+    def find(self, digest:bytes) -> int:
+        """ Index of a 20 bytes digest, -1 if not present: one binary search in the index, one in a block """
+        block_number = self.block_of(digest)
+        if block_number < 0:
+            return -1
+        shared, suffixes_start, _ = self._suffixes_of(block_number)
+        if digest[:shared] != self.first_digest_of(block_number)[:shared]:
+            return -1
+        target = digest[shared:]
+        width = DIGEST_SIZE - shared
+        the_map = self._map
+        low, high = 0, self.records_in(block_number)
+        while low < high:
+            self.probes += 1
+            mid = (low + high) // 2
+            offset = suffixes_start + mid * width
+            current = the_map[offset:offset + width]
+            if current < target:
+                low = mid + 1
+            elif current > target:
+                high = mid
+            else:
+                return block_number * self.records_per_block + mid
+        return -1
+
+    def lower_bound(self, digest:bytes) -> int:
+        """ index of the first digest >= digest (len(self) if none): the start of a range of prefixes """
+        block_number = self.block_of(digest)
+        if block_number < 0:
+            return 0
+        shared, suffixes_start, _ = self._suffixes_of(block_number)
+        block_start = block_number * self.records_per_block
+        if digest[:shared] != self.first_digest_of(block_number)[:shared]:
+            return block_start + self.records_in(block_number)   #every digest of the block is smaller
+        target = digest[shared:]
+        width = DIGEST_SIZE - shared
+        the_map = self._map
+        low, high = 0, self.records_in(block_number)
+        while low < high:
+            mid = (low + high) // 2
+            offset = suffixes_start + mid * width
+            if the_map[offset:offset + width] < target:
+                low = mid + 1
+            else:
+                high = mid
+        return block_start + low
+
+    def digest_at(self, index:int) -> bytes:
+        block_number, position = divmod(index, self.records_per_block)
+        shared, suffixes_start, _ = self._suffixes_of(block_number)
+        offset = suffixes_start + position * (DIGEST_SIZE - shared)
+        return self.first_digest_of(block_number)[:shared] + self._map[offset:offset + DIGEST_SIZE - shared]
+
+    def count_at(self, index:int) -> int:
+        block_number, position = divmod(index, self.records_per_block)
+        return self.counts_of(block_number)[position]
+
+    def get_count(self, digest:bytes) -> int:
+        """ Breach count of digest, 0 if not present. """
+        index = self.find(digest)
+        return self.count_at(index) if index >= 0 else 0
+
+    def lookup_hex(self, hex_hash:str) -> bool:
+        """ True if the (40 hex chars) SHA1 is in the DB. """
+        try:
+            digest = binascii.unhexlify(hex_hash.strip())
+        except (binascii.Error, ValueError):
+            return False
+        if len(digest) != DIGEST_SIZE:
+            return False
+        return self.find(digest) >= 0
+
+    def iter_records(self):
+        """ (digest, count) of every record, in order """
+        for block_number in range(self.number_of_blocks):
+            shared, suffixes_start, counts_start = self._suffixes_of(block_number)
+            prefix = self.first_digest_of(block_number)[:shared]
+            width = DIGEST_SIZE - shared
+            suffixes = self._map[suffixes_start:counts_start]
+            for position, count in enumerate(self.counts_of(block_number)):
+                yield prefix + suffixes[position * width:(position + 1) * width], count
@@ -0,0 +1,132 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Persistent cache of the parsed /range/ responses (pwned.py --cache), stored in a SQLite file.
+#
+# Each row keeps one prefix, its suffix:count lines (zlib compressed), the time it was downloaded and
+# the time it was last used. Rows older than the TTL are downloaded again, and the least recently used
+# rows are evicted when the total (compressed) size goes over the cap.
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_CACHE_TTL_HOURS:float = 24
+DEFAULT_CACHE_SIZE_MB:int     = 256
+COMMIT_EVERY:int              = 100   #writes between two commits
+
+
+def packSuffixes(suffixes:dict) -> bytes:
+    the_text = "\n".join(suffix + ":" + str(count) for suffix, count in suffixes.items())
+    return zlib.compress(the_text.encode("ascii"))
+
+
+def unpackSuffixes(data:bytes) -> dict:
+    suffixes = {}
+    for the_line in zlib.decompress(data).decode("ascii").splitlines():
+        suffix, _, count = the_line.partition(":")
+        suffixes[suffix] = int(count)
+    return suffixes
+
+
+class RangeCache:
+    """ prefix -> {suffix: count} cache with TTL and LRU eviction. Thread safe. """
+
+    def __init__(self, filename:str, ttl_hours:float=DEFAULT_CACHE_TTL_HOURS, max_size_mb:float=DEFAULT_CACHE_SIZE_MB):
+        self.filename:str = filename
+        self.ttl_secs:float = ttl_hours * 3600
+        self.max_size_bytes:int = int(max_size_mb * 1024 * 1024)
+        self.hits:int = 0
+        self.misses:int = 0
+        self.evictions:int = 0
+        self._lock = threading.Lock()
+        self._pending_writes:int = 0
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS ranges ("
+                                 "prefix TEXT PRIMARY KEY, fetched_at REAL NOT NULL, last_access REAL NOT NULL, "
+                                 "size INTEGER NOT NULL, data BLOB NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ranges_last_access ON ranges (last_access)")
+        self._connection.commit()
+        self._total_size:int = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM ranges").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
+
+    def get(self, prefix:str):
+        """ The cached suffixes of prefix, or None if missing or expired. """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT fetched_at, data FROM ranges WHERE prefix = ?", (prefix,)).fetchone()
+            if row is None or (now - row[0]) > self.ttl_secs:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute("UPDATE ranges SET last_access = ? WHERE prefix = ?", (now, prefix))
+            self._written()
+        return unpackSuffixes(row[1])
+
+    def put(self, prefix:str, suffixes:dict) -> None:
+        data = packSuffixes(suffixes)
+        now = time.time()
+        with self._lock:
+            old_row = self._connection.execute("SELECT size FROM ranges WHERE prefix = ?", (prefix,)).fetchone()
+            if old_row is not None:
+                self._total_size -= old_row[0]
+            self._connection.execute("INSERT OR REPLACE INTO ranges (prefix, fetched_at, last_access, size, data) VALUES (?, ?, ?, ?, ?)",
+                                     (prefix, now, now, len(data), data))
+            self._total_size += len(data)
+            if self._total_size > self.max_size_bytes:
+                self._evict()
+            self._written()
+
+    def _evict(self) -> None:
+        """ Remove least recently used ranges until the cache is 10% below its cap. """
+        target_size = int(self.max_size_bytes * 0.9)
+        rows = self._connection.execute("SELECT prefix, size FROM ranges ORDER BY last_access ASC").fetchall()
+        to_delete = []
+        for prefix, size in rows:
+            if self._total_size <= target_size:
+                break
+            to_delete.append((prefix,))
+            self._total_size -= size
+        self._connection.executemany("DELETE FROM ranges WHERE prefix = ?", to_delete)
+        self.evictions += len(to_delete)
+
+    def _written(self) -> None:
+        self._pending_writes += 1
+        if self._pending_writes >= COMMIT_EVERY:
+            self._connection.commit()
+            self._pending_writes = 0
+
+    def total_size(self) -> int:
+        return self._total_size
@@ -0,0 +1,273 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Bloom filter ("sidecar") of a db used by pwned.py to answer "not pwned" without reading the db.
+#
+# The sidecar is <db filename>.bloom (<zip filename>.bloom with -z) and contains (little endian):
+#   header : 8 bytes magic "PWNBLM01" + 8 bytes number of bits + 8 bytes number of hashes added
+#            + 8 bytes size of the db it was built from + 4 bytes number of bit positions per hash
+#   bits   : the bit array
+#
+# SHA1 digests are already uniformly distributed, so the bit positions are derived straight from the
+# digest bytes (double hashing) without hashing again. A negative answer is exact, a positive one must
+# be confirmed by the db: about 9.6 bits per hash give 1% false positives (~1 GB for the full corpus).
+import binascii
+import math
+import mmap
+import os
+import shutil
+import struct
+
+import pwned_bindb as pbindb
+import pwned_blockdb as pblockdb
+
+FILTER_MAGIC:bytes          = b"PWNBLM01"
+FILTER_HEADER               = struct.Struct("<8sQQQI")
+FILTER_SUFFIX:str           = ".bloom"
+FILTER_DEFAULT_FP_RATE:float = 0.01
+MIN_TEXT_LINE_BYTES:int     = 43   #"<40 hex chars>:1\n": the number of lines of a text db is at most its size / 43
+
+
+class BloomFilterError(Exception):
+    """ Raised when the filter cannot be built or does not match its db. """
+
+
+def filterFilenameFor(l_db_file:str) -> str:
+    return l_db_file + FILTER_SUFFIX
+
+
+def filterParameters(capacity:int, fp_rate:float):
+    """ (number of bits, bit positions per hash) for capacity hashes at fp_rate false positives """
+    if not 0 < fp_rate < 1:
+        raise BloomFilterError("the false positive rate must be between 0 and 1")
+    capacity = max(1, capacity)
+    number_of_bits = max(64, int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))))
+    number_of_bits = (number_of_bits + 7) // 8 * 8
+    positions = min(16, max(1, int(round(number_of_bits / capacity * math.log(2)))))
+    return number_of_bits, positions
+
+
+def bitPositions(digest:bytes, number_of_bits:int, positions:int):
+    h1 = int.from_bytes(digest[0:8], "little")
+    h2 = int.from_bytes(digest[8:16], "little") | 1
+    return [(h1 + i * h2) % number_of_bits for i in range(positions)]
+
+
+class BloomFilterBuilder:
+    """ In memory bit array being filled, see buildFilter """
+
+    def __init__(self, capacity:int, fp_rate:float=FILTER_DEFAULT_FP_RATE):
+        self.number_of_bits, self.positions = filterParameters(capacity, fp_rate)
+        self.bits = bytearray(self.number_of_bits // 8)
+        self.count:int = 0
+
+    def add(self, digest:bytes) -> None:
+        bits = self.bits
+        for position in bitPositions(digest, self.number_of_bits, self.positions):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def write(self, filename:str, db_size:int) -> None:
+        with open(filename, "wb") as filter_file:
+            filter_file.write(FILTER_HEADER.pack(FILTER_MAGIC, self.number_of_bits, self.count, db_size, self.positions))
+            filter_file.write(self.bits)
+
+
+def buildFilter(l_db_file:str, fp_rate:float=FILTER_DEFAULT_FP_RATE, l_local_zip_file:str="", filter_filename:str="") -> str:
+    """ Stream the db once (HASH:count text, plain or inside l_local_zip_file, packed or block compressed) and write its filter.
+        Returns the filter file name (by default the sidecar of the db, or of the zip).
+    """
+    attached_file = l_local_zip_file or l_db_file
+    filter_filename = filter_filename or filterFilenameFor(attached_file)
+    binary_db = None if l_local_zip_file else pblockdb.openBinaryDb(l_db_file)
+    if binary_db is not None:
+        with binary_db:
+            builder = BloomFilterBuilder(len(binary_db), fp_rate)
+            for digest, _ in binary_db.iter_records():
+                builder.add(digest)
+    else:
+        if l_local_zip_file:
+            import zipfile
+            with zipfile.ZipFile(l_local_zip_file) as the_zip:
+                try:
+                    text_size = the_zip.getinfo(l_db_file).file_size
+                except KeyError as e:
+                    raise BloomFilterError(l_db_file + " file NOT FOUND inside " + l_local_zip_file) from e
+        else:
+            text_size = os.path.getsize(l_db_file)
+        builder = BloomFilterBuilder(text_size // MIN_TEXT_LINE_BYTES + 1, fp_rate)
+        with pbindb.openTextDb(l_db_file, l_local_zip_file) as text_db:
+            for the_line in text_db:
+                parsed = pbindb.parseDbLine(the_line)
+                if parsed is not None:
+                    builder.add(parsed[0])
+    builder.write(filter_filename, os.path.getsize(attached_file))
+    return filter_filename
+
+
+def estimatedFpRate(number_of_bits:int, positions:int, count:int) -> float:
+    """ false positive rate of a filter of number_of_bits with count hashes added """
+    return (1 - math.exp(-positions * count / number_of_bits)) ** positions
+
+
+class BloomFilterPatcher:
+    """ Adds hashes to an existing filter file, for a db updated in place (see pwned_update.py).
+        The filter keeps its size: its false positive rate grows with the hashes added (estimated_fp_rate).
+    """
+
+    def __init__(self, filter_filename:str, old_db_size:int, out_filter_filename:str=""):
+        if out_filter_filename and out_filter_filename != filter_filename:
+            shutil.copyfile(filter_filename, out_filter_filename)
+            filter_filename = out_filter_filename
+        self.filter_filename:str = filter_filename
+        self._file = open(self.filter_filename, "r+b")
+        self._map = None
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            magic, self.number_of_bits, self.count, db_size, self.positions = FILTER_HEADER.unpack_from(self._map, 0)
+            if magic != FILTER_MAGIC or self.positions < 1 or self.number_of_bits < 8:
+                raise BloomFilterError(self.filter_filename + " is not a valid filter file")
+            if len(self._map) != FILTER_HEADER.size + self.number_of_bits // 8:
+                raise BloomFilterError(self.filter_filename + " is truncated")
+            if db_size != old_db_size:
+                raise BloomFilterError(self.filter_filename + " is stale (db size changed). Rebuild it with --build_filter")
+        except (ValueError, struct.error) as e:
+            self.abort()
+            raise BloomFilterError(self.filter_filename + " is not a valid filter file") from e
+        except BloomFilterError:
+            self.abort()
+            raise
+
+    def add(self, digest:bytes) -> None:
+        the_map = self._map
+        offset = FILTER_HEADER.size
+        for position in bitPositions(digest, self.number_of_bits, self.positions):
+            the_map[offset + (position >> 3)] |= 1 << (position & 7)
+        self.count += 1
+
+    def estimated_fp_rate(self) -> float:
+        return estimatedFpRate(self.number_of_bits, self.positions, self.count)
+
+    def close(self, new_db_size:int) -> None:
+        """ write the new header (hashes count and size of the updated db) and close the file """
+        FILTER_HEADER.pack_into(self._map, 0, FILTER_MAGIC, self.number_of_bits, self.count, new_db_size, self.positions)
+        self._map.flush()
+        self.abort()
+
+    def abort(self) -> None:
+        """ close without updating the header: the filter stays stale for the old db """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class BloomFilter:
+    """ Memory mapped filter. might_contain is False only for hashes that are surely not in the db. """
+
+    def __init__(self, l_db_file:str, filter_filename:str=""):
+        self.filter_filename:str = filter_filename or filterFilenameFor(l_db_file)
+        self._file = open(self.filter_filename, "rb")
+        self._map = None
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.number_of_bits, self.count, db_size, self.positions = FILTER_HEADER.unpack_from(self._map, 0)
+            if magic != FILTER_MAGIC or self.positions < 1 or self.number_of_bits < 8:
+                raise BloomFilterError(self.filter_filename + " is not a valid filter file")
+            if len(self._map) != FILTER_HEADER.size + self.number_of_bits // 8:
+                raise BloomFilterError(self.filter_filename + " is truncated")
+            if db_size != os.path.getsize(l_db_file):
+                raise BloomFilterError(self.filter_filename + " is stale (db size changed). Rebuild it with --build_filter")
+        except (ValueError, struct.error) as e:
+            self.close()
+            raise BloomFilterError(self.filter_filename + " is not a valid filter file") from e
+        except BloomFilterError:
+            self.close()
+            raise
+        self.negatives:int = 0   #lookups answered by the filter alone, cumulative
+        self.positives:int = 0   #lookups that still need the db
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def might_contain(self, digest:bytes) -> bool:
+        the_map = self._map
+        offset = FILTER_HEADER.size
+        for position in bitPositions(digest, self.number_of_bits, self.positions):
+            if not the_map[offset + (position >> 3)] & (1 << (position & 7)):
+                self.negatives += 1
+                return False
+        self.positives += 1
+        return True
+
+    def might_contain_hex(self, hex_hash:str) -> bool:
+        """ same as might_contain for the 40 chars hex hashes. Not valid hashes are left to the db """
+        try:
+            digest = binascii.unhexlify(hex_hash)
+        except (binascii.Error, ValueError, TypeError):
+            return True
+        if len(digest) != pbindb.PACKED_DIGEST_SIZE:
+            return True
+        return self.might_contain(digest)
+
+
+_open_filters:dict = {}
+
+
+def getFilterFor(l_db_file:str):
+    """ Return the (cached, already open) BloomFilter for a db (or zip) or None if there is no sidecar.
+        Raises BloomFilterError if the sidecar exists but cannot be used.
+    """
+    the_filter = _open_filters.get(l_db_file)
+    if the_filter is None:
+        if not os.path.isfile(filterFilenameFor(l_db_file)):
+            return None
+        try:
+            the_filter = BloomFilter(l_db_file)
+        except BloomFilterError:
+            _open_filters[l_db_file] = False   #report the problem only once
+            raise
+        _open_filters[l_db_file] = the_filter
+    if the_filter is False:
+        return None
+    return the_filter
+
+
+def closeFilters() -> None:
+    for the_filter in _open_filters.values():
+        if the_filter:
+            the_filter.close()
+    _open_filters.clear()
@@ -0,0 +1,96 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Batch SHA1 hashing of the plain text passwords read by pwned.py -f/-t (--hash_workers).
+#
+# Words are hashed in batches, each batch returning its raw 20 bytes digests packed in a single bytes
+# object (no hex strings, no per word objects crossing the process boundary). With more than one worker
+# the batches are hashed by a process pool while the next ones are read; at most a few batches per worker
+# are in flight, so memory stays bounded whatever the size of the input. Batches come back in input order.
+# The hashing time of each batch is measured where it runs and reported by the parent (hash stage metrics).
+import collections
+import hashlib
+import time
+
+import pwned_metrics as pmetrics
+
+DIGEST_SIZE:int        = 20
+HASH_BATCH_SIZE:int    = 20000   #words per batch handed to a worker
+BATCHES_PER_WORKER:int = 2       #batches queued per worker while the reader goes on
+
+
+def sha1Digests(l_words) -> bytes:
+    """ raw SHA1 digests of the utf-8 encoded words, concatenated in the same order """
+    sha1 = hashlib.sha1
+    return b"".join([sha1(word.encode("utf-8", errors="replace")).digest() for word in l_words])
+
+
+def timedSha1Digests(l_words):
+    """ (sha1Digests(l_words), seconds it took) """
+    start = time.perf_counter()
+    digests = sha1Digests(l_words)
+    return digests, time.perf_counter() - start
+
+
+def splitDigests(l_digests:bytes) -> list:
+    return [l_digests[i:i + DIGEST_SIZE] for i in range(0, len(l_digests), DIGEST_SIZE)]
+
+
+def hexDigest(l_digest:bytes) -> str:
+    """ the 40 chars uppercase hex form written in the output and used by the text dbs and the web api """
+    return l_digest.hex().upper()
+
+
+def iterHashedBatches(l_batches, l_workers:int=1, l_word_of=None):
+    """ (batch, concatenated digests of the batch) for each batch (list) of l_batches, in order.
+        l_word_of(item) is the string hashed for each item of a batch (the item itself by default).
+        With l_workers > 1 the hashing runs in a process pool.
+    """
+    def wordsOf(the_batch):
+        return the_batch if l_word_of is None else [l_word_of(item) for item in the_batch]
+
+    registry = pmetrics.getRegistry()
+    hashed_words = registry.counter("pwned_hashed_passwords_total", "Plain text passwords hashed")
+
+    def counted(the_batch, timed_digests):
+        digests, secs = timed_digests
+        registry.observe_stage(pmetrics.STAGE_HASH, secs)
+        hashed_words.inc(len(the_batch))
+        return the_batch, digests
+
+    if l_workers <= 1:
+        for the_batch in l_batches:
+            yield counted(the_batch, timedSha1Digests(wordsOf(the_batch)))
+        return
+
+    import pwned_parallel as pparallel
+    with pparallel.getProcessContext().Pool(l_workers) as pool:
+        pending = collections.deque()
+        for the_batch in l_batches:
+            pending.append((the_batch, pool.apply_async(timedSha1Digests, (wordsOf(the_batch),))))
+            if len(pending) >= l_workers * BATCHES_PER_WORKER:
+                done_batch, done_digests = pending.popleft()
+                yield counted(done_batch, done_digests.get())
+        while pending:
+            done_batch, done_digests = pending.popleft()
+            yield counted(done_batch, done_digests.get())
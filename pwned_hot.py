@@ -0,0 +1,193 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Hot tier ("sidecar") of a db used by pwned.py: the most breached hashes, kept in memory.
+#
+# The sidecar is <db filename>.hot (<zip filename>.hot with -z) and contains (little endian):
+#   header : 8 bytes magic "PWNHOT01" + 8 bytes size of the db it was built from
+#   records: the top N hashes of the db by breach count, in the packed db format (pwned_bindb.py)
+# It is loaded once in a set: a hash found there is pwned without reading the db (the cold tier), which is
+# read only on a miss. A few common passwords make most of the real world hits, so a small tier answers most
+# of the pwned checks. A sidecar whose db changed size is stale and is not loaded.
+#
+# The hot tier only holds hashes of its db and a new release never removes hashes: it stays correct after
+# --update_db (restampHotTier), only the ranking may drift. About 90 bytes of memory per hash.
+import binascii
+import heapq
+import os
+import shutil
+import struct
+
+import pwned_bindb as pbindb
+import pwned_blockdb as pblockdb
+
+HOT_SUFFIX:str        = ".hot"
+HOT_DEFAULT_SIZE:int  = 100000
+HOT_MAGIC:bytes       = b"PWNHOT01"
+HOT_HEADER            = struct.Struct("<8sQ")
+
+
+class HotTierError(Exception):
+    """ Raised when the hot tier cannot be built or loaded. """
+
+
+def hotTierFilenameFor(l_db_file:str) -> str:
+    return l_db_file + HOT_SUFFIX
+
+
+def digestOfHex(hex_hash:str) -> bytes:
+    """ the raw digest of a 40 chars hex hash, b"" (never in a hot tier) if it is not one """
+    try:
+        return binascii.unhexlify(hex_hash)
+    except (binascii.Error, ValueError, TypeError):
+        return b""
+
+
+def iterDbRecords(l_db_file:str, l_local_zip_file:str=""):
+    """ (digest, count) of every hash of the db: HASH:count text (plain or inside l_local_zip_file), packed or block compressed """
+    binary_db = None if l_local_zip_file else pblockdb.openBinaryDb(l_db_file)
+    if binary_db is not None:
+        with binary_db:
+            yield from binary_db.iter_records()
+        return
+    with pbindb.openTextDb(l_db_file, l_local_zip_file) as text_db:
+        for the_line in text_db:
+            record = pbindb.parseDbLine(the_line)
+            if record is not None:
+                yield record
+
+
+def topRecords(l_records, size:int) -> list:
+    """ the size (digest, count) with the biggest counts, sorted by digest """
+    top = []
+    for record in l_records:
+        if len(top) < size:
+            heapq.heappush(top, (record[1], record[0]))
+        elif record[1] > top[0][0]:
+            heapq.heapreplace(top, (record[1], record[0]))
+    return sorted((digest, count) for count, digest in top)
+
+
+def buildHotTier(l_db_file:str, size:int=HOT_DEFAULT_SIZE, l_local_zip_file:str="", hot_filename:str="") -> str:
+    """ Stream the db once and write the size most breached hashes to hot_filename (by default the sidecar
+        of the db, or of the zip). Returns the hot tier file name.
+    """
+    if size < 1:
+        raise HotTierError("the hot tier size must be at least 1")
+    attached_file = l_local_zip_file or l_db_file
+    hot_filename = hot_filename or hotTierFilenameFor(attached_file)
+    packed_filename = hot_filename + ".tmp"
+    try:
+        pbindb.writePackedDb(packed_filename, topRecords(iterDbRecords(l_db_file, l_local_zip_file), size))
+        with open(hot_filename, "wb") as hot_file, open(packed_filename, "rb") as packed_file:
+            hot_file.write(HOT_HEADER.pack(HOT_MAGIC, os.path.getsize(attached_file)))
+            shutil.copyfileobj(packed_file, hot_file)
+    except pbindb.PackedDBError as e:
+        raise HotTierError(str(e)) from e
+    finally:
+        if os.path.isfile(packed_filename):
+            os.remove(packed_filename)
+    return hot_filename
+
+
+def restampHotTier(hot_filename:str, db_size:int, out_hot_filename:str="") -> None:
+    """ record db_size as the size of the db of the hot tier (written to out_hot_filename if given): for a db that
+        only gained hashes (see pwned_update.py), whose hot tier is still correct
+    """
+    if out_hot_filename and out_hot_filename != hot_filename:
+        shutil.copyfile(hot_filename, out_hot_filename)
+        hot_filename = out_hot_filename
+    with open(hot_filename, "r+b") as hot_file:
+        if hot_file.read(len(HOT_MAGIC)) != HOT_MAGIC:
+            raise HotTierError(hot_filename + " is not a valid hot tier file")
+        hot_file.seek(0)
+        hot_file.write(HOT_HEADER.pack(HOT_MAGIC, db_size))
+
+
+class HotTier:
+    """ The hashes of a hot tier file in memory. contains is True only for hashes that are surely in the db """
+
+    def __init__(self, l_db_file:str, hot_filename:str=""):
+        self.hot_filename:str = hot_filename or hotTierFilenameFor(l_db_file)
+        with open(self.hot_filename, "rb") as hot_file:
+            data = hot_file.read()
+        try:
+            magic, db_size = HOT_HEADER.unpack_from(data, 0)
+            magic_packed, number_of_records = pbindb.PACKED_HEADER.unpack_from(data, HOT_HEADER.size)
+        except struct.error as e:
+            raise HotTierError(self.hot_filename + " is not a valid hot tier file") from e
+        digests_start = HOT_HEADER.size + pbindb.PACKED_HEADER.size
+        counts_start = digests_start + number_of_records * pbindb.PACKED_DIGEST_SIZE
+        if magic != HOT_MAGIC or magic_packed != pbindb.PACKED_MAGIC or len(data) != counts_start + number_of_records * pbindb.PACKED_COUNT.size:
+            raise HotTierError(self.hot_filename + " is not a valid hot tier file")
+        if db_size != os.path.getsize(l_db_file):
+            raise HotTierError(self.hot_filename + " is stale (db size changed). Rebuild it with --build_hot_tier")
+        self._digests = frozenset(data[offset:offset + pbindb.PACKED_DIGEST_SIZE]
+                                  for offset in range(digests_start, counts_start, pbindb.PACKED_DIGEST_SIZE))
+        self.min_count:int = min((count for (count,) in pbindb.PACKED_COUNT.iter_unpack(data[counts_start:])), default=0)
+        self.hits:int = 0     #lookups answered by the hot tier, cumulative
+        self.misses:int = 0   #lookups left to the db
+
+    def __len__(self) -> int:
+        return len(self._digests)
+
+    def __contains__(self, digest:bytes) -> bool:
+        """ membership without counting """
+        return digest in self._digests
+
+    def contains(self, digest:bytes) -> bool:
+        if digest in self._digests:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def contains_hex(self, hex_hash:str) -> bool:
+        """ same as contains for the 40 chars hex hashes """
+        return self.contains(digestOfHex(hex_hash))
+
+
+_hot_tiers:dict = {}
+
+
+def getHotTierFor(l_db_file:str):
+    """ Return the (cached, already loaded) HotTier of a db (or zip) or None if there is no sidecar.
+        Raises HotTierError if the sidecar exists but cannot be used.
+    """
+    the_tier = _hot_tiers.get(l_db_file)
+    if the_tier is None:
+        if not os.path.isfile(hotTierFilenameFor(l_db_file)):
+            return None
+        try:
+            the_tier = HotTier(l_db_file)
+        except (HotTierError, OSError):
+            _hot_tiers[l_db_file] = False   #report the problem only once
+            raise
+        _hot_tiers[l_db_file] = the_tier
+    if the_tier is False:
+        return None
+    return the_tier
+
+
+def closeHotTiers() -> None:
+    _hot_tiers.clear()
@@ -0,0 +1,273 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Prefix offset index ("sidecar") for the sorted HASH:count text db used by pwned.py -b.
+#
+# The sidecar is <db filename>.idx and contains (little endian):
+#   header : 8 bytes magic "PWNIDX01" + 8 bytes prefix bits (16 or 20) + 8 bytes size of the indexed db
+#   offsets: 2^bits + 1 unsigned 64 bit byte offsets. Lines whose hash starts with prefix p
+#            are in [offsets[p], offsets[p+1]) of the text db.
+#
+# A lookup is then one seek and one read of a single bucket.
+import itertools
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+INDEX_MAGIC:bytes         = b"PWNIDX01"
+INDEX_HEADER              = struct.Struct("<8sQQ")
+INDEX_OFFSET              = struct.Struct("<Q")
+INDEX_SUFFIX:str          = ".idx"
+INDEX_ALLOWED_BITS        = [16, 20]
+INDEX_DEFAULT_BITS:int    = 20
+INDEX_MAX_READ_BYTES:int  = 256 * 1024  #buckets bigger than this are binary searched instead of read at once
+HASH_HEX_LENGTH:int       = 40
+
+
+class PrefixIndexError(Exception):
+    """ Raised when the sidecar index cannot be built or does not match its db. """
+
+
+def indexFilenameFor(l_local_db_file:str) -> str:
+    return l_local_db_file + INDEX_SUFFIX
+
+
+def writeIndex(index_filename:str, prefix_bits:int, db_size:int, bucket_starts) -> None:
+    """ bucket_starts: iterable of (prefix, offset of the first line with that prefix), prefixes ascending. """
+    number_of_buckets = 1 << prefix_bits
+    with open(index_filename, "wb") as index_file:
+        index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, prefix_bits, db_size))
+        next_prefix = 0
+        for prefix, offset in bucket_starts:
+            #empty buckets before this one start (and end) where this one starts
+            while next_prefix <= prefix:
+                index_file.write(INDEX_OFFSET.pack(offset))
+                next_prefix += 1
+        while next_prefix <= number_of_buckets:
+            index_file.write(INDEX_OFFSET.pack(db_size))
+            next_prefix += 1
+
+
+def iterBucketStarts(db_file, prefix_bits:int):
+    """ Stream a sorted binary db file yielding (prefix, offset) for the first line of each prefix.
+        Raises PrefixIndexError if the file is not sorted.
+    """
+    prefix_chars = prefix_bits // 4
+    offset:int = 0
+    last_hash:bytes = b""
+    last_prefix:int = -1
+    for the_line in db_file:
+        line_hash = the_line.split(b":", 1)[0].strip().upper()
+        if line_hash:
+            if line_hash < last_hash:
+                raise PrefixIndexError("db is not sorted (line at byte " + str(offset) + ")")
+            last_hash = line_hash
+            prefix = int(line_hash[:prefix_chars], 16)
+            if prefix != last_prefix:
+                yield prefix, offset
+                last_prefix = prefix
+        offset += len(the_line)
+
+
+def buildIndex(l_local_db_file:str, prefix_bits:int=INDEX_DEFAULT_BITS, index_filename:str="") -> str:
+    """ Build the sidecar index of a sorted text db. Returns the index file name. """
+    if prefix_bits not in INDEX_ALLOWED_BITS:
+        raise PrefixIndexError("prefix bits must be one of " + str(INDEX_ALLOWED_BITS))
+    if not index_filename:
+        index_filename = indexFilenameFor(l_local_db_file)
+    db_size = os.path.getsize(l_local_db_file)
+    with open(l_local_db_file, "rb") as db_file:
+        try:
+            writeIndex(index_filename, prefix_bits, db_size, iterBucketStarts(db_file, prefix_bits))
+        except (PrefixIndexError, ValueError):
+            os.remove(index_filename)
+            raise
+    return index_filename
+
+
+def patchIndex(index_filename:str, bytes_by_prefix, old_db_size:int, new_db_size:int, out_index_filename:str="") -> str:
+    """ Rewrite the index of a db whose lines changed in place (see pwned_update.py) instead of rebuilding it.
+        bytes_by_prefix[p] is the number of bytes added (or removed, negative) to the lines of the 20 bits prefix p.
+        Returns the new index file name (index_filename itself by default).
+    """
+    with open(index_filename, "rb") as index_file:
+        content = index_file.read()
+    try:
+        magic, prefix_bits, indexed_size = INDEX_HEADER.unpack_from(content, 0)
+    except struct.error as e:
+        raise PrefixIndexError(index_filename + " is not a valid index file") from e
+    if magic != INDEX_MAGIC or prefix_bits not in INDEX_ALLOWED_BITS:
+        raise PrefixIndexError(index_filename + " is not a valid index file")
+    if len(content) != INDEX_HEADER.size + ((1 << prefix_bits) + 1) * INDEX_OFFSET.size:
+        raise PrefixIndexError(index_filename + " is truncated")
+    if indexed_size != old_db_size:
+        raise PrefixIndexError(index_filename + " is stale (db size changed). Rebuild it with --build_index")
+    offsets = array("Q")
+    offsets.frombytes(content[INDEX_HEADER.size:])
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    #the changes of the 20 bits prefixes regrouped by prefix of the index
+    group = 1 << (INDEX_DEFAULT_BITS - prefix_bits)
+    shifts = [sum(bytes_by_prefix[prefix:prefix + group]) for prefix in range(0, len(bytes_by_prefix), group)]
+    #a bucket moves by the changes of all the buckets before it
+    for prefix, shift in enumerate(itertools.accumulate(shifts), 1):
+        if shift:
+            offsets[prefix] += shift
+    if offsets[-1] != new_db_size:
+        raise PrefixIndexError(index_filename + " cannot be patched (size mismatch). Rebuild it with --build_index")
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    out_index_filename = out_index_filename or index_filename
+    with open(out_index_filename, "wb") as index_file:
+        index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, prefix_bits, new_db_size))
+        index_file.write(offsets.tobytes())
+    return out_index_filename
+
+
+class PrefixIndex:
+    """ Memory mapped sidecar index plus the open text db it describes. """
+
+    def __init__(self, l_local_db_file:str, index_filename:str=""):
+        self.db_filename:str = l_local_db_file
+        self.index_filename:str = index_filename or indexFilenameFor(l_local_db_file)
+        self._index_file = open(self.index_filename, "rb")
+        self._map = None
+        self._db_file = None
+        try:
+            self._map = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.prefix_bits, indexed_size = INDEX_HEADER.unpack_from(self._map, 0)
+            if magic != INDEX_MAGIC or self.prefix_bits not in INDEX_ALLOWED_BITS:
+                raise PrefixIndexError(self.index_filename + " is not a valid index file")
+            if len(self._map) != INDEX_HEADER.size + ((1 << self.prefix_bits) + 1) * INDEX_OFFSET.size:
+                raise PrefixIndexError(self.index_filename + " is truncated")
+            if indexed_size != os.path.getsize(l_local_db_file):
+                raise PrefixIndexError(self.index_filename + " is stale (db size changed). Rebuild it with --build_index")
+        except (ValueError, struct.error) as e:
+            self.close()
+            raise PrefixIndexError(self.index_filename + " is not a valid index file") from e
+        except PrefixIndexError:
+            self.close()
+            raise
+        self._db_file = open(l_local_db_file, "rb")
+        self.prefix_chars:int = self.prefix_bits // 4
+        self.reads:int = 0   #number of reads done on the db, cumulative
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        if self._db_file is not None:
+            self._db_file.close()
+            self._db_file = None
+
+    def bucket_range(self, hex_hash:str):
+        """ (start, end) byte offsets in the db of the lines sharing the prefix of hex_hash """
+        prefix = int(hex_hash[:self.prefix_chars], 16)
+        start = INDEX_OFFSET.unpack_from(self._map, INDEX_HEADER.size + prefix * INDEX_OFFSET.size)[0]
+        end   = INDEX_OFFSET.unpack_from(self._map, INDEX_HEADER.size + (prefix + 1) * INDEX_OFFSET.size)[0]
+        return start, end
+
+    def lookup(self, hex_hash:str) -> bool:
+        """ True if the (upper case, 40 hex chars) hash is in the db """
+        if len(hex_hash) != HASH_HEX_LENGTH:
+            return False
+        try:
+            start, end = self.bucket_range(hex_hash)
+        except ValueError:
+            return False   #not an hex string
+        if start >= end:
+            return False
+        the_hash = hex_hash.encode("ascii", errors="replace")
+        if end - start <= INDEX_MAX_READ_BYTES:
+            self.reads += 1
+            self._db_file.seek(start)
+            bucket = self._db_file.read(end - start)
+            #hashes have all the same length, so a match can only be at the start of a line
+            position = bucket.find(the_hash)
+            return position >= 0 and (position == 0 or bucket[position - 1:position] == b"\n")
+        return self._search_range(the_hash, start, end)
+
+    def _search_range(self, the_hash:bytes, left:int, right:int) -> bool:
+        """ Binary search restricted to one (big) bucket. left is always the start of a line. """
+        db_file = self._db_file
+        while left < right:
+            self.reads += 1
+            mid = (left + right) // 2
+            if mid > left:
+                db_file.seek(mid - 1)
+                db_file.readline()   #discard the partial line (we may have landed mid-line)
+            else:
+                db_file.seek(mid)
+            pos = db_file.tell()
+            if pos >= right:
+                right = mid
+                continue
+            line = db_file.readline()
+            line_hash = line.split(b":", 1)[0].strip()
+            if line_hash == the_hash:
+                return True
+            if line_hash < the_hash:
+                left = pos + len(line)
+            else:
+                right = mid
+        return False
+
+
+_open_indexes:dict = {}
+
+
+def getIndexFor(l_local_db_file:str):
+    """ Return the (cached, already open) PrefixIndex for a db or None if there is no sidecar.
+        Raises PrefixIndexError if the sidecar exists but cannot be used.
+    """
+    the_index = _open_indexes.get(l_local_db_file)
+    if the_index is None:
+        if not os.path.isfile(indexFilenameFor(l_local_db_file)):
+            return None
+        try:
+            the_index = PrefixIndex(l_local_db_file)
+        except PrefixIndexError:
+            _open_indexes[l_local_db_file] = False   #report the problem only once
+            raise
+        _open_indexes[l_local_db_file] = the_index
+    if the_index is False:
+        return None
+    return the_index
+
+
+def closeIndexes() -> None:
+    for the_index in _open_indexes.values():
+        if the_index:
+            the_index.close()
+    _open_indexes.clear()
@@ -0,0 +1,190 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Single pass merge join of a sorted list of hashes against the sorted HASH:count text db (pwned.py -b with -f/-t).
+#
+# The db is only ever read forward: for each hash (in ascending order) the cursor gallops forward
+# (exponential steps) until it passes the hash, then narrows down with a binary search and a short scan.
+# Dense inputs end up reading the db sequentially, sparse inputs skip most of it.
+#
+# Inputs too big to be sorted in memory are spilled to disk as sorted runs, merged back on the fly.
+import heapq
+import os
+import tempfile
+
+GALLOP_FIRST_STEP:int = 4 * 1024    #bytes, first jump forward when galloping
+GALLOP_SCAN_BYTES:int = 4 * 1024    #below this distance lines are just read one after the other
+GALLOP_SCAN_LINES:int = 16          #lines read sequentially before starting to gallop (dense inputs never gallop)
+
+
+def lineHash(the_line:bytes) -> bytes:
+    return the_line.split(b":", 1)[0].strip()
+
+
+class SortedDbCursor:
+    """ Forward only cursor over a sorted text db opened in binary mode. """
+
+    def __init__(self, db_file, the_index=None):
+        self._db_file = db_file
+        self._index = the_index   #optional PrefixIndex (pwned_index.py) to jump straight to the right bucket
+        self.size:int = os.fstat(db_file.fileno()).st_size
+        self.pos:int = 0          #always the start of a line
+        self.lines_read:int = 0
+
+    def _line_at(self, offset:int):
+        """ (start, line) of the first line starting at or after offset """
+        self.lines_read += 1
+        if offset <= 0:
+            self._db_file.seek(0)
+        else:
+            self._db_file.seek(offset - 1)
+            self._db_file.readline()   #discard the partial line (we may have landed mid-line)
+        start = self._db_file.tell()
+        return start, self._db_file.readline()
+
+    def contains(self, target:bytes) -> bool:
+        """ Advance to the first line with hash >= target and tell if it is target.
+            Targets must be passed in ascending order.
+        """
+        low = self.pos
+        if self._index is not None:
+            try:
+                bucket_start = self._index.bucket_range(target.decode("ascii"))[0]
+                low = max(low, bucket_start)
+            except (ValueError, UnicodeDecodeError):
+                pass
+        if low >= self.size:
+            self.pos = self.size
+            return False
+
+        start, line = self._line_at(low)
+        for _ in range(GALLOP_SCAN_LINES):
+            if not line:
+                self.pos = self.size
+                return False
+            line_hash = lineHash(line)
+            if line_hash >= target:
+                self.pos = start
+                return line_hash == target
+            low = start   #invariant: the line at low has hash < target
+            start += len(line)
+            line = self._db_file.readline()
+            self.lines_read += 1
+
+        #gallop: find high so that the first line starting at or after high is >= target (or the end of file)
+        step = GALLOP_FIRST_STEP
+        while True:
+            high = low + step
+            if high >= self.size:
+                high = self.size
+                break
+            start, line = self._line_at(high)
+            if (not line) or lineHash(line) >= target:
+                break
+            low = start
+            step = step * 2
+
+        #binary search down to a short range
+        while high - low > GALLOP_SCAN_BYTES:
+            mid = (low + high) // 2
+            start, line = self._line_at(mid)
+            if line and lineHash(line) < target:
+                low = start
+            else:
+                high = mid
+
+        #short forward scan
+        self._db_file.seek(low)
+        start = low
+        while True:
+            line = self._db_file.readline()
+            self.lines_read += 1
+            if not line:
+                self.pos = self.size
+                return False
+            line_hash = lineHash(line)
+            if line_hash >= target:
+                self.pos = start
+                return line_hash == target
+            start += len(line)
+
+
+def joinSortedTargets(sorted_targets, l_local_db_file:str, the_index=None, on_found=None) -> int:
+    """ Merge join of an ascending iterable of hashes (bytes) with the sorted db.
+        on_found(target) is called for each hash found. Returns the number of db lines read.
+    """
+    with open(l_local_db_file, "rb") as db_file:
+        cursor = SortedDbCursor(db_file, the_index)
+        for target in sorted_targets:
+            if cursor.contains(target) and on_found is not None:
+                on_found(target)
+            if cursor.pos >= cursor.size:
+                break
+    return cursor.lines_read
+
+
+def mergeJoinSortedDb(l_hashes, l_local_db_file:str, the_index=None):
+    """ Check all l_hashes (iterable of hex strings, any order, duplicates allowed) against the sorted db.
+        Returns (set of the hex strings found, number of db lines read).
+    """
+    targets = sorted(set(the_hash.encode("ascii", errors="replace") for the_hash in l_hashes))
+    found = set()
+    lines_read = joinSortedTargets(targets, l_local_db_file, the_index, lambda target: found.add(target.decode("ascii")))
+    return found, lines_read
+
+
+def spillSortedRuns(l_hashes, run_size:int, work_dir:str) -> list:
+    """ Write l_hashes (iterable of hex strings) as files of at most run_size sorted, distinct hashes (one per line).
+        Returns the list of the file names.
+    """
+    run_files = []
+    the_run = set()
+
+    def writeRun():
+        with tempfile.NamedTemporaryFile("wb", dir=work_dir, suffix=".run", delete=False) as run_file:
+            run_file.write(b"\n".join(sorted(the_run)) + b"\n")
+        run_files.append(run_file.name)
+        the_run.clear()
+
+    for the_hash in l_hashes:
+        the_run.add(the_hash.encode("ascii", errors="replace"))
+        if len(the_run) >= run_size:
+            writeRun()
+    if the_run:
+        writeRun()
+    return run_files
+
+
+def iterMergedRuns(run_files):
+    """ Ascending, distinct hashes (bytes) of all the sorted runs """
+    opened_files = [open(run_filename, "rb") for run_filename in run_files]
+    try:
+        last = None
+        for the_line in heapq.merge(*opened_files):
+            the_hash = the_line.rstrip(b"\n")
+            if the_hash != last:
+                yield the_hash
+                last = the_hash
+    finally:
+        for run_file in opened_files:
+            run_file.close()
@@ -0,0 +1,306 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Metrics of a pwned.py run (--metrics_out): counters and histograms, exported as JSON or Prometheus text.
+#
+# Everything lives in one registry per process (getRegistry). Counters and histograms take a lock, so any
+# thread can update them (web requests, result writer, lookup daemon). Worker processes do not share memory
+# with the parent: they record in a registry of their own and send its snapshot() back, which the parent adds
+# with merge() (see pwned_parallel.py).
+#
+# Stage timers (stage="read", "hash", "lookup", "network", "write") all go to the pwned_stage_seconds histogram.
+import bisect
+import contextlib
+import json
+import threading
+import time
+
+FORMAT_JSON:str        = "json"
+FORMAT_PROMETHEUS:str  = "prometheus"
+METRICS_FORMATS        = [FORMAT_JSON, FORMAT_PROMETHEUS]
+
+#seconds, from 10 microseconds (a packed db lookup) to a minute (a full db scan)
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+PROBE_BUCKETS   = (1, 2, 4, 8, 16, 24, 32, 48, 64, 128, 1024, 65536)
+
+STAGE_READ:str    = "read"
+STAGE_HASH:str    = "hash"
+STAGE_LOOKUP:str  = "lookup"
+STAGE_NETWORK:str = "network"
+STAGE_WRITE:str   = "write"
+
+
+def labelsKey(labels) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+class Counter:
+    """ monotonic counter, one value per set of labels """
+
+    def __init__(self, name:str, help_text:str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value:float=1, labels=None) -> None:
+        key = labelsKey(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, value:float, labels=None) -> None:
+        """ for totals counted elsewhere (PwnedStats) and copied here before the export """
+        with self._lock:
+            self._values[labelsKey(labels)] = value
+
+    def value(self, labels=None) -> float:
+        with self._lock:
+            return self._values.get(labelsKey(labels), 0)
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+class Gauge(Counter):
+    """ value that can go up and down (ratios, rates) """
+
+
+class Histogram:
+    """ cumulative buckets + sum + count, one series per set of labels """
+
+    def __init__(self, name:str, help_text:str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   #labels key -> [bucket counts (not cumulative, last one is +Inf), sum, count]
+        self._lock = threading.Lock()
+
+    def _get_series(self, key):
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        return series
+
+    def observe(self, value:float, labels=None) -> None:
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._get_series(labelsKey(labels))
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def observe_counts(self, counts:dict, labels=None) -> None:
+        """ observe each value of counts (value -> number of times) taking the lock once: for the per record loops """
+        positions = [(bisect.bisect_left(self.buckets, value), value, times) for value, times in counts.items()]
+        with self._lock:
+            series = self._get_series(labelsKey(labels))
+            for position, value, times in positions:
+                series[0][position] += times
+                series[1] += value * times
+                series[2] += times
+
+    def add_series(self, bucket_counts, total:float, count:int, labels=None) -> None:
+        """ add a series of another histogram with the same buckets: bucket_counts not cumulative, the last one is +Inf """
+        if len(bucket_counts) != len(self.buckets) + 1:
+            raise ValueError("cannot add a series of " + str(len(bucket_counts)) + " buckets to " + self.name)
+        with self._lock:
+            series = self._get_series(labelsKey(labels))
+            series[0] = [mine + theirs for mine, theirs in zip(series[0], bucket_counts)]
+            series[1] += total
+            series[2] += count
+
+    def count(self, labels=None) -> int:
+        with self._lock:
+            series = self._series.get(labelsKey(labels))
+            return series[2] if series else 0
+
+    def total(self, labels=None) -> float:
+        with self._lock:
+            series = self._series.get(labelsKey(labels))
+            return series[1] if series else 0.0
+
+    def items(self):
+        with self._lock:
+            return [(key, (list(series[0]), series[1], series[2])) for key, series in self._series.items()]
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.started_at:float = time.time()
+
+    def counter(self, name:str, help_text:str="") -> Counter:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Counter(name, help_text)
+            return metric
+
+    def gauge(self, name:str, help_text:str="") -> Gauge:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Gauge(name, help_text)
+            return metric
+
+    def histogram(self, name:str, help_text:str="", buckets=LATENCY_BUCKETS) -> Histogram:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Histogram(name, help_text, buckets)
+            return metric
+
+    def metrics(self) -> list:
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+    @contextlib.contextmanager
+    def stage(self, stage_name:str):
+        """ time the block into pwned_stage_seconds{stage=stage_name} """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage_name, time.perf_counter() - start)
+
+    def observe_stage(self, stage_name:str, secs:float) -> None:
+        self.histogram("pwned_stage_seconds", "Time spent in each stage of the checks").observe(secs, {"stage": stage_name})
+
+    def snapshot(self) -> dict:
+        """ picklable copy of every value, see merge """
+        result = {}
+        for metric in self.metrics():
+            if isinstance(metric, Gauge):
+                result[metric.name] = ("gauge", metric.help_text, None, metric.items())
+            elif isinstance(metric, Counter):
+                result[metric.name] = ("counter", metric.help_text, None, metric.items())
+            else:
+                result[metric.name] = ("histogram", metric.help_text, metric.buckets, metric.items())
+        return result
+
+    def merge(self, snapshot:dict) -> None:
+        """ add the values of a snapshot (e.g. taken in a worker process). Gauges take the value of the snapshot """
+        for name, (kind, help_text, buckets, items) in snapshot.items():
+            if kind == "gauge":
+                the_gauge = self.gauge(name, help_text)
+                for key, value in items:
+                    the_gauge.set(value, dict(key))
+            elif kind == "counter":
+                the_counter = self.counter(name, help_text)
+                for key, value in items:
+                    the_counter.inc(value, dict(key))
+            else:
+                the_histogram = self.histogram(name, help_text, buckets)
+                for key, (bucket_counts, total, count) in items:
+                    the_histogram.add_series(bucket_counts, total, count, dict(key))
+
+    def to_dict(self) -> dict:
+        result = {"started_at": self.started_at, "uptime_secs": round(time.time() - self.started_at, 4), "counters": {}, "gauges": {}, "histograms": {}}
+        for metric in self.metrics():
+            if isinstance(metric, Gauge):
+                result["gauges"][metric.name] = [{"labels": dict(key), "value": value} for key, value in metric.items()]
+            elif isinstance(metric, Counter):
+                result["counters"][metric.name] = [{"labels": dict(key), "value": value} for key, value in metric.items()]
+            else:
+                series_list = []
+                for key, (bucket_counts, total, count) in metric.items():
+                    cumulative = 0
+                    buckets = {}
+                    for bound, bucket_count in zip(list(metric.buckets) + ["+Inf"], bucket_counts):
+                        cumulative += bucket_count
+                        buckets[str(bound)] = cumulative
+                    series_list.append({"labels": dict(key), "count": count, "sum": total,
+                                        "mean": (total / count) if count else 0.0, "buckets": buckets})
+                result["histograms"][metric.name] = series_list
+        return result
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for metric in self.metrics():
+            if isinstance(metric, Counter):
+                lines.append("# HELP " + metric.name + " " + metric.help_text)
+                lines.append("# TYPE " + metric.name + " " + ("gauge" if isinstance(metric, Gauge) else "counter"))
+                for key, value in metric.items():
+                    lines.append(metric.name + formatLabels(key) + " " + formatValue(value))
+            else:
+                lines.append("# HELP " + metric.name + " " + metric.help_text)
+                lines.append("# TYPE " + metric.name + " histogram")
+                for key, (bucket_counts, total, count) in metric.items():
+                    cumulative = 0
+                    for bound, bucket_count in zip(list(metric.buckets) + ["+Inf"], bucket_counts):
+                        cumulative += bucket_count
+                        lines.append(metric.name + "_bucket" + formatLabels(key + (("le", str(bound)),)) + " " + str(cumulative))
+                    lines.append(metric.name + "_sum" + formatLabels(key) + " " + formatValue(total))
+                    lines.append(metric.name + "_count" + formatLabels(key) + " " + str(count))
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename:str, metrics_format:str="") -> None:
+        metrics_format = metrics_format or formatFromFilename(filename)
+        if metrics_format not in METRICS_FORMATS:
+            raise ValueError("unknown metrics format " + str(metrics_format) + " (use one of " + str(METRICS_FORMATS) + ")")
+        with open(filename, "w", encoding="utf-8", newline="\n") as metrics_file:
+            metrics_file.write(self.to_prometheus() if metrics_format == FORMAT_PROMETHEUS else self.to_json())
+
+
+def formatLabels(key) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"' for name, value in key) + "}"
+
+
+def formatValue(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def formatFromFilename(filename:str) -> str:
+    """ prometheus for .prom and .txt files, json otherwise """
+    return FORMAT_PROMETHEUS if filename.lower().endswith((".prom", ".txt")) else FORMAT_JSON
+
+
+_registry = MetricsRegistry()
+
+
+def getRegistry() -> MetricsRegistry:
+    return _registry
+
+
+def iterTimed(l_items, stage_name:str):
+    """ the items of l_items, the time spent producing each one (not the time of the caller) observed as stage_name.
+        For iterators of batches: one observation per item
+    """
+    l_items = iter(l_items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(l_items)
+        except StopIteration:
+            _registry.observe_stage(stage_name, time.perf_counter() - start)
+            return
+        _registry.observe_stage(stage_name, time.perf_counter() - start)
+        yield item
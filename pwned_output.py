@@ -0,0 +1,149 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Result file written by pwned.py -o: one handle kept open for the whole run.
+#
+# Records are formatted (CSV or JSON Lines) in the calling thread and handed in blocks to a background
+# thread that writes them, so the lookups never wait for the disk. Files ending in .gz are gzip compressed.
+# The time spent writing each block is the write stage of the metrics (pwned_metrics.py).
+import gzip
+import json
+import queue
+import threading
+
+import pwned_metrics as pmetrics
+
+FORMAT_CSV:str          = "csv"
+FORMAT_JSONL:str        = "jsonl"
+OUTPUT_FORMATS          = [FORMAT_CSV, FORMAT_JSONL]
+RECORDS_PER_BLOCK:int   = 4096      #records formatted before a block is handed to the writer thread
+MAX_PENDING_BLOCKS:int  = 16        #the lookups wait if the writer thread is this far behind
+FILE_BUFFER_SIZE:int    = 1024 * 1024
+
+
+def formatCsvLine(found_filename:str, found_linenumber, src_password:str, src_hash:str, ispwned:bool) -> str:
+    """ same columns (and spacing) as the -o file always had """
+    return found_filename + ", " + str(found_linenumber) + "," + src_password + ", " + src_hash + "," + str(ispwned) + "\n"
+
+
+def formatJsonLine(found_filename:str, found_linenumber, src_password:str, src_hash:str, ispwned:bool) -> str:
+    return json.dumps({"file": found_filename, "line": found_linenumber, "password": src_password,
+                       "sha1": src_hash, "pwned": bool(ispwned)}, ensure_ascii=False) + "\n"
+
+
+def isCompressedFilename(filename:str) -> bool:
+    return filename.lower().endswith(".gz")
+
+
+class ResultWriter:
+    """ Buffered writer of the check results, flushed by a background thread. Thread safe. """
+
+    def __init__(self, filename:str, output_format:str=FORMAT_CSV, pwned_only:bool=False, append:bool=False, background:bool=True):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("unknown output format " + str(output_format) + " (use one of " + str(OUTPUT_FORMATS) + ")")
+        self.filename:str = filename
+        self.output_format:str = output_format
+        self.pwned_only:bool = pwned_only
+        self.records_written:int = 0
+        self._format_line = formatJsonLine if output_format == FORMAT_JSONL else formatCsvLine
+        mode = "at" if append else "wt"
+        if isCompressedFilename(filename):
+            self._file = gzip.open(filename, mode, encoding="utf-8", newline="\n")
+        else:
+            self._file = open(filename, mode, encoding="utf-8", newline="\n", buffering=FILE_BUFFER_SIZE)
+        self._lock = threading.Lock()
+        self._block = []
+        self._error = None
+        self._queue = None
+        self._thread = None
+        if background:
+            self._queue = queue.Queue(MAX_PENDING_BLOCKS)
+            self._thread = threading.Thread(target=self._run, name="pwned-result-writer", daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _run(self) -> None:
+        while True:
+            block = self._queue.get()
+            if block is None:
+                return
+            if self._error is None:
+                try:
+                    self._write_block(block)
+                except Exception as e:   #reported to the caller by the next write or by close()
+                    self._error = e
+
+    def _check_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write_block(self, block) -> None:
+        with pmetrics.getRegistry().stage(pmetrics.STAGE_WRITE):
+            self._file.writelines(block)
+
+    def _hand_off(self, block) -> None:
+        if self._queue is not None:
+            self._queue.put(block)
+        else:
+            self._write_block(block)
+
+    def write(self, found_filename:str, found_linenumber, src_password:str, src_hash:str, ispwned:bool) -> None:
+        if self.pwned_only and not ispwned:
+            return
+        the_line = self._format_line(found_filename, found_linenumber, src_password, src_hash, ispwned)
+        with self._lock:
+            self._block.append(the_line)
+            self.records_written += 1
+            if len(self._block) >= RECORDS_PER_BLOCK:
+                block, self._block = self._block, []
+                self._check_error()
+                self._hand_off(block)
+
+    def write_records(self, list_records) -> None:
+        """ write password_record like objects (src_password, src_hash, found_filename, found_linenumber, ispwned) """
+        for the_record in list_records:
+            self.write(the_record.found_filename, the_record.found_linenumber, the_record.src_password, the_record.src_hash, the_record.ispwned)
+
+    def close(self) -> None:
+        """ write everything still pending and close the file. Raises the error of the writer thread, if any. """
+        with self._lock:
+            if self._file is None:
+                return
+            block, self._block = self._block, []
+            if block:
+                self._hand_off(block)
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+            try:
+                self._file.close()
+            finally:
+                self._file = None
+            self._check_error()
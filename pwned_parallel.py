@@ -0,0 +1,129 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Multi process full scan of the (unsorted) HASH:count text db used by pwned.py --workers.
+#
+# The db is split in N byte ranges aligned to line boundaries. Each range is scanned by a separate
+# process against the same set of input hashes (handed to each worker once, at start up).
+# The metrics of each worker (pwned_metrics.py) come back with its results and are merged in the parent.
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+import pwned_metrics as pmetrics
+
+_worker_hashes = frozenset()   #set of the input hashes (bytes) in each worker process
+
+
+def splitFileInRanges(filename:str, number_of_ranges:int) -> list:
+    """ Split filename in (at most) number_of_ranges [start, end) byte ranges, each starting at the beginning of a line. """
+    file_size = os.path.getsize(filename)
+    number_of_ranges = max(1, number_of_ranges)
+    boundaries = [0]
+    with open(filename, "rb") as db_file:
+        for i in range(1, number_of_ranges):
+            offset = (file_size * i) // number_of_ranges
+            if offset <= boundaries[-1]:
+                continue
+            db_file.seek(offset - 1)
+            db_file.readline()   #move to the start of the next line
+            boundaries.append(min(db_file.tell(), file_size))
+    boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def scanRange(l_local_db_file:str, start:int, end:int, l_hashes=None, registry=None):
+    """ Scan the lines in [start, end) of the db. Returns (set of the hashes found, number of lines scanned).
+        The scan time and bytes go to registry (the registry of the process by default).
+    """
+    started_at = time.perf_counter()
+    the_hashes = _worker_hashes if l_hashes is None else l_hashes
+    found = set()   #a db with repeated lines finds the same hash more than once
+    line_number = 0
+    with open(l_local_db_file, "rb") as db_file:
+        db_file.seek(start)
+        position = start
+        for the_line in db_file:
+            if position >= end:
+                break
+            position += len(the_line)
+            line_number += 1
+            line_hash = the_line.split(b":", 1)[0].strip()
+            if line_hash in the_hashes:
+                found.add(line_hash)
+                if len(found) == len(the_hashes):
+                    break
+    if registry is None:
+        registry = pmetrics.getRegistry()
+    registry.histogram("pwned_scan_range_seconds", "Time to scan one byte range of the db (--workers)").observe(time.perf_counter() - started_at)
+    registry.counter("pwned_db_bytes_scanned_total", "Bytes of the db scanned by the --workers processes").inc(position - start)
+    return found, line_number
+
+
+def scanRangeInWorker(l_local_db_file:str, start:int, end:int):
+    """ scanRange in a worker process: (hashes found, lines scanned, snapshot of the metrics of this scan).
+        A new registry: a forked worker starts with a copy of the parent one, which must not be sent back
+    """
+    registry = pmetrics.MetricsRegistry()
+    found, line_number = scanRange(l_local_db_file, start, end, None, registry)
+    return found, line_number, registry.snapshot()
+
+
+def _initWorker(l_hashes) -> None:
+    global _worker_hashes
+    _worker_hashes = l_hashes
+
+
+def getProcessContext():
+    """ The platform default (fork or spawn): pwned.py runs its command line only under __main__,
+        so a spawned child can safely re-import it.
+    """
+    return multiprocessing.get_context()
+
+
+def scanDbParallel(l_hashes, l_local_db_file:str, l_workers:int):
+    """ Check l_hashes (iterable of hex strings) scanning the db with l_workers processes.
+        Returns (set of the hex strings found, total number of lines scanned).
+    """
+    the_hashes = frozenset(the_hash.encode("ascii", errors="replace") for the_hash in l_hashes)
+    ranges = splitFileInRanges(l_local_db_file, l_workers)
+    found = set()
+    total_lines = 0
+
+    if len(ranges) < 2:
+        for start, end in ranges:
+            range_found, range_lines = scanRange(l_local_db_file, start, end, the_hashes)
+            found.update(range_found)
+            total_lines += range_lines
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(ranges), mp_context=getProcessContext(),
+                                                    initializer=_initWorker, initargs=(the_hashes,)) as executor:
+            futures = [executor.submit(scanRangeInWorker, l_local_db_file, start, end) for start, end in ranges]
+            for future in concurrent.futures.as_completed(futures):
+                range_found, range_lines, range_metrics = future.result()
+                found.update(range_found)
+                total_lines += range_lines
+                pmetrics.getRegistry().merge(range_metrics)
+
+    return set(the_hash.decode("ascii") for the_hash in found), total_lines
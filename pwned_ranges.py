@@ -0,0 +1,175 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Local db in the layout of the HIBP downloader used by pwned.py -r: one file per 5 hex chars prefix
+# (00000.txt ... FFFFF.txt, 1,048,576 files) holding the 'SUFFIX:count' lines of that range, exactly as the
+# /range/ api returns them. The files can be in a directory or in a zip archive of it.
+#
+# RangeDirectory has the fetch_range / fetch_ranges interface of the web client (pwned_web.py): the batch
+# engine groups the hashes by prefix and reads each needed range file once (about 1 KB), on a pool of threads.
+# Each range is a file of its own, so the db can be sharded or refreshed one file at a time. A missing range
+# file is an empty range (no hash with that prefix is pwned): missing_files tells how many were asked.
+import concurrent.futures
+import os
+import threading
+
+import pwned_metrics as pmetrics
+import pwned_web as pweb
+
+zipfile = None   #loaded by importZipfile() when a zip of range files is opened
+
+RANGE_PREFIX_LENGTH:int   = 5
+RANGE_FILE_SUFFIX:str     = ".txt"
+DEFAULT_READERS:int       = 8
+HEX_CHARS                 = frozenset("0123456789ABCDEF")
+
+
+class RangeDirectoryError(Exception):
+    """ Raised when the path is not a directory (or zip) of range files. """
+
+
+def importZipfile():
+    global zipfile
+    if zipfile is None:
+        import zipfile   #binds the global zipfile
+    return zipfile
+
+
+def rangePrefixOf(filename:str):
+    """ the (upper case) prefix of a range file name (XXXXX or XXXXX.txt, any directory), None for other files """
+    name = os.path.basename(filename.rstrip("/"))
+    if name.lower().endswith(RANGE_FILE_SUFFIX):
+        name = name[:-len(RANGE_FILE_SUFFIX)]
+    name = name.upper()
+    if len(name) == RANGE_PREFIX_LENGTH and HEX_CHARS.issuperset(name):
+        return name
+    return None
+
+
+class RangeDirectory:
+    """ Range files of a directory or of a zip archive. Thread safe. """
+
+    def __init__(self, path:str, readers:int=DEFAULT_READERS):
+        self.path:str = path
+        self.readers:int = max(1, readers)
+        self._zip = None
+        self._members = None   #zip: prefix -> member name
+        self._lock = threading.Lock()
+        if os.path.isdir(path):
+            with os.scandir(path) as entries:   #stops at the first range file: the full layout has a million files
+                found = any(rangePrefixOf(entry.name) for entry in entries)
+            if not found:
+                raise RangeDirectoryError(path + " does not contain range files (XXXXX.txt)")
+        elif os.path.isfile(path) and importZipfile().is_zipfile(path):
+            self._zip = zipfile.ZipFile(path)
+            self._members = {}
+            for name in self._zip.namelist():
+                prefix = rangePrefixOf(name)
+                if prefix is not None:
+                    self._members[prefix] = name
+            if not self._members:
+                self.close()
+                raise RangeDirectoryError(path + " does not contain range files (XXXXX.txt)")
+        else:
+            raise RangeDirectoryError(path + " is neither a directory nor a zip of range files")
+        self.files_read:int = 0   #cumulative
+        self.lines_read:int = 0
+        self.missing_files:int = 0
+        self._bytes_read = pmetrics.getRegistry().counter("pwned_range_files_bytes_read_total", "Bytes of the range files read (-r)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+    def read_range(self, prefix:str):
+        """ content of the range file of prefix (upper case), None if it does not exist """
+        if self._members is not None:
+            name = self._members.get(prefix)
+            if name is None:
+                return None
+            with self._lock:   #one zip file handle shared by all the readers
+                try:
+                    return self._zip.read(name)
+                except (zipfile.BadZipFile, RuntimeError) as e:   #RuntimeError: encrypted member
+                    raise OSError(str(e)) from e
+        for filename in (prefix + RANGE_FILE_SUFFIX, prefix, prefix.lower() + RANGE_FILE_SUFFIX):
+            try:
+                with open(os.path.join(self.path, filename), "rb") as range_file:
+                    return range_file.read()
+            except FileNotFoundError:
+                continue
+        return None
+
+    def fetch_range(self, prefix:str) -> pweb.RangeResult:
+        prefix = prefix.upper()
+        try:
+            content = self.read_range(prefix)
+        except OSError as e:
+            return pweb.RangeResult(prefix, 0, None, "ERROR - cannot read range " + prefix + ": " + str(e))
+        if content is None:
+            with self._lock:
+                self.missing_files += 1
+            return pweb.RangeResult(prefix, 200, {})
+        suffixes = pweb.parseRangeResponse(content.decode("ascii", errors="replace"))
+        self._bytes_read.inc(len(content))
+        with self._lock:
+            self.files_read += 1
+            self.lines_read += len(suffixes)
+        return pweb.RangeResult(prefix, 200, suffixes)
+
+    def fetch_ranges(self, prefixes, on_result=None) -> dict:
+        """ same as RangeClient.fetch_ranges (pwned_web.py): the distinct range files are read on a pool of threads """
+        results = {}
+        distinct_prefixes = list(dict.fromkeys(prefixes))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.readers) as executor:
+            futures = [executor.submit(self.fetch_range, prefix) for prefix in distinct_prefixes]
+            for future in concurrent.futures.as_completed(futures):
+                range_result = future.result()
+                results[range_result.prefix] = range_result
+                if on_result is not None:
+                    on_result(range_result)
+        return results
+
+
+_open_directories:dict = {}
+
+
+def getRangeDirectoryFor(path:str) -> RangeDirectory:
+    """ the (cached, already open) RangeDirectory of path. Raises RangeDirectoryError if it cannot be used """
+    the_directory = _open_directories.get(path)
+    if the_directory is None:
+        the_directory = _open_directories[path] = RangeDirectory(path)
+    return the_directory
+
+
+def closeRangeDirectories() -> None:
+    for the_directory in _open_directories.values():
+        the_directory.close()
+    _open_directories.clear()
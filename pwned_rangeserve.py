@@ -0,0 +1,215 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Self hosted /range/ api started by pwned.py --serve_range: a LAN mirror of api.pwnedpasswords.com.
+#
+# GET /range/XXXXX answers, like the public api, the 'SUFFIX:count' lines (CRLF separated) of the hashes
+# starting with the 5 hex chars prefix, read from a local db opened once: sorted text (-b, one bucket read
+# with its .idx index), packed (-m) or a directory of range files (-r). GET /stats gives counters and latency.
+# The web mode of pwned.py (and any other client of the public api) can point at it: --api_url or PWNED_API_URL.
+#
+# Each connection is served by its own thread and kept alive, as the RangeClient of pwned_web.py expects.
+import binascii
+import http.server
+import json
+import threading
+import time
+
+import pwned_bindb as pbindb
+import pwned_join as pjoin
+import pwned_serve as pserve
+
+RANGE_PATH:str          = "/range/"
+RANGE_PREFIX_LENGTH:int = 5
+HEX_CHARS               = frozenset("0123456789ABCDEF")
+
+
+def isValidPrefix(prefix:str) -> bool:
+    return len(prefix) == RANGE_PREFIX_LENGTH and HEX_CHARS.issuperset(prefix)
+
+
+def formatRange(the_lines) -> bytes:
+    """ the response body: 'SUFFIX:count' lines separated by CRLF, as the public api """
+    return b"\r\n".join(the_lines)
+
+
+class SortedDbRanges:
+    """ Ranges of a sorted HASH:count text db: one bucket read with the prefix index, a galloping search without """
+
+    def __init__(self, l_db_file:str, the_index=None):
+        self._db_file = open(l_db_file, "rb")
+        self._index = the_index   #PrefixIndex (pwned_index.py) of l_db_file or None
+        self._lock = threading.Lock()   #one file handle shared by all the connections
+
+    def close(self) -> None:
+        self._db_file.close()
+
+    def range_lines(self, prefix:str) -> list:
+        """ 'SUFFIX:count' lines (bytes) of the hashes starting with prefix (5 upper case hex chars) """
+        target = prefix.encode("ascii")
+        the_lines = []
+        with self._lock:
+            if self._index is not None:
+                start, end = self._index.bucket_range(prefix)   #a 16 bits bucket holds 16 prefixes: filtered below
+                self._db_file.seek(start)
+                candidates = self._db_file.read(end - start).splitlines()
+            else:
+                cursor = pjoin.SortedDbCursor(self._db_file)
+                cursor.contains(target)   #first line >= the prefix: the first hash of the range, if any
+                self._db_file.seek(cursor.pos)
+                candidates = []
+                for the_line in self._db_file:
+                    if the_line[:RANGE_PREFIX_LENGTH].upper() != target:
+                        break
+                    candidates.append(the_line)
+        for the_line in candidates:
+            the_line = the_line.strip()
+            if the_line[:RANGE_PREFIX_LENGTH].upper() == target:
+                the_lines.append(the_line[RANGE_PREFIX_LENGTH:].upper())
+        return the_lines
+
+
+class PackedDbRanges:
+    """ Ranges of a packed db (pwned_bindb.py): the digests of a prefix are contiguous.
+        db_class=pwned_blockdb.BlockHashDB serves a block compressed db the same way.
+    """
+
+    def __init__(self, l_db_file:str, db_class=pbindb.PackedHashDB):
+        self._packed_db = db_class(l_db_file)
+
+    def close(self) -> None:
+        self._packed_db.close()
+
+    def range_lines(self, prefix:str) -> list:
+        low = binascii.unhexlify(prefix + "0")   #5 hex chars: 2 bytes and the high nibble of the third
+        packed_db = self._packed_db
+        index = packed_db.lower_bound(low + bytes(pbindb.PACKED_DIGEST_SIZE - len(low)))
+        the_lines = []
+        while index < len(packed_db):
+            digest = packed_db.digest_at(index)
+            if digest[:2] != low[:2] or (digest[2] >> 4) != (low[2] >> 4):
+                break
+            the_lines.append(binascii.hexlify(digest).upper()[RANGE_PREFIX_LENGTH:] + b":" + str(packed_db.count_at(index)).encode("ascii"))
+            index += 1
+        return the_lines
+
+
+class RangeFilesRanges:
+    """ Ranges of a directory (or zip) of range files (pwned_ranges.py): served as they are """
+
+    def __init__(self, range_directory):
+        self._range_directory = range_directory
+
+    def close(self) -> None:
+        self._range_directory.close()
+
+    def range_lines(self, prefix:str) -> list:
+        content = self._range_directory.read_range(prefix)
+        if content is None:
+            return []
+        return [the_line.strip() for the_line in content.splitlines() if the_line.strip()]
+
+
+class RangeService:
+    """ Bodies of the /range/ responses from one of the *Ranges readers above, and the stats """
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+        self.latency = pserve.LatencyRecorder()
+        self.hashes_served:int = 0
+        self.errors:int = 0
+        self.started_at:float = time.time()
+        self._lock = threading.Lock()
+
+    def range_body(self, prefix:str) -> bytes:
+        start = time.perf_counter()
+        the_lines = self.ranges.range_lines(prefix)
+        self.latency.add(time.perf_counter() - start)
+        with self._lock:
+            self.hashes_served += len(the_lines)
+        return formatRange(the_lines)
+
+    def count_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        the_stats = {"hashes_served": self.hashes_served, "errors": self.errors, "uptime_secs": round(time.time() - self.started_at, 1)}
+        the_stats.update(self.latency.percentiles())
+        return the_stats
+
+
+class _RangeHttpHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status:int, body:bytes, content_type:str="text/plain") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        path = self.path.split("?", 1)[0]
+        if path == "/stats":
+            self._reply(200, json.dumps(service.stats()).encode("utf-8"), "application/json")
+        elif path.startswith(RANGE_PATH):
+            prefix = path[len(RANGE_PATH):].upper()
+            if not isValidPrefix(prefix):
+                self._reply(400, b"The hash prefix was not in a valid format")
+                return
+            try:
+                body = service.range_body(prefix)
+            except Exception as e:   #a db error must not kill the server
+                service.count_error()
+                self._reply(500, ("lookup failed: " + str(e)).encode("utf-8"))
+                return
+            self._reply(200, body)
+        else:
+            self._reply(404, b"use GET /range/<first 5 hex chars of the SHA1> or GET /stats")
+
+
+class _ThreadingRangeServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, service:RangeService):
+        self.service:RangeService = service   #read by the handlers
+        super().__init__(server_address, handler_class)
+
+
+def makeRangeServer(address:str, service:RangeService):
+    """ The server (not started yet: call serve_forever) for an http://host:port address """
+    kind, where = pserve.parseAddress(address)
+    if kind != "http":
+        raise pserve.ServeError("the range api needs an http://host:port address, not " + address)
+    return _ThreadingRangeServer(where, _RangeHttpHandler, service)
+
+
+def rangeUrlOf(server) -> str:
+    """ base url of a running server, for --api_url """
+    host, port = server.server_address[:2]
+    return "http://" + host + ":" + str(port) + RANGE_PATH
@@ -0,0 +1,111 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Adaptive rate limiter shared by all the web api requests in flight (pwned_web.py).
+#
+# A token bucket refilled at the current rate. The rate is halved when the server throttles us (429/5xx)
+# and grows back a little after each healthy response, up to the configured maximum.
+# A Retry-After from the server pauses every request until it expires.
+import datetime
+import email.utils
+import random
+import threading
+import time
+
+DEFAULT_MAX_RATE:float   = 50      #requests per second
+DEFAULT_MAX_RETRIES:int  = 5
+MIN_RATE:float           = 0.2     #throttling never slows down below one request every 5 seconds (or the max rate, if lower)
+DECREASE_FACTOR:float    = 0.5     #rate multiplier when throttled
+INCREASE_FRACTION:float  = 0.05    #rate increase after each success, as a fraction of the max rate
+BACKOFF_BASE_SECS:float  = 0.5
+BACKOFF_MAX_SECS:float   = 60
+
+
+def parseRetryAfter(value):
+    """ Seconds to wait from a Retry-After header (delay in seconds or HTTP date). None if missing or not valid. """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+def computeBackoff(attempt:int, base_secs:float=BACKOFF_BASE_SECS, max_secs:float=BACKOFF_MAX_SECS) -> float:
+    """ Exponential backoff with full jitter for the (0 based) attempt that just failed """
+    return random.uniform(0, min(max_secs, base_secs * (2 ** attempt)))
+
+
+class AdaptiveRateLimiter:
+    """ Token bucket with additive increase / multiplicative decrease of its rate. Thread safe. """
+
+    def __init__(self, max_rate:float=DEFAULT_MAX_RATE, burst:float=0):
+        self.max_rate:float = max_rate if max_rate > 0 else MIN_RATE   #-w may ask for less than MIN_RATE
+        self.rate:float = self.max_rate
+        self.capacity:float = burst if burst >= 1 else max(1.0, self.max_rate)
+        self._tokens:float = self.capacity
+        self._last_refill:float = time.monotonic()
+        self._paused_until:float = 0
+        self._lock = threading.Lock()
+        self.throttled:int = 0   #number of times the server asked us to slow down
+
+    def _refill(self, now:float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self) -> None:
+        """ Block until a request can be sent """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * INCREASE_FRACTION)
+
+    def on_throttled(self, retry_after_secs=None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.throttled += 1
+            self.rate = max(min(MIN_RATE, self.max_rate), self.rate * DECREASE_FACTOR)
+            self._tokens = min(self._tokens, 0)
+            if retry_after_secs is not None:
+                self._paused_until = max(self._paused_until, now + retry_after_secs)
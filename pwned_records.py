@@ -0,0 +1,246 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Columnar store of the records read from a -f/-t file (pwned.py), instead of one password_record object each.
+#
+# Columns: the raw 20 bytes SHA1 digests in one bytearray, the line numbers in an array, the pwned flags in a
+# bitset and the plain text passwords in a list only when they are kept (they are written only with -o).
+# The source file name is stored once per store. Hashes that are not 40 uppercase hex chars (-s input can
+# contain anything) are kept as given, on the side, so they are looked up exactly as before.
+#
+# About 30 bytes per record without passwords, against several hundreds for a password_record.
+# RecordView (a __slots__ object) gives the password_record attributes of one record, so the batch engines
+# work on a RecordStore or on a list of password_record alike.
+from array import array
+
+DIGEST_SIZE:int          = 20
+PASSWORD_NOT_KEPT:str    = "unknown"   #src_password of stores without passwords (same as the -s input)
+HEX_UPPER_CHARS          = frozenset("0123456789ABCDEF")
+NO_DIGEST:bytes          = bytes(DIGEST_SIZE)
+
+
+class RecordView:
+    """ password_record like access to the record at index of a RecordStore """
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store, index:int):
+        self._store = store
+        self._index = index
+
+    @property
+    def src_password(self) -> str:
+        return self._store.password_at(self._index)
+
+    @property
+    def src_hash(self) -> str:
+        return self._store.hash_at(self._index)
+
+    @property
+    def src_digest(self):
+        return self._store.digest_at(self._index)
+
+    @property
+    def found_filename(self) -> str:
+        return self._store.found_filename
+
+    @property
+    def found_linenumber(self) -> int:
+        return self._store.line_at(self._index)
+
+    @property
+    def ispwned(self) -> bool:
+        return self._store.is_pwned(self._index)
+
+    @ispwned.setter
+    def ispwned(self, value:bool) -> None:
+        self._store.set_pwned(self._index, value)
+
+
+class RecordStore:
+    """ Records of one source file. Iterating gives a RecordView for each record. """
+
+    def __init__(self, found_filename:str, keep_passwords:bool=True):
+        self.found_filename:str = found_filename
+        self.keep_passwords:bool = keep_passwords
+        self._digests = bytearray()
+        self._lines = array("Q")
+        self._flags = bytearray()
+        self._passwords = [] if keep_passwords else None
+        self._odd_hashes = {}   #index -> hash string that is not a valid uppercase SHA1 hex
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def __iter__(self):
+        for index in range(len(self._lines)):
+            yield RecordView(self, index)
+
+    def __getitem__(self, index:int) -> RecordView:
+        if index < 0:
+            index += len(self._lines)
+        if not 0 <= index < len(self._lines):
+            raise IndexError("record index out of range")
+        return RecordView(self, index)
+
+    def _grow_flags(self) -> None:
+        needed = (len(self._lines) + 7) // 8
+        if len(self._flags) < needed:
+            self._flags.extend(bytes(needed - len(self._flags)))
+
+    def append(self, src_password, found_linenumber:int, src_digest:bytes=None, src_hash:str=None) -> None:
+        """ add a record given its raw digest or its hex hash """
+        if src_digest is None:
+            if len(src_hash) == DIGEST_SIZE * 2 and HEX_UPPER_CHARS.issuperset(src_hash):
+                src_digest = bytes.fromhex(src_hash)
+            else:
+                self._odd_hashes[len(self._lines)] = src_hash
+                src_digest = NO_DIGEST
+        self._digests += src_digest
+        self._lines.append(found_linenumber)
+        if self._passwords is not None:
+            self._passwords.append(src_password)
+        self._grow_flags()
+
+    def extend_digests(self, src_passwords, found_linenumbers, src_digests:bytes) -> None:
+        """ add len(found_linenumbers) records at once: src_digests are their digests concatenated (see pwned_hashing.py) """
+        self._digests += src_digests
+        self._lines.extend(found_linenumbers)
+        if self._passwords is not None:
+            self._passwords.extend(src_passwords)
+        self._grow_flags()
+
+    def extend(self, other, start:int=0, end:int=None) -> None:
+        """ add the records [start, end) of other, flags included """
+        if end is None:
+            end = len(other)
+        first = len(self._lines)
+        src_digests, found_linenumbers, src_passwords, odd_hashes = other.columns(start, end)
+        if src_passwords is None:
+            src_passwords = [PASSWORD_NOT_KEPT] * (end - start)
+        for offset, the_hash in odd_hashes.items():
+            self._odd_hashes[first + offset] = the_hash
+        self.extend_digests(src_passwords, found_linenumbers, src_digests)
+        if other.has_pwned():
+            for index in range(start, end):
+                if other.is_pwned(index):
+                    self.set_pwned(first + index - start, True)
+
+    def columns(self, start:int, end:int):
+        """ (digests, line numbers, passwords or None, {offset from start: hash stored as given}) of the records [start, end) """
+        odd_hashes = {index - start: the_hash for index, the_hash in self._odd_hashes.items() if start <= index < end}
+        src_passwords = self._passwords[start:end] if self._passwords is not None else None
+        return self._digests[start * DIGEST_SIZE:end * DIGEST_SIZE], self._lines[start:end], src_passwords, odd_hashes
+
+    def select(self, indexes):
+        """ new store with the records at indexes (in that order) """
+        selected = RecordStore(self.found_filename, self.keep_passwords)
+        for index in indexes:
+            selected.append(self.password_at(index), self._lines[index], self.digest_at(index), self._odd_hashes.get(index))
+            if self.is_pwned(index):
+                selected.set_pwned(len(selected) - 1, True)
+        return selected
+
+    def unique_indexes(self):
+        """ (indexes of the first record of each distinct hash, for each record the position in that list of its hash) """
+        first_of = {}
+        unique = []
+        fan_out = array("Q")
+        digests = self._digests
+        odd_hashes = self._odd_hashes
+        for index in range(len(self._lines)):
+            key = odd_hashes.get(index)
+            if key is None:
+                key = bytes(digests[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE])
+            position = first_of.get(key)
+            if position is None:
+                position = first_of[key] = len(unique)
+                unique.append(index)
+            fan_out.append(position)
+        return unique, fan_out
+
+    def digest_at(self, index:int):
+        """ raw digest, None for the hashes stored as given """
+        if index in self._odd_hashes:
+            return None
+        offset = index * DIGEST_SIZE
+        return bytes(self._digests[offset:offset + DIGEST_SIZE])
+
+    def hash_at(self, index:int) -> str:
+        odd_hash = self._odd_hashes.get(index)
+        if odd_hash is not None:
+            return odd_hash
+        offset = index * DIGEST_SIZE
+        return self._digests[offset:offset + DIGEST_SIZE].hex().upper()
+
+    def password_at(self, index:int) -> str:
+        if self._passwords is None:
+            return PASSWORD_NOT_KEPT
+        return self._passwords[index]
+
+    def line_at(self, index:int) -> int:
+        return self._lines[index]
+
+    def is_pwned(self, index:int) -> bool:
+        return bool(self._flags[index >> 3] & (1 << (index & 7)))
+
+    def set_pwned(self, index:int, value:bool) -> None:
+        if value:
+            self._flags[index >> 3] |= 1 << (index & 7)
+        else:
+            self._flags[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+    def has_pwned(self) -> bool:
+        return any(self._flags)
+
+    def pwned_count(self) -> int:
+        return sum(bin(flags).count("1") for flags in self._flags)
+
+    def memory_size(self) -> int:
+        """ bytes used by the columns (passwords excluded) """
+        return len(self._digests) + self._lines.itemsize * len(self._lines) + len(self._flags)
+
+
+def iterStoreChunks(l_stores, l_chunk_size:int):
+    """ the records of l_stores (iterable of RecordStore) regrouped in stores of l_chunk_size records
+        (a new chunk is also started when the source file changes)
+    """
+    current = None
+    for the_store in l_stores:
+        start = 0
+        while start < len(the_store):
+            if current is not None and current.found_filename != the_store.found_filename:
+                yield current
+                current = None
+            if current is None:
+                if start == 0 and len(the_store) == l_chunk_size:
+                    yield the_store   #already the right size
+                    break
+                current = RecordStore(the_store.found_filename, the_store.keep_passwords)
+            end = min(len(the_store), start + l_chunk_size - len(current))
+            current.extend(the_store, start, end)
+            start = end
+            if len(current) >= l_chunk_size:
+                yield current
+                current = None
+    if current is not None and len(current) > 0:
+        yield current
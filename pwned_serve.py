@@ -0,0 +1,353 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Lookup daemon started by pwned.py --serve, and its client.
+#
+# The daemon keeps one PwnedChecker (db file, index, packed db mapping or web session) open and answers
+# SHA1 hash checks from concurrent clients, over a Unix domain socket or a local HTTP port:
+#   unix:/path/to/socket   one JSON object per line: {"hashes": [...]} or {"stats": true}, one JSON line back
+#   http://host:port       GET /check/<sha1>, POST /check {"hashes": [...]}, GET /stats
+# Only hashes travel on the socket: the client hashes the passwords itself.
+#
+# Client usage: python pwned_serve.py -a unix:/tmp/pwned.sock -p password_to_check
+import collections
+import getopt
+import hashlib
+import http.client
+import http.server
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+LATENCY_SAMPLES:int = 100000   #percentiles are computed on the most recent requests
+MAX_REQUEST_BYTES:int = 16 * 1024 * 1024
+CLIENT_BATCH_SIZE:int = 1000   #hashes per request when the client checks a file
+
+
+class ServeError(Exception):
+    pass
+
+
+def isValidHash(l_hash) -> bool:
+    if not isinstance(l_hash, str) or len(l_hash) != 40:
+        return False
+    try:
+        int(l_hash, 16)
+    except ValueError:
+        return False
+    return True
+
+
+def parseAddress(address:str):
+    """ ("unix", socket path) or ("http", (host, port)) """
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    if address.startswith("http://"):
+        host, _, port = address[len("http://"):].rstrip("/").rpartition(":")
+        try:
+            return "http", (host or "127.0.0.1", int(port))
+        except ValueError:
+            pass
+    raise ServeError("address must be unix:/path/to/socket or http://host:port, not " + address)
+
+
+class LatencyRecorder:
+    """ Service time of the most recent requests. Thread safe. """
+
+    def __init__(self, max_samples:int=LATENCY_SAMPLES):
+        self._samples = collections.deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self.count:int = 0
+
+    def add(self, secs:float) -> None:
+        with self._lock:
+            self._samples.append(secs)
+            self.count += 1
+
+    def percentiles(self) -> dict:
+        with self._lock:
+            samples = sorted(self._samples)
+        result = {"requests": self.count}
+        for name, fraction in (("p50_ms", 0.50), ("p90_ms", 0.90), ("p99_ms", 0.99), ("max_ms", 1.0)):
+            if samples:
+                result[name] = round(samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000, 4)
+            else:
+                result[name] = 0.0
+        return result
+
+
+class LookupService:
+    """ What both servers do: check hashes with check_hash(hex) -> bool and keep the stats. """
+
+    def __init__(self, check_hash):
+        self.check_hash = check_hash
+        self.latency = LatencyRecorder()
+        self.hashes_checked:int = 0
+        self.hashes_pwned:int = 0
+        self.started_at:float = time.time()
+        self._lock = threading.Lock()
+
+    def check(self, hashes) -> dict:
+        """ hash (upper case) -> True if pwned. Raises ServeError if any hash is not valid. """
+        start = time.perf_counter()
+        if isinstance(hashes, str) or not isinstance(hashes, (list, tuple)):
+            raise ServeError("hashes must be a list of SHA1 hex strings")
+        results = {}
+        for l_hash in hashes:
+            if not isValidHash(l_hash):
+                raise ServeError("not a SHA1 hash: " + str(l_hash)[:64])
+            l_hash = l_hash.upper()
+            results[l_hash] = bool(self.check_hash(l_hash))
+        self.latency.add(time.perf_counter() - start)
+        with self._lock:
+            self.hashes_checked += len(results)
+            self.hashes_pwned += sum(1 for is_pwned in results.values() if is_pwned)
+        return results
+
+    def stats(self) -> dict:
+        the_stats = {"hashes_checked": self.hashes_checked, "hashes_pwned": self.hashes_pwned,
+                     "uptime_secs": round(time.time() - self.started_at, 1)}
+        the_stats.update(self.latency.percentiles())
+        return the_stats
+
+    def handle_request(self, request) -> dict:
+        """ one decoded JSON request of the Unix socket protocol """
+        if not isinstance(request, dict):
+            raise ServeError("request must be a JSON object")
+        if request.get("stats"):
+            return self.stats()
+        return {"results": self.check(request.get("hashes"))}
+
+
+class _UnixHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        for the_line in self.rfile:
+            if not the_line.strip():
+                continue
+            try:
+                response = service.handle_request(json.loads(the_line))
+            except (ServeError, ValueError) as e:
+                response = {"error": str(e)}
+            except Exception as e:   #a db error must not kill the daemon
+                response = {"error": "lookup failed: " + str(e)}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _HttpHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   #keep-alive: a client pays the connection set up once
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status:int, response:dict) -> None:
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _check(self, hashes) -> None:
+        try:
+            self._reply(200, {"results": self.server.service.check(hashes)})
+        except ServeError as e:
+            self._reply(400, {"error": str(e)})
+        except Exception as e:
+            self._reply(500, {"error": "lookup failed: " + str(e)})
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._reply(200, self.server.service.stats())
+        elif self.path.startswith("/check/"):
+            self._check([self.path[len("/check/"):]])
+        else:
+            self._reply(404, {"error": "use GET /check/<sha1>, POST /check or GET /stats"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if self.path != "/check":
+            self._reply(404, {"error": "use POST /check"})
+        elif length > MAX_REQUEST_BYTES:
+            self._reply(413, {"error": "request too big"})
+        else:
+            try:
+                request = json.loads(self.rfile.read(length))
+            except ValueError as e:
+                self._reply(400, {"error": "not valid JSON: " + str(e)})
+                return
+            self._check(request.get("hashes") if isinstance(request, dict) else None)
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, service:LookupService):
+        self.service:LookupService = service   #read by the handlers
+        super().__init__(server_address, handler_class)
+
+
+class _ThreadingHttpServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, service:LookupService):
+        self.service:LookupService = service   #read by the handlers
+        super().__init__(server_address, handler_class)
+
+
+def makeServer(address:str, service:LookupService):
+    """ The server (not started yet: call serve_forever) for address, see parseAddress """
+    kind, where = parseAddress(address)
+    if kind == "unix":
+        if os.path.exists(where):
+            os.remove(where)   #left behind by a previous run
+        return _ThreadingUnixServer(where, _UnixHandler, service)
+    return _ThreadingHttpServer(where, _HttpHandler, service)
+
+
+class LookupClient:
+    """ Client of a running pwned.py --serve daemon. Keeps its connection open. Not thread safe. """
+
+    def __init__(self, address:str, timeout:float=10):
+        self.kind, where = parseAddress(address)
+        if self.kind == "unix":
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(where)
+            self._file = self._socket.makefile("rwb")
+        else:
+            self._connection = http.client.HTTPConnection(where[0], where[1], timeout=timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        if self.kind == "unix":
+            self._file.close()
+            self._socket.close()
+        else:
+            self._connection.close()
+
+    def _request(self, request:dict) -> dict:
+        if self.kind == "unix":
+            self._file.write(json.dumps(request).encode("utf-8") + b"\n")
+            self._file.flush()
+            the_line = self._file.readline()
+            if not the_line:
+                raise ServeError("connection closed by the server")
+            response = json.loads(the_line)
+        else:
+            if request.get("stats"):
+                self._connection.request("GET", "/stats")
+            else:
+                self._connection.request("POST", "/check", json.dumps(request), {"Content-Type": "application/json"})
+            response = json.loads(self._connection.getresponse().read())
+        if "error" in response:
+            raise ServeError(response["error"])
+        return response
+
+    def check_hashes(self, hashes) -> dict:
+        """ hash (upper case) -> True if pwned """
+        return self._request({"hashes": list(hashes)})["results"]
+
+    def is_hash_pwned(self, l_hash:str) -> bool:
+        return self.check_hashes([l_hash.strip()])[l_hash.strip().upper()]
+
+    def is_password_pwned(self, l_password:str) -> bool:
+        return self.is_hash_pwned(hashlib.sha1(l_password.strip().encode("utf-8")).hexdigest())
+
+    def stats(self) -> dict:
+        return self._request({"stats": True})
+
+
+def showHelp() -> None:
+    print("Usage: python pwned_serve.py -a address [-p password]|[-s sha1_hash]|[-f pwds_filename] [--stats]")
+    print(" -a address           (--address)       - address of a running 'pwned.py --serve address': unix:/path or http://host:port")
+    print(" -p password          (--password)      - password to check (hashed here, only the hash is sent)")
+    print(" -s sha1_hash         (--sha1)          - SHA1 hash to check")
+    print(" -f pwds_filename     (--password_file) - file with one password per line")
+    print("                      (--stats)         - print the daemon counters and latency percentiles")
+
+
+def main(argv=None) -> int:
+    """ lightweight client: no db, no pwned.py import """
+    try:
+        arguments, _ = getopt.getopt(sys.argv[1:] if argv is None else argv, "a:p:s:f:h",
+                                     ["address=", "password=", "sha1=", "password_file=", "stats", "help"])
+    except getopt.error as err:
+        print("Argument parsing error: " + str(err))
+        return 1
+    address = ""
+    to_check = []   #(label, hash)
+    password_file = ""
+    want_stats = False
+    for currentArgument, currentValue in arguments:
+        if currentArgument in ("-a", "--address"):
+            address = currentValue.strip()
+        elif currentArgument in ("-p", "--password"):
+            to_check.append((currentValue, hashlib.sha1(currentValue.strip().encode("utf-8")).hexdigest().upper()))
+        elif currentArgument in ("-s", "--sha1"):
+            to_check.append((currentValue, currentValue.strip().upper()))
+        elif currentArgument in ("-f", "--password_file"):
+            password_file = currentValue.strip()
+        elif currentArgument == "--stats":
+            want_stats = True
+        else:
+            showHelp()
+            return 0
+    if address == "" or not (to_check or password_file or want_stats):
+        showHelp()
+        return 1
+
+    try:
+        with LookupClient(address) as client:
+            if password_file:
+                with open(password_file, "r", encoding="utf-8", errors="ignore") as the_file:
+                    words = [the_line.strip() for the_line in the_file if the_line.strip()]
+                to_check.extend((word, hashlib.sha1(word.encode("utf-8")).hexdigest().upper()) for word in words)
+            for i in range(0, len(to_check), CLIENT_BATCH_SIZE):
+                batch = to_check[i:i + CLIENT_BATCH_SIZE]
+                results = client.check_hashes([l_hash for _, l_hash in batch])
+                for label, l_hash in batch:
+                    if results[l_hash]:
+                        print(label + " (Hash = " + l_hash + ") FOUND! This password is PWNED")
+                    else:
+                        print(label + " (Hash = " + l_hash + ") NOT FOUND! This password is SAFE")
+            if want_stats:
+                print(json.dumps(client.stats(), indent=2))
+    except (OSError, ServeError, ValueError) as e:
+        print("ERROR: " + str(e))
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# External merge sort of a HASH:count db into the sorted db used by pwned.py -b (--sort_db).
+#
+# The input (text, or a member of a zip) is read in blocks of run_mb MB cut at line boundaries. Each block is
+# parsed and sorted by a pool of worker processes while the parent reads the next ones, so memory stays bounded
+# by workers + 1 blocks whatever the size of the input. A sorted block is written as one run file per partition:
+# the partitions split the hashes in equal ranges of their first byte (SHA1 hashes are uniform), one per worker.
+# Then each worker merges the runs of one partition with heapq.merge (at most MAX_OPEN_RUNS files at a time,
+# in more passes if needed) and the parts are concatenated. Lines of the same hash become one line with the
+# sum of the counts, and the order is verified while the output is written. The prefix index (pwned_index.py)
+# can be written by the same final pass.
+import binascii
+import collections
+import concurrent.futures
+import heapq
+import os
+import shutil
+import tempfile
+from array import array
+
+import pwned_bindb as pbindb
+import pwned_index as pidx
+import pwned_parallel as pparallel
+
+SORT_DEFAULT_RUN_MB:int  = 32      #input MB sorted in memory at a time by each worker (it takes about 8 times that of RAM)
+MAX_OPEN_RUNS:int        = 128     #run files merged at once
+WRITE_BUFFER_SIZE:int    = 1024 * 1024
+HASH_HEX_LENGTH:int      = 40
+
+
+class SortError(Exception):
+    """ Raised when the db cannot be sorted, or the sorted output does not verify. """
+
+
+class SortSummary:
+    """ What sortDb read and wrote """
+
+    def __init__(self):
+        self.lines_read:int = 0
+        self.invalid_lines:int = 0
+        self.hashes_written:int = 0
+        self.duplicates_merged:int = 0
+        self.runs:int = 0
+        self.partitions:int = 1
+        self.merge_passes:int = 0
+        self.input_sorted:bool = True   #the input was already in order (duplicates aside)
+        self.index_filename:str = ""
+
+
+def iterBlocks(db_file, block_size:int):
+    """ blocks of about block_size bytes of db_file (opened in binary mode), each ending at a line boundary """
+    while True:
+        block = db_file.read(block_size)
+        if not block:
+            return
+        if not block.endswith(b"\n"):
+            block += db_file.readline()
+        yield block
+
+
+def lineEndingOf(block:bytes) -> bytes:
+    end_of_line = block.find(b"\n")
+    return b"\r\n" if end_of_line > 0 and block[end_of_line - 1:end_of_line] == b"\r" else b"\n"
+
+
+def partitionOf(the_hash:bytes, partitions:int) -> int:
+    """ partition (0 .. partitions - 1) of an upper case hex hash: ranges of its first byte """
+    return (int(the_hash[:2], 16) * partitions) >> 8
+
+
+def newRunFile(work_dir:str):
+    return tempfile.NamedTemporaryFile("wb", dir=work_dir, suffix=".run", delete=False, buffering=WRITE_BUFFER_SIZE)
+
+
+def sortBlock(block:bytes, work_dir:str, partitions:int=1) -> tuple:
+    """ Parse and sort one block into one run file per partition of 'HASH:count' lines, distinct hashes (counts summed).
+        Returns (run file names, lines read, invalid lines, duplicates merged, first hash, last hash, block in order)
+    """
+    counts = {}
+    lines_read = invalid_lines = duplicates = 0
+    first_hash = last_hash = None
+    in_order = True
+    for the_line in block.splitlines():
+        lines_read += 1
+        the_hash, _, count = the_line.strip().partition(b":")
+        if len(the_hash) != HASH_HEX_LENGTH:
+            if the_hash:
+                invalid_lines += 1
+            continue
+        try:
+            binascii.unhexlify(the_hash)
+        except (binascii.Error, ValueError):
+            invalid_lines += 1
+            continue
+        try:
+            count = int(count.split(b":", 1)[0]) if count else 0
+        except ValueError:
+            count = 0   #as pwned_bindb.parseDbLine
+        the_hash = the_hash.upper()
+        if last_hash is None:
+            first_hash = the_hash
+        elif the_hash < last_hash:
+            in_order = False
+        last_hash = the_hash
+        if the_hash in counts:
+            counts[the_hash] += count
+            duplicates += 1
+        else:
+            counts[the_hash] = count
+    del block
+    sorted_hashes = sorted(counts)
+    run_files = []
+    start = 0
+    for partition in range(partitions):
+        end = start
+        while end < len(sorted_hashes) and partitionOf(sorted_hashes[end], partitions) == partition:
+            end += 1
+        with newRunFile(work_dir) as run_file:
+            run_file.writelines(the_hash + b":" + str(counts[the_hash]).encode("ascii") + b"\n" for the_hash in sorted_hashes[start:end])
+        run_files.append(run_file.name)
+        start = end
+    return run_files, lines_read, invalid_lines, duplicates, first_hash, last_hash, in_order
+
+
+def mergeRuns(run_files, out_file, new_line:bytes=b"\n", prefix_bits:int=0) -> tuple:
+    """ Write to out_file (binary) the lines of the sorted run_files, one per hash (counts summed), verifying the order.
+        With prefix_bits the offset of the first line of each prefix is recorded for the index.
+        Returns (hashes written, duplicates merged, prefixes, their offsets, first hash, last hash)
+    """
+    opened_files = [open(run_filename, "rb") for run_filename in run_files]
+    hashes_written = duplicates = 0
+    prefix_chars = prefix_bits // 4
+    prefixes, offsets = array("L"), array("Q")
+    offset:int = 0
+    first_hash:bytes = b""
+    last_hash:bytes = b""
+    last_count:int = 0
+
+    def writeLast():
+        nonlocal offset, hashes_written
+        if prefix_chars:
+            prefix = int(last_hash[:prefix_chars], 16)
+            if not prefixes or prefixes[-1] != prefix:
+                prefixes.append(prefix)
+                offsets.append(offset)
+        the_line = last_hash + b":" + str(last_count).encode("ascii") + new_line
+        out_file.write(the_line)
+        offset += len(the_line)
+        hashes_written += 1
+
+    try:
+        for the_line in heapq.merge(*opened_files):
+            the_hash = the_line[:HASH_HEX_LENGTH]
+            count = int(the_line[HASH_HEX_LENGTH + 1:])
+            if the_hash == last_hash:
+                last_count += count
+                duplicates += 1
+                continue
+            if last_hash:
+                if the_hash < last_hash:
+                    raise SortError("sorted output does not verify: " + the_hash.decode("ascii") + " after " + last_hash.decode("ascii"))
+                writeLast()
+            else:
+                first_hash = the_hash
+            last_hash, last_count = the_hash, count
+        if last_hash:
+            writeLast()
+    finally:
+        for run_file in opened_files:
+            run_file.close()
+    return hashes_written, duplicates, prefixes, offsets, first_hash, last_hash
+
+
+def mergePartition(run_files, out_filename:str, work_dir:str, new_line:bytes=b"\n", prefix_bits:int=0) -> tuple:
+    """ Merge the runs of one partition into out_filename, in more passes if they are more than MAX_OPEN_RUNS
+        (the runs are removed as they are merged). Returns (merge passes, the mergeRuns result)
+    """
+    passes = 0
+    extra_duplicates = 0
+    while len(run_files) > MAX_OPEN_RUNS:
+        merged_files = []
+        for start in range(0, len(run_files), MAX_OPEN_RUNS):
+            with newRunFile(work_dir) as run_file:
+                extra_duplicates += mergeRuns(run_files[start:start + MAX_OPEN_RUNS], run_file)[1]
+            merged_files.append(run_file.name)
+            for run_filename in run_files[start:start + MAX_OPEN_RUNS]:
+                os.remove(run_filename)
+        run_files = merged_files
+        passes += 1
+    with open(out_filename, "wb", buffering=WRITE_BUFFER_SIZE) as out_file:
+        hashes_written, duplicates, prefixes, offsets, first_hash, last_hash = mergeRuns(run_files, out_file, new_line, prefix_bits)
+    for run_filename in run_files:
+        os.remove(run_filename)
+    return passes + 1, (hashes_written, duplicates + extra_duplicates, prefixes, offsets, first_hash, last_hash)
+
+
+def sortDb(l_local_db_file:str, out_filename:str, l_local_zip_file:str="", workers:int=1, run_mb:float=SORT_DEFAULT_RUN_MB,
+           prefix_bits:int=0, work_dir:str="") -> SortSummary:
+    """ Sort l_local_db_file (inside l_local_zip_file if given) into out_filename (may be the same file), with the index
+        of prefix_bits bits if not 0. Temporary runs go to work_dir (default: the directory of out_filename).
+    """
+    if prefix_bits and prefix_bits not in pidx.INDEX_ALLOWED_BITS:
+        raise SortError("prefix bits must be one of " + str(pidx.INDEX_ALLOWED_BITS))
+    summary = SortSummary()
+    summary.partitions = partitions = max(1, min(workers, 256))
+    partition_runs = [[] for _ in range(partitions)]
+    new_line = b"\n"
+    previous_last = None
+    temp_filename = out_filename + ".tmp"
+    work_dir = tempfile.mkdtemp(prefix="pwned_sort_", dir=work_dir or os.path.dirname(os.path.abspath(out_filename)))
+
+    def collect(result):
+        nonlocal previous_last
+        run_files, lines_read, invalid_lines, duplicates, first_hash, last_hash, in_order = result
+        for partition, run_filename in enumerate(run_files):
+            partition_runs[partition].append(run_filename)
+        summary.runs += 1
+        summary.lines_read += lines_read
+        summary.invalid_lines += invalid_lines
+        summary.duplicates_merged += duplicates
+        if not in_order or (previous_last is not None and first_hash is not None and first_hash < previous_last):
+            summary.input_sorted = False
+        if last_hash is not None:
+            previous_last = last_hash
+
+    executor = None
+    if workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=pparallel.getProcessContext())
+    try:
+        with pbindb.openTextDb(l_local_db_file, l_local_zip_file) as db_file:
+            pending = collections.deque()   #in input order: the order across blocks is checked as they complete
+            for block_number, block in enumerate(iterBlocks(db_file, max(1, int(run_mb * 1024 * 1024)))):
+                if block_number == 0:
+                    new_line = lineEndingOf(block)
+                if executor is None:
+                    collect(sortBlock(block, work_dir, partitions))
+                    continue
+                pending.append(executor.submit(sortBlock, block, work_dir, partitions))
+                del block
+                if len(pending) >= workers:
+                    collect(pending.popleft().result())
+            while pending:
+                collect(pending.popleft().result())
+
+        if partitions == 1:
+            part_filenames = [temp_filename]
+        else:
+            part_filenames = [os.path.join(work_dir, "part" + str(partition)) for partition in range(partitions)]
+        arguments = (partition_runs, part_filenames, [work_dir] * partitions, [new_line] * partitions, [prefix_bits] * partitions)
+        merged = list(executor.map(mergePartition, *arguments)) if executor is not None else list(map(mergePartition, *arguments))
+
+        #the parts are in hash order: concatenated, with their index offsets shifted
+        all_prefixes, all_offsets = array("L"), array("Q")
+        part_start:int = 0
+        last_hash = b""
+        out_file = open(temp_filename, "wb") if partitions > 1 else None
+        try:
+            for part_filename, (passes, result) in zip(part_filenames, merged):
+                hashes_written, duplicates, prefixes, offsets, first_hash, part_last_hash = result
+                if first_hash and last_hash and first_hash <= last_hash:
+                    raise SortError("sorted output does not verify: " + first_hash.decode("ascii") + " after " + last_hash.decode("ascii"))
+                last_hash = part_last_hash or last_hash
+                summary.merge_passes = max(summary.merge_passes, passes)
+                summary.hashes_written += hashes_written
+                summary.duplicates_merged += duplicates
+                all_prefixes.extend(prefixes)
+                all_offsets.extend(offset + part_start for offset in offsets)
+                part_start += os.path.getsize(part_filename)
+                if out_file is not None:
+                    with open(part_filename, "rb") as part_file:
+                        shutil.copyfileobj(part_file, out_file, WRITE_BUFFER_SIZE)
+                    os.remove(part_filename)
+        finally:
+            if out_file is not None:
+                out_file.close()
+        os.replace(temp_filename, out_filename)
+        if prefix_bits:
+            summary.index_filename = pidx.indexFilenameFor(out_filename)
+            pidx.writeIndex(summary.index_filename, prefix_bits, os.path.getsize(out_filename), zip(all_prefixes, all_offsets))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if os.path.isfile(temp_filename):
+            os.remove(temp_filename)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return summary
@@ -21,6 +21,7 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
+import threading
 import time
 
 class PwnedStats:
@@ -50,6 +51,15 @@ class PwnedStats:
             self.safe_passwords_found:int    = 0
             self.scanned_lines_in_db:int     = 0  #if local db option used
             self.safe_passwords_invalid:int  = 0
+            self.range_cache_hits:int        = 0  #if --cache option used
+            self.range_cache_misses:int      = 0
+            self.web_requests_retried:int    = 0
+            self.filter_negatives:int        = 0  #checks answered by the bloom filter alone (--build_filter)
+            self.filter_positives:int        = 0  #checks the filter passed on to the db
+            self.hot_tier_hits:int           = 0  #checks answered by the in memory hot tier (--build_hot_tier)
+            self.hot_tier_misses:int         = 0  #checks the hot tier passed on to the db
+            self.unique_passwords_checked:int = 0  #distinct hashes actually looked up by the -f/-t batch engines
+            self._lock = threading.Lock()
 
             self._initialized = True
             
@@ -66,6 +76,12 @@ class PwnedStats:
     def get_elapsed_time_str(self) -> str:
         return f"{self.elapsed_time:.2f} seconds"
 
+    def add(self, **counters) -> None:
+        """ thread safe += of the counters given by name, e.g. add(number_of_password_read=1, pwned_passwords_found=1) """
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
     def increment_number_of_password_read(self) -> None:
         self.number_of_password_read += 1
 
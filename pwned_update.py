@@ -0,0 +1,189 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Incremental update of the sorted HASH:count text db used by pwned.py -b (--update_db).
+#
+# The hashes of a new release (or of a smaller delta file) are merged in ascending order: the db cursor of the
+# merge join (pwned_join.py) jumps from one hash of the delta to the next, and the bytes in between are copied
+# to the new db as they are, in big blocks, without being parsed. Hashes not in the db are inserted, counts that
+# changed are rewritten, everything else is left untouched. The parsing work is bounded by the size of the delta.
+#
+# Every change is also tallied by 20 bits (5 hex chars, the range api) prefix: the changelog lists the prefixes
+# touched and the index sidecar (pwned_index.py) is patched by shifting its offsets instead of being rebuilt.
+import binascii
+import datetime
+import os
+from array import array
+
+import pwned_bindb as pbindb
+import pwned_join as pjoin
+
+CHANGELOG_SUFFIX:str    = ".changelog"
+COPY_BLOCK_SIZE:int     = 1024 * 1024
+PREFIX_CHARS:int        = 5
+PREFIX_BITS:int         = PREFIX_CHARS * 4
+
+
+class UpdateError(Exception):
+    """ Raised when the db cannot be updated with the delta file. """
+
+
+class DeltaNotSortedError(UpdateError):
+    """ Raised by iterDeltaRecords: use sortedDeltaRecords instead. """
+
+
+def changelogFilenameFor(l_db_file:str) -> str:
+    return l_db_file + CHANGELOG_SUFFIX
+
+
+def iterDeltaRecords(l_delta_file:str):
+    """ (upper case hex hash as bytes, count) of the HASH:count lines of l_delta_file, ascending and distinct
+        (the last count of a repeated hash wins). Raises DeltaNotSortedError if the file is not sorted.
+    """
+    last_hash = None
+    last_count = 0
+    with open(l_delta_file, "rb") as delta_file:
+        for the_line in delta_file:
+            record = pbindb.parseDbLine(the_line)
+            if record is None:
+                continue
+            the_hash = binascii.hexlify(record[0]).upper()
+            if last_hash is not None:
+                if the_hash < last_hash:
+                    raise DeltaNotSortedError(l_delta_file + " is not sorted")
+                if the_hash != last_hash:
+                    yield last_hash, last_count
+            last_hash, last_count = the_hash, record[1]
+    if last_hash is not None:
+        yield last_hash, last_count
+
+
+def sortedDeltaRecords(l_delta_file:str) -> list:
+    """ same as iterDeltaRecords for an unsorted (small) delta: sorted in memory """
+    records = {}
+    with open(l_delta_file, "rb") as delta_file:
+        for the_line in delta_file:
+            record = pbindb.parseDbLine(the_line)
+            if record is not None:
+                records[binascii.hexlify(record[0]).upper()] = record[1]
+    return sorted(records.items())
+
+
+class UpdateSummary:
+    """ What mergeDelta changed, by 20 bits prefix """
+
+    def __init__(self):
+        self.added:int = 0
+        self.updated:int = 0
+        self.unchanged:int = 0
+        self.lines_read:int = 0
+        self.added_by_prefix = array("Q", bytes(8 << PREFIX_BITS))
+        self.updated_by_prefix = array("Q", bytes(8 << PREFIX_BITS))
+        self.bytes_by_prefix = array("q", bytes(8 << PREFIX_BITS))   #bytes added (or removed) in the lines of each prefix
+
+    def changed_prefixes(self):
+        """ (prefix, hashes added, counts updated) of the prefixes touched, ascending """
+        for prefix in range(1 << PREFIX_BITS):
+            if self.added_by_prefix[prefix] or self.updated_by_prefix[prefix]:
+                yield prefix, self.added_by_prefix[prefix], self.updated_by_prefix[prefix]
+
+
+def copyBytes(src_file, out_file, start:int, end:int) -> None:
+    src_file.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        block = src_file.read(min(COPY_BLOCK_SIZE, remaining))
+        if not block:
+            raise UpdateError("db changed while being updated")
+        out_file.write(block)
+        remaining -= len(block)
+
+
+def lineEnding(l_db_file:str) -> bytes:
+    with open(l_db_file, "rb") as db_file:
+        first_line = db_file.readline()
+    return b"\r\n" if first_line.endswith(b"\r\n") else b"\n"
+
+
+def mergeDelta(l_db_file:str, l_delta_records, out_filename:str, the_index=None, on_added=None) -> UpdateSummary:
+    """ Write to out_filename the sorted db l_db_file updated with l_delta_records ((hash, count) ascending, see
+        iterDeltaRecords): new hashes are inserted, the count of the others is replaced by the one of the delta.
+        the_index (PrefixIndex of l_db_file, optional) speeds up the jumps. on_added(digest) is called for each new hash.
+    """
+    summary = UpdateSummary()
+    new_line = lineEnding(l_db_file)
+    with open(l_db_file, "rb") as db_file, open(l_db_file, "rb") as src_file, open(out_filename, "wb") as out_file:
+        cursor = pjoin.SortedDbCursor(db_file, the_index)
+        copied_up_to:int = 0   #bytes of l_db_file already in out_file
+        end_of_line_missing = False   #the last line of l_db_file has no end of line: added before appending after it
+        if cursor.size > 0:
+            src_file.seek(cursor.size - 1)
+            end_of_line_missing = src_file.read(1) != b"\n"
+        for the_hash, count in l_delta_records:
+            prefix = int(the_hash[:PREFIX_CHARS], 16)
+            updated_line = the_hash + b":" + str(count).encode("ascii") + new_line
+            found = cursor.contains(the_hash)
+            copyBytes(src_file, out_file, copied_up_to, cursor.pos)
+            copied_up_to = cursor.pos
+            if not found:
+                if end_of_line_missing and copied_up_to == cursor.size:
+                    out_file.write(new_line)
+                    end_of_line_missing = False
+                out_file.write(updated_line)
+                summary.added += 1
+                summary.added_by_prefix[prefix] += 1
+                summary.bytes_by_prefix[prefix] += len(updated_line)
+                if on_added is not None:
+                    on_added(binascii.unhexlify(the_hash))
+                continue
+            src_file.seek(cursor.pos)
+            old_line = src_file.readline()
+            copied_up_to += len(old_line)
+            parsed = pbindb.parseDbLine(old_line)
+            if parsed is not None and parsed[1] == count:
+                out_file.write(old_line)
+                summary.unchanged += 1
+                continue
+            if not old_line.endswith(new_line):
+                #keep the end of line of the old line (or none at all for the last line)
+                updated_line = updated_line[:-len(new_line)] + (b"\n" if old_line.endswith(b"\n") else b"")
+            out_file.write(updated_line)
+            summary.updated += 1
+            summary.updated_by_prefix[prefix] += 1
+            summary.bytes_by_prefix[prefix] += len(updated_line) - len(old_line)
+        copyBytes(src_file, out_file, copied_up_to, cursor.size)
+        summary.lines_read = cursor.lines_read
+    return summary
+
+
+def appendChangelog(l_db_file:str, l_delta_file:str, summary:UpdateSummary) -> str:
+    """ append to <db>.changelog one header line and a 'PREFIX:added:updated' line for each prefix touched.
+        Returns the changelog file name.
+    """
+    changelog_filename = changelogFilenameFor(l_db_file)
+    with open(changelog_filename, "a", encoding="utf-8", newline="\n") as changelog_file:
+        changelog_file.write("# " + datetime.datetime.now().isoformat(timespec="seconds") + " " + os.path.basename(l_delta_file) +
+                             ": " + str(summary.added) + " added, " + str(summary.updated) + " updated\n")
+        for prefix, added, updated in summary.changed_prefixes():
+            changelog_file.write(format(prefix, "05X") + ":" + str(added) + ":" + str(updated) + "\n")
+    return changelog_filename
@@ -0,0 +1,208 @@
+"""
+MIT License
+
+Copyright (c) [2024] [Antonio Romeo]
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# Batched client of the /range/ web api used by pwned.py when no local db is given.
+#
+# Hashes are grouped by their HASH_PREFIX_LENGTH chars prefix, each distinct range is downloaded once
+# and the requests run concurrently on a pool of threads sharing keep-alive connections (requests.Session).
+# All the threads share one adaptive rate limiter; throttled (429) and failed (5xx, network) requests are retried.
+# Each request is timed (network stage and pwned_http_request_seconds{status}, see pwned_metrics.py).
+import concurrent.futures
+import threading
+import time
+import urllib.parse
+
+import pwned_metrics as pmetrics
+import pwned_ratelimit as pratelimit
+
+requests = None   #loaded by importRequests() when the first client is created: offline runs never import it
+
+DEFAULT_CONNECTIONS:int = 8
+REQUEST_TIMEOUT:int     = 10
+
+
+def parseRangeResponse(response_text:str) -> dict:
+    """ Parse the 'SUFFIX:count' lines of a range response into a dictionary suffix -> count.
+        Suffixes with count 0 (padding) are left out.
+    """
+    suffixes = {}
+    for the_line in response_text.splitlines():
+        suffix, _, count = the_line.partition(":")
+        suffix = suffix.strip().upper()
+        if not suffix:
+            continue
+        try:
+            the_count = int(count)
+        except ValueError:
+            the_count = 1
+        if the_count > 0:
+            suffixes[suffix] = the_count
+    return suffixes
+
+
+def normalizeApiUrl(l_url:str) -> str:
+    """ base url of a range api, to which the prefix is appended: http://host:port alone gets /range/,
+        a trailing / is added otherwise. Raises ValueError if l_url is not an http(s) url.
+    """
+    scheme, netloc, path, _, _ = urllib.parse.urlsplit(l_url.strip())
+    if scheme not in ("http", "https") or not netloc:
+        raise ValueError("not an http(s) url: " + l_url)
+    if path in ("", "/"):
+        path = "/range/"
+    elif not path.endswith("/"):
+        path += "/"
+    return urllib.parse.urlunsplit((scheme, netloc, path, "", ""))
+
+
+class RangeResult:
+    """ Outcome of the download of one range: suffixes is None if the request failed. """
+    __slots__ = ("prefix", "status_code", "suffixes", "message")
+
+    def __init__(self, prefix:str, status_code:int, suffixes=None, message:str=""):
+        self.prefix = prefix
+        self.status_code = status_code
+        self.suffixes = suffixes
+        self.message = message
+
+    def is_valid(self) -> bool:
+        return self.suffixes is not None
+
+
+def describeStatus(status_code:int, response_text:str="") -> str:
+    if status_code == 404:
+        return "ERROR 404 - Page not Found."
+    if status_code == 429:
+        return "ERROR 429 - rate limit exceeded"
+    if status_code == 400:
+        return "ERROR 400 - The hash prefix was not valid hexadecimal"
+    return "ERROR Unknown: " + str(status_code) + " " + response_text
+
+
+def importRequests():
+    global requests
+    if requests is None:
+        import requests.adapters   #binds the global requests
+    return requests
+
+
+class RangeClient:
+    """ Download and parse /range/ responses over a pool of keep-alive connections. Thread safe. """
+
+    def __init__(self, base_url:str, max_connections:int=DEFAULT_CONNECTIONS, ssl_check:bool=True, delay_secs:float=0, cache=None,
+                 max_rate:float=pratelimit.DEFAULT_MAX_RATE, max_retries:int=pratelimit.DEFAULT_MAX_RETRIES):
+        self.base_url:str = base_url
+        self.cache = cache   #optional RangeCache (pwned_cache.py): only missing or expired ranges are downloaded
+        self.max_connections:int = max(1, max_connections)
+        self.ssl_check:bool = ssl_check
+        self.max_retries:int = max(0, max_retries)
+        if delay_secs > 0:
+            #-w: never more than one request every delay_secs, whatever the number of connections
+            self.limiter = pratelimit.AdaptiveRateLimiter(min(max_rate, 1 / delay_secs), burst=1)
+        else:
+            self.limiter = pratelimit.AdaptiveRateLimiter(max_rate)
+        importRequests()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._counters_lock = threading.Lock()
+        self.requests_done:int = 0
+        self.retries:int = 0
+        registry = pmetrics.getRegistry()
+        self._request_seconds = registry.histogram("pwned_http_request_seconds", "Latency of the range requests by status (0: no response)")
+        self._bytes_received = registry.counter("pwned_http_bytes_received_total", "Bytes of the range responses")
+
+    def close(self) -> None:
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def _get(self, prefix:str):
+        """ One request. Returns (RangeResult, retry_after_secs, True if it is worth retrying) """
+        self.limiter.acquire()
+        start = time.perf_counter()
+        status_code = 0
+        try:
+            response = self.session.get(self.base_url + prefix, timeout=REQUEST_TIMEOUT, verify=self.ssl_check)
+            status_code = response.status_code
+            self._bytes_received.inc(len(response.content))
+        except requests.RequestException as e:
+            return RangeResult(prefix, 0, None, "ERROR - request failed: " + str(e)), None, True
+        finally:
+            secs = time.perf_counter() - start
+            self._request_seconds.observe(secs, {"status": str(status_code)})
+            pmetrics.getRegistry().observe_stage(pmetrics.STAGE_NETWORK, secs)
+            with self._counters_lock:
+                self.requests_done += 1
+        if response.status_code == 200:
+            self.limiter.on_success()
+            return RangeResult(prefix, 200, parseRangeResponse(response.text)), None, False
+        range_result = RangeResult(prefix, response.status_code, None, describeStatus(response.status_code, response.text))
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = pratelimit.parseRetryAfter(response.headers.get("Retry-After"))
+            self.limiter.on_throttled(retry_after)
+            return range_result, retry_after, True
+        return range_result, None, False
+
+    def fetch_range(self, prefix:str) -> RangeResult:
+        if self.cache is not None:
+            cached_suffixes = self.cache.get(prefix)
+            if cached_suffixes is not None:
+                return RangeResult(prefix, 200, cached_suffixes)
+
+        for attempt in range(self.max_retries + 1):
+            range_result, retry_after, retry_it = self._get(prefix)
+            if not retry_it:
+                break
+            if attempt == self.max_retries:
+                range_result.message += " (gave up after " + str(self.max_retries) + " retries)"
+                break
+            with self._counters_lock:
+                self.retries += 1
+            if retry_after is None:
+                time.sleep(pratelimit.computeBackoff(attempt))
+            #otherwise the limiter keeps every request on hold until Retry-After expires
+
+        if range_result.is_valid() and self.cache is not None:
+            self.cache.put(prefix, range_result.suffixes)
+        return range_result
+
+    def fetch_ranges(self, prefixes, on_result=None) -> dict:
+        """ Download all (distinct) prefixes concurrently. Returns prefix -> RangeResult.
+            on_result(range_result) is called (in the calling thread) as soon as each range is available.
+        """
+        results = {}
+        distinct_prefixes = list(dict.fromkeys(prefixes))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            futures = [executor.submit(self.fetch_range, prefix) for prefix in distinct_prefixes]
+            for future in concurrent.futures.as_completed(futures):
+                range_result = future.result()
+                results[range_result.prefix] = range_result
+                if on_result is not None:
+                    on_result(range_result)
+        return results
+
+
+def splitHash(l_hash:str, prefix_length:int):
+    """ (prefix, suffix) of an hex hash as used by the range api """
+    return l_hash[0:prefix_length].upper(), l_hash[prefix_length:].upper()
@@ -0,0 +1,1266 @@
+import gzip
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import unittest.mock
+import urllib.error
+import urllib.request
+
+import pwned_bindb as pbindb
+import pwned_stats as pstat
+import pwned_index as pidx
+import pwned_join as pjoin
+import pwned_parallel as pparallel
+import pwned_web as pweb
+import pwned_cache as pcache
+import pwned_ratelimit as pratelimit
+import pwned_output as poutput
+import pwned_serve as pserve
+import pwned_filter as pfilter
+import pwned_hashing as phash
+import pwned_records as precords
+import pwned_bench as pbench
+import pwned_metrics as pmetrics
+import pwned_update as pupdate
+import pwned_hot as phot
+import pwned_ranges as pranges
+import pwned_rangeserve as prangeserve
+import pwned_sort as psort
+import pwned_blockdb as pblockdb
+import pwned
+
+
+def sha1Hex(the_password):
+    return hashlib.sha1(the_password.encode("utf-8")).hexdigest().upper()
+
+
+def writeTextDb(filename, passwords, sort_it=True):
+    lines = [sha1Hex(pwd) + ":" + str(count) for count, pwd in enumerate(passwords, start=1)]
+    if sort_it:
+        lines.sort()
+    with open(filename, "w", encoding="utf-8", newline="\n") as db_file:
+        db_file.write("\n".join(lines) + "\n")
+
+
+PWNED_WORDS = ["password", "123456", "qwerty", "letmein", "dragon", "monkey", "zaqwsx"]
+SAFE_WORDS  = ["Patagarru", "Sirripignu", "KjW@i2348.@@DICIOTTO"]
+
+
+class WorkDirTestCase(unittest.TestCase):
+    """ TestCase with a temporary directory, self.work_dir, removed after each test """
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+
+class TestPackedDb(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text_db = os.path.join(self.work_dir, "db.txt")
+        self.packed_db = os.path.join(self.work_dir, "db.bin")
+
+    def check_lookups(self):
+        with pbindb.PackedHashDB(self.packed_db) as packed_db:
+            self.assertEqual(len(packed_db), len(PWNED_WORDS))
+            for word in PWNED_WORDS:
+                self.assertTrue(packed_db.lookup_hex(sha1Hex(word)), word)
+            for word in SAFE_WORDS:
+                self.assertFalse(packed_db.lookup_hex(sha1Hex(word)), word)
+            self.assertEqual(packed_db.get_count(bytes.fromhex(sha1Hex("qwerty"))), 3)
+            self.assertFalse(packed_db.lookup_hex("not_an_hash"))
+
+    def test_sorted_input(self):
+        writeTextDb(self.text_db, PWNED_WORDS)
+        self.assertEqual(pbindb.buildPackedDb(self.text_db, self.packed_db), len(PWNED_WORDS))
+        self.check_lookups()
+
+    def test_unsorted_input(self):
+        writeTextDb(self.text_db, PWNED_WORDS, sort_it=False)
+        self.assertEqual(pbindb.buildPackedDb(self.text_db, self.packed_db), len(PWNED_WORDS))
+        self.check_lookups()
+
+    def test_not_a_packed_db(self):
+        writeTextDb(self.text_db, PWNED_WORDS)
+        with self.assertRaises(pbindb.PackedDBError):
+            pbindb.PackedHashDB(self.text_db)
+
+
+class TestPrefixIndex(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text_db = os.path.join(self.work_dir, "db.txt")
+
+    def tearDown(self):
+        pidx.closeIndexes()
+        super().tearDown()
+
+    def check_lookups(self, the_index):
+        for word in PWNED_WORDS:
+            self.assertTrue(the_index.lookup(sha1Hex(word)), word)
+        for word in SAFE_WORDS:
+            self.assertFalse(the_index.lookup(sha1Hex(word)), word)
+        self.assertFalse(the_index.lookup("not_an_hash"))
+
+    def test_lookup(self):
+        writeTextDb(self.text_db, PWNED_WORDS)
+        for prefix_bits in pidx.INDEX_ALLOWED_BITS:
+            pidx.buildIndex(self.text_db, prefix_bits)
+            with pidx.PrefixIndex(self.text_db) as the_index:
+                self.assertEqual(the_index.prefix_bits, prefix_bits)
+                self.check_lookups(the_index)
+
+    def test_lookup_big_buckets(self):
+        writeTextDb(self.text_db, PWNED_WORDS + SAFE_WORDS[:1])
+        pidx.buildIndex(self.text_db, 16)
+        saved_max_read = pidx.INDEX_MAX_READ_BYTES
+        pidx.INDEX_MAX_READ_BYTES = 0   #force the binary search inside the bucket
+        try:
+            with pidx.PrefixIndex(self.text_db) as the_index:
+                for word in PWNED_WORDS + SAFE_WORDS[:1]:
+                    self.assertTrue(the_index.lookup(sha1Hex(word)), word)
+                self.assertFalse(the_index.lookup(sha1Hex(SAFE_WORDS[1])))
+        finally:
+            pidx.INDEX_MAX_READ_BYTES = saved_max_read
+
+    def test_unsorted_db(self):
+        writeTextDb(self.text_db, PWNED_WORDS, sort_it=False)
+        with self.assertRaises(pidx.PrefixIndexError):
+            pidx.buildIndex(self.text_db)
+        self.assertFalse(os.path.exists(pidx.indexFilenameFor(self.text_db)))
+
+    def test_stale_index(self):
+        writeTextDb(self.text_db, PWNED_WORDS)
+        pidx.buildIndex(self.text_db)
+        writeTextDb(self.text_db, PWNED_WORDS + SAFE_WORDS)
+        with self.assertRaises(pidx.PrefixIndexError):
+            pidx.getIndexFor(self.text_db)
+        self.assertIsNone(pidx.getIndexFor(self.text_db))
+
+
+class TestDictionaryJoin(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text_db = os.path.join(self.work_dir, "db.txt")
+        self.db_words = PWNED_WORDS + ["word" + str(i) for i in range(500)]
+        writeTextDb(self.text_db, self.db_words, sort_it=False)
+
+    def make_records(self, words):
+        return [pwned.password_record(word, sha1Hex(word), "test", line) for line, word in enumerate(words, start=1)]
+
+    def test_group_by_hash(self):
+        records = self.make_records(["password", "dragon", "password", "Patagarru", "password"])
+        groups = pwned.groupRecordsByHash(records)
+        self.assertEqual(len(groups), 3)
+        self.assertEqual([record.found_linenumber for record in groups[sha1Hex("password")]], [1, 3, 5])
+
+    def test_duplicates_present_and_absent(self):
+        words = PWNED_WORDS + SAFE_WORDS + PWNED_WORDS[:3] + SAFE_WORDS[:1] + ["word499"]
+        records = self.make_records(words)
+        loc_stats = pstat.PwnedStats()
+        found_before, safe_before = loc_stats.pwned_passwords_found, loc_stats.safe_passwords_found
+        self.assertTrue(pwned.isHashListPwnedLocal(records, self.text_db, "", pwned.OM_PLAIN))
+        self.assertEqual([record.ispwned for record in records], [word in self.db_words for word in words])
+        self.assertEqual(loc_stats.pwned_passwords_found - found_before, len(PWNED_WORDS) + 3 + 1)
+        self.assertEqual(loc_stats.safe_passwords_found - safe_before, len(SAFE_WORDS) + 1)
+
+    def test_stops_when_all_found(self):
+        records = self.make_records(PWNED_WORDS[:2] * 3)   #the first two lines of the db
+        loc_stats = pstat.PwnedStats()
+        scanned_before = loc_stats.scanned_lines_in_db
+        self.assertTrue(pwned.isHashListPwnedLocal(records, self.text_db, "", pwned.OM_PLAIN))
+        self.assertTrue(all(record.ispwned for record in records))
+        self.assertEqual(loc_stats.scanned_lines_in_db - scanned_before, 2)
+        records = self.make_records(SAFE_WORDS)
+        self.assertFalse(pwned.isHashListPwnedLocal(records, self.text_db, "", pwned.OM_PLAIN))
+
+
+class TestMergeJoin(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text_db = os.path.join(self.work_dir, "db.txt")
+        self.db_words = ["word" + str(i) for i in range(5000)]
+        writeTextDb(self.text_db, self.db_words)
+
+    def check_join(self, the_index=None):
+        for step in [1, 7, 499, 4999]:
+            pwned_hashes = [sha1Hex(word) for word in self.db_words[::step]]
+            safe_hashes  = [sha1Hex("safe" + str(i)) for i in range(0, 5000, step)]
+            found, _ = pjoin.mergeJoinSortedDb(pwned_hashes + safe_hashes + pwned_hashes[:3] + ["not_an_hash"], self.text_db, the_index)
+            self.assertEqual(found, set(pwned_hashes))
+
+    def test_join(self):
+        self.check_join()
+
+    def test_join_with_index(self):
+        pidx.buildIndex(self.text_db, 16)
+        with pidx.PrefixIndex(self.text_db) as the_index:
+            self.check_join(the_index)
+
+    def test_join_spilled_runs(self):
+        pwned_hashes = [sha1Hex(word) for word in self.db_words[::3]]
+        safe_hashes  = [sha1Hex("safe" + str(i)) for i in range(2000)]
+        all_hashes = pwned_hashes + safe_hashes + pwned_hashes[::5]
+        run_files = pjoin.spillSortedRuns(all_hashes, 256, self.work_dir)
+        self.assertGreater(len(run_files), 1)
+        merged = list(pjoin.iterMergedRuns(run_files))
+        self.assertEqual(merged, sorted(set(the_hash.encode("ascii") for the_hash in all_hashes)))
+        found = set()
+        pjoin.joinSortedTargets(iter(merged), self.text_db, None, lambda target: found.add(target.decode("ascii")))
+        self.assertEqual(found, set(pwned_hashes))
+
+
+class TestParallelScan(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text_db = os.path.join(self.work_dir, "db.txt")
+        self.db_words = ["word" + str(i) for i in range(3000)]
+        writeTextDb(self.text_db, self.db_words, sort_it=False)
+
+    def test_ranges_cover_the_file_on_line_boundaries(self):
+        with open(self.text_db, "rb") as db_file:
+            content = db_file.read()
+        for number_of_ranges in [1, 2, 3, 7, 64]:
+            ranges = pparallel.splitFileInRanges(self.text_db, number_of_ranges)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(content))
+            for (_, end), (next_start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, next_start)
+                self.assertEqual(content[end - 1:end], b"\n")
+
+    def test_scan(self):
+        pwned_hashes = [sha1Hex(word) for word in self.db_words[::13]]
+        safe_hashes  = [sha1Hex(word) for word in SAFE_WORDS]
+        scanned_ranges = pmetrics.getRegistry().histogram("pwned_scan_range_seconds")
+        ranges_before = scanned_ranges.count()
+        found, lines = pparallel.scanDbParallel(pwned_hashes + safe_hashes, self.text_db, 3)
+        self.assertEqual(found, set(pwned_hashes))
+        self.assertEqual(lines, len(self.db_words))
+        #the metrics of the worker processes are merged in the registry of this one
+        self.assertEqual(scanned_ranges.count() - ranges_before, len(pparallel.splitFileInRanges(self.text_db, 3)))
+
+    def test_repeated_lines(self):
+        #the first hash twice at the top: the scan must not stop before reaching the second one
+        first, second = sha1Hex(self.db_words[0]), sha1Hex(self.db_words[-1])
+        with open(self.text_db, "rb") as db_file:
+            content = db_file.read()
+        with open(self.text_db, "wb") as db_file:
+            db_file.write(first.encode("ascii") + b":5\n" + content)
+        found, _ = pparallel.scanRange(self.text_db, 0, len(content) + 43, frozenset([first.encode("ascii"), second.encode("ascii")]))
+        self.assertEqual(found, {first.encode("ascii"), second.encode("ascii")})
+
+
+class TestZipBatch(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        import zipfile
+        self.text_db = os.path.join(self.work_dir, "db.txt")
+        self.zip_file = os.path.join(self.work_dir, "db.zip")
+        writeTextDb(self.text_db, PWNED_WORDS + ["word" + str(i) for i in range(1000)])
+        with zipfile.ZipFile(self.zip_file, "w", zipfile.ZIP_DEFLATED) as the_zip:
+            the_zip.write(self.text_db, "db.txt")
+        with open(self.text_db, encoding="utf-8") as db_file:
+            self.db_hashes = [the_line.split(":")[0] for the_line in db_file]
+
+    def make_records(self, the_hashes):
+        return [pwned.password_record("unknown", the_hash, "test", line) for line, the_hash in enumerate(the_hashes, start=1)]
+
+    def test_one_pass(self):
+        #repeated hashes are all flagged, each db line is read once for all of them
+        the_hashes = [sha1Hex(word) for word in PWNED_WORDS + SAFE_WORDS + PWNED_WORDS[:2]]
+        for zip_sorted in [False, True]:
+            records = self.make_records(the_hashes)
+            loc_stats = pstat.PwnedStats()
+            scanned_before = loc_stats.scanned_lines_in_db
+            self.assertTrue(pwned.isHashListPwnedLocalZip(records, "db.txt", self.zip_file, "", pwned.OM_HASH, zip_sorted))
+            self.assertEqual([record.ispwned for record in records], [True] * len(PWNED_WORDS) + [False] * len(SAFE_WORDS) + [True, True])
+            self.assertLessEqual(loc_stats.scanned_lines_in_db - scanned_before, len(self.db_hashes))
+
+    def test_sorted_zip_early_stop(self):
+        #nothing can be found after the biggest hash asked for: the rest of the sorted zip is not read
+        the_hashes = ["0" * 40, self.db_hashes[100]]
+        for zip_sorted, expected_lines in [(False, len(self.db_hashes)), (True, 102)]:
+            records = self.make_records(the_hashes)
+            loc_stats = pstat.PwnedStats()
+            scanned_before = loc_stats.scanned_lines_in_db
+            pwned.isHashListPwnedLocalZip(records, "db.txt", self.zip_file, "", pwned.OM_HASH, zip_sorted)
+            self.assertEqual([record.ispwned for record in records], [False, True])
+            self.assertEqual(loc_stats.scanned_lines_in_db - scanned_before, expected_lines)
+
+    def test_missing_member_raises(self):
+        with pwned.PwnedChecker(pwned.DB_LOCAL_ZIP, "missing.txt", self.zip_file) as checker:
+            with self.assertRaises(FileNotFoundError):
+                checker.check_records(self.make_records([sha1Hex(PWNED_WORDS[0])]))
+
+
+class FakeRangeHandler(http.server.BaseHTTPRequestHandler):
+    """ /range/XXXXX answers of a web api knowing only PWNED_WORDS """
+    requested_prefixes = []
+    throttle_next = 0   #number of next requests answered with 429
+
+    def do_GET(self):
+        prefix = self.path.rsplit("/", 1)[-1].upper()
+        FakeRangeHandler.requested_prefixes.append(prefix)
+        if FakeRangeHandler.throttle_next > 0:
+            FakeRangeHandler.throttle_next -= 1
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if len(prefix) != 5:
+            self.send_response(400)
+            self.end_headers()
+            return
+        body = "".join(sha1Hex(word)[5:] + ":" + str(count) + "\r\n"
+                       for count, word in enumerate(PWNED_WORDS, start=1) if sha1Hex(word).startswith(prefix))
+        body += "0000000000000000000000000000000000A:0\r\n"   #padding
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode("ascii"))
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRangeClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeRangeHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.base_url = "http://127.0.0.1:" + str(cls.server.server_address[1]) + "/range/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_parse_range_response(self):
+        suffixes = pweb.parseRangeResponse("0018A45C4D1DEF81644B54AB7F969B88D65:10\r\n00D4F6E8FA6EECAD2A3AA415EEC418D38EC:0\r\n")
+        self.assertEqual(suffixes, {"0018A45C4D1DEF81644B54AB7F969B88D65": 10})
+
+    def test_fetch_ranges_once_per_prefix(self):
+        FakeRangeHandler.requested_prefixes = []
+        the_hashes = [sha1Hex(word) for word in PWNED_WORDS + SAFE_WORDS] * 3
+        the_client = pweb.RangeClient(self.base_url, 4)
+        try:
+            results = the_client.fetch_ranges(pweb.splitHash(the_hash, 5)[0] for the_hash in the_hashes)
+        finally:
+            the_client.close()
+        self.assertEqual(len(FakeRangeHandler.requested_prefixes), len(set(FakeRangeHandler.requested_prefixes)))
+        for word in PWNED_WORDS:
+            prefix, suffix = pweb.splitHash(sha1Hex(word), 5)
+            self.assertIn(suffix, results[prefix].suffixes)
+        for word in SAFE_WORDS:
+            prefix, suffix = pweb.splitHash(sha1Hex(word), 5)
+            self.assertNotIn(suffix, results[prefix].suffixes)
+
+    def test_invalid_prefix(self):
+        the_client = pweb.RangeClient(self.base_url, 1)
+        try:
+            range_result = the_client.fetch_range("XYZ")
+        finally:
+            the_client.close()
+        self.assertFalse(range_result.is_valid())
+        self.assertEqual(range_result.status_code, 400)
+
+    def test_retry_when_throttled(self):
+        FakeRangeHandler.throttle_next = 2
+        the_client = pweb.RangeClient(self.base_url, 1, max_retries=3)
+        try:
+            range_result = the_client.fetch_range(sha1Hex("password")[:5])
+        finally:
+            the_client.close()
+        self.assertTrue(range_result.is_valid())
+        self.assertEqual(the_client.retries, 2)
+        self.assertEqual(the_client.limiter.throttled, 2)
+
+    def test_give_up_after_retries(self):
+        FakeRangeHandler.throttle_next = 2
+        the_client = pweb.RangeClient(self.base_url, 1, max_retries=1)
+        try:
+            range_result = the_client.fetch_range(sha1Hex("password")[:5])
+        finally:
+            the_client.close()
+            FakeRangeHandler.throttle_next = 0
+        self.assertFalse(range_result.is_valid())
+        self.assertEqual(range_result.status_code, 429)
+
+    def test_delay_slower_than_min_rate(self):
+        #-w 10: one request every 10 seconds, throttled or not. MIN_RATE must not shorten it
+        clock = [1000.0]
+        sleeps = []
+
+        def fake_sleep(secs):
+            sleeps.append(secs)
+            clock[0] += secs
+        with unittest.mock.patch.object(pratelimit.time, "monotonic", lambda: clock[0]), unittest.mock.patch.object(pratelimit.time, "sleep", fake_sleep):
+            the_client = pweb.RangeClient(self.base_url, 4, delay_secs=10)
+            the_client.close()
+            for _ in range(3):
+                the_client.limiter.acquire()
+            the_client.limiter.on_throttled()
+            the_client.limiter.acquire()
+        self.assertEqual(the_client.limiter.max_rate, 0.1)
+        self.assertEqual(sleeps, [10, 10, 10])
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_parse_retry_after(self):
+        self.assertEqual(pratelimit.parseRetryAfter("120"), 120)
+        self.assertIsNone(pratelimit.parseRetryAfter(None))
+        self.assertIsNone(pratelimit.parseRetryAfter("soon"))
+        self.assertEqual(pratelimit.parseRetryAfter("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+
+    def test_decrease_and_recover(self):
+        limiter = pratelimit.AdaptiveRateLimiter(10)
+        limiter.on_throttled()
+        self.assertEqual(limiter.rate, 5)
+        for _ in range(100):
+            limiter.on_success()
+        self.assertEqual(limiter.rate, 10)
+
+    def test_backoff_is_bounded(self):
+        for attempt in range(20):
+            self.assertLessEqual(pratelimit.computeBackoff(attempt), pratelimit.BACKOFF_MAX_SECS)
+
+
+class TestRangeCache(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_file = os.path.join(self.work_dir, "ranges.sqlite")
+
+    def test_hit_and_miss(self):
+        suffixes = {"0018A45C4D1DEF81644B54AB7F969B88D65": 10, "00D4F6E8FA6EECAD2A3AA415EEC418D38EC": 2}
+        with pcache.RangeCache(self.cache_file) as the_cache:
+            self.assertIsNone(the_cache.get("21BD1"))
+            the_cache.put("21BD1", suffixes)
+        with pcache.RangeCache(self.cache_file) as the_cache:   #persisted
+            self.assertEqual(the_cache.get("21BD1"), suffixes)
+            self.assertEqual((the_cache.hits, the_cache.misses), (1, 0))
+
+    def test_ttl(self):
+        with pcache.RangeCache(self.cache_file, ttl_hours=0) as the_cache:
+            the_cache.put("21BD1", {"0018A45C4D1DEF81644B54AB7F969B88D65": 10})
+            self.assertIsNone(the_cache.get("21BD1"))
+
+    def test_eviction(self):
+        suffixes = {sha1Hex(word)[5:]: 1 for word in PWNED_WORDS}
+        entry_size = len(pcache.packSuffixes(suffixes))
+        with pcache.RangeCache(self.cache_file, max_size_mb=(entry_size * 3.5) / (1024 * 1024)) as the_cache:
+            for prefix in ["00000", "00001", "00002"]:
+                the_cache.put(prefix, suffixes)
+            self.assertIsNotNone(the_cache.get("00000"))   #now 00001 is the least recently used
+            the_cache.put("00003", suffixes)
+            self.assertEqual(the_cache.evictions, 1)
+            self.assertIsNone(the_cache.get("00001"))
+            self.assertIsNotNone(the_cache.get("00000"))
+
+
+class TestResultWriter(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.rows = [("in.txt", i, "pwd" + str(i), sha1Hex("pwd" + str(i)), i % 3 == 0) for i in range(10000)]
+
+    def test_csv_same_as_before(self):
+        filename = os.path.join(self.work_dir, "out.csv")
+        with poutput.ResultWriter(filename) as the_writer:
+            for row in self.rows:
+                the_writer.write(*row)
+        with open(filename, encoding="utf-8") as out_file:
+            lines = out_file.readlines()
+        self.assertEqual(len(lines), len(self.rows))
+        self.assertEqual(lines[3], "in.txt, 3,pwd3, " + sha1Hex("pwd3") + ",True\n")
+
+    def test_jsonl_gzip_pwned_only(self):
+        filename = os.path.join(self.work_dir, "out.jsonl.gz")
+        with poutput.ResultWriter(filename, poutput.FORMAT_JSONL, pwned_only=True) as the_writer:
+            for row in self.rows:
+                the_writer.write(*row)
+        with gzip.open(filename, "rt", encoding="utf-8") as out_file:
+            records = [json.loads(the_line) for the_line in out_file]
+        self.assertEqual([the_record["line"] for the_record in records], [row[1] for row in self.rows if row[4]])
+        self.assertTrue(all(the_record["pwned"] for the_record in records))
+
+    def test_append(self):
+        filename = os.path.join(self.work_dir, "out.csv")
+        for _ in range(2):
+            with poutput.ResultWriter(filename, append=True, background=False) as the_writer:
+                the_writer.write(*self.rows[0])
+        with open(filename, encoding="utf-8") as out_file:
+            self.assertEqual(len(out_file.readlines()), 2)
+
+
+class TestPwnedChecker(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text_db = os.path.join(self.work_dir, "db.txt")
+        self.packed_db = os.path.join(self.work_dir, "db.bin")
+        writeTextDb(self.text_db, PWNED_WORDS + ["word" + str(i) for i in range(2000)])
+        pbindb.buildPackedDb(self.text_db, self.packed_db)
+
+    def tearDown(self):
+        pidx.closeIndexes()
+        super().tearDown()
+
+    def check_all(self, checker):
+        for word in PWNED_WORDS:
+            self.assertTrue(checker.is_password_pwned(word), word)
+        for word in SAFE_WORDS:
+            self.assertFalse(checker.is_password_pwned(word), word)
+        self.assertTrue(checker.is_hash_pwned(sha1Hex("word1999").lower()))
+
+    def test_local_modes(self):
+        for db_mode, db_file in [(pwned.DB_LOCAL, self.text_db), (pwned.DB_LOCAL_SORTED, self.text_db), (pwned.DB_LOCAL_PACKED, self.packed_db)]:
+            with pwned.PwnedChecker(db_mode, db_file) as checker:
+                self.check_all(checker)
+        pidx.buildIndex(self.text_db, 16)
+        with pwned.PwnedChecker(pwned.DB_LOCAL_SORTED, self.text_db) as checker:
+            self.check_all(checker)
+
+    def test_check_records(self):
+        records = [pwned.password_record(word, sha1Hex(word), "test", i) for i, word in enumerate(PWNED_WORDS + SAFE_WORDS)]
+        with pwned.PwnedChecker(pwned.DB_LOCAL_PACKED, self.packed_db) as checker:
+            checker.check_records(records)
+        self.assertEqual([the_record.ispwned for the_record in records], [True] * len(PWNED_WORDS) + [False] * len(SAFE_WORDS))
+
+    def test_duplicates_checked_once(self):
+        words = (PWNED_WORDS + SAFE_WORDS) * 3
+        loc_stats = pstat.PwnedStats()
+        for db_mode, db_file in [(pwned.DB_LOCAL, self.text_db), (pwned.DB_LOCAL_SORTED, self.text_db), (pwned.DB_LOCAL_PACKED, self.packed_db)]:
+            records = [pwned.password_record(word, sha1Hex(word), "test", i) for i, word in enumerate(words)]
+            read_before, pwned_before, unique_before = loc_stats.number_of_password_read, loc_stats.pwned_passwords_found, loc_stats.unique_passwords_checked
+            with pwned.PwnedChecker(db_mode, db_file) as checker:
+                checker.check_records(records)
+            self.assertEqual([the_record.ispwned for the_record in records], [word in PWNED_WORDS for word in words])
+            self.assertEqual(loc_stats.number_of_password_read - read_before, len(words))
+            self.assertEqual(loc_stats.pwned_passwords_found - pwned_before, 3 * len(PWNED_WORDS))
+            self.assertEqual(loc_stats.unique_passwords_checked - unique_before, len(PWNED_WORDS + SAFE_WORDS))
+
+    def test_concurrent_single_checks(self):
+        words = (PWNED_WORDS + SAFE_WORDS) * 20
+        loc_stats = pstat.PwnedStats()
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for db_mode, db_file in [(pwned.DB_LOCAL_SORTED, self.text_db), (pwned.DB_LOCAL_PACKED, self.packed_db)]:
+                with pwned.PwnedChecker(db_mode, db_file) as checker:
+                    scanned_before = loc_stats.scanned_lines_in_db
+                    for word in words:
+                        checker.is_password_pwned(word)
+                    scanned_once = loc_stats.scanned_lines_in_db - scanned_before
+                    self.assertGreater(scanned_once, 0)
+                    read_before, pwned_before, scanned_before = (loc_stats.number_of_password_read, loc_stats.pwned_passwords_found,
+                                                                 loc_stats.scanned_lines_in_db)
+                    errors = []
+
+                    def checkAll():
+                        for word in words:
+                            if checker.is_password_pwned(word) != (word in PWNED_WORDS):
+                                errors.append(word)
+                    threads = [threading.Thread(target=checkAll) for _ in range(8)]
+                    for the_thread in threads:
+                        the_thread.start()
+                    for the_thread in threads:
+                        the_thread.join()
+                self.assertEqual(errors, [])
+                self.assertEqual(loc_stats.number_of_password_read - read_before, 8 * len(words))
+                self.assertEqual(loc_stats.pwned_passwords_found - pwned_before, 8 * 20 * len(PWNED_WORDS))
+                self.assertEqual(loc_stats.scanned_lines_in_db - scanned_before, 8 * scanned_once)
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+    def test_web_client_settings(self):
+        try:
+            with pwned.PwnedChecker(pwned.DB_WEB, connections=2):
+                self.assertEqual(pwned.getRangeClient().max_connections, 2)
+            first_client = pwned.getRangeClient(3, 0, 7, 1)
+            self.assertIs(pwned.getRangeClient(3), first_client)
+            with pwned.PwnedChecker(pwned.DB_WEB, connections=5, delay_secs=2):
+                the_client = pwned.getRangeClient()
+                self.assertIsNot(the_client, first_client)
+                self.assertEqual(the_client.max_connections, 5)
+                self.assertEqual(the_client.max_retries, 1)
+                self.assertEqual(the_client.limiter.max_rate, 0.5)
+        finally:
+            pwned.closeRangeClient()
+
+    def test_missing_db(self):
+        with self.assertRaises(FileNotFoundError):
+            pwned.PwnedChecker(pwned.DB_LOCAL_SORTED, os.path.join(self.work_dir, "missing.txt"))
+
+    def test_import_is_cheap(self):
+        #-S: no site packages, so nothing else loads zipfile behind our back
+        code = "import sys, pwned; print(sorted(m for m in ('requests', 'zipfile') if m in sys.modules))"
+        output = subprocess.run([sys.executable, "-S", "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+
+class TestBloomFilter(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text_db = os.path.join(self.work_dir, "db.txt")
+        self.packed_db = os.path.join(self.work_dir, "db.bin")
+        self.many_words = ["word" + str(i) for i in range(3000)]
+        writeTextDb(self.text_db, PWNED_WORDS + self.many_words)
+        pbindb.buildPackedDb(self.text_db, self.packed_db)
+
+    def tearDown(self):
+        pfilter.closeFilters()
+        super().tearDown()
+
+    def check_filter(self, attached_file):
+        with pfilter.BloomFilter(attached_file) as the_filter:
+            for word in PWNED_WORDS + self.many_words:
+                self.assertTrue(the_filter.might_contain_hex(sha1Hex(word)), word)   #never a false negative
+            false_positives = sum(the_filter.might_contain_hex(sha1Hex("safe" + str(i))) for i in range(3000))
+            self.assertLess(false_positives, 90)   #1% requested, some slack
+            self.assertTrue(the_filter.might_contain_hex("not_an_hash"))
+
+    def test_text_and_packed(self):
+        for db_file in [self.text_db, self.packed_db]:
+            self.assertEqual(pfilter.buildFilter(db_file), db_file + pfilter.FILTER_SUFFIX)
+            self.check_filter(db_file)
+
+    def test_zip(self):
+        import zipfile
+        zip_file = os.path.join(self.work_dir, "db.zip")
+        with zipfile.ZipFile(zip_file, "w") as the_zip:
+            the_zip.write(self.text_db, "db.txt")
+        pfilter.buildFilter("db.txt", l_local_zip_file=zip_file)
+        self.check_filter(zip_file)
+
+    def test_stale_filter(self):
+        pfilter.buildFilter(self.text_db)
+        with open(self.text_db, "a", encoding="utf-8") as db_file:
+            db_file.write(sha1Hex("new") + ":1\n")
+        with self.assertRaises(pfilter.BloomFilterError):
+            pfilter.BloomFilter(self.text_db)
+
+    def test_checker_uses_filter(self):
+        pfilter.buildFilter(self.packed_db)
+        with pwned.PwnedChecker(pwned.DB_LOCAL_PACKED, self.packed_db) as checker:
+            for word in PWNED_WORDS:
+                self.assertTrue(checker.is_password_pwned(word), word)
+            for word in SAFE_WORDS:
+                self.assertFalse(checker.is_password_pwned(word), word)
+
+
+class TestHotTier(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text_db = os.path.join(self.work_dir, "db.txt")
+        self.packed_db = os.path.join(self.work_dir, "db.bin")
+        writeTextDb(self.text_db, PWNED_WORDS)   #the counts grow with the position: the last words are the most breached
+        pbindb.buildPackedDb(self.text_db, self.packed_db)
+        self.hot_words = PWNED_WORDS[-3:]
+
+    def tearDown(self):
+        phot.closeHotTiers()
+        super().tearDown()
+
+    def test_text_and_packed(self):
+        for db_file in [self.text_db, self.packed_db]:
+            self.assertEqual(phot.buildHotTier(db_file, 3), db_file + phot.HOT_SUFFIX)
+            the_tier = phot.HotTier(db_file)
+            self.assertEqual((len(the_tier), the_tier.min_count), (3, len(PWNED_WORDS) - 2))
+            for word in PWNED_WORDS:
+                self.assertEqual(the_tier.contains_hex(sha1Hex(word)), word in self.hot_words, word)
+            self.assertFalse(the_tier.contains_hex("not_an_hash"))
+            self.assertEqual((the_tier.hits, the_tier.misses), (3, len(PWNED_WORDS) - 2))
+
+    def test_stale_hot_tier(self):
+        phot.buildHotTier(self.text_db, 3)
+        writeTextDb(self.text_db, SAFE_WORDS)   #a different db: its hot tier must not be used
+        with self.assertRaises(phot.HotTierError):
+            phot.HotTier(self.text_db)
+        with pwned.PwnedChecker(pwned.DB_LOCAL_SORTED, self.text_db) as checker:
+            for word in self.hot_words:
+                self.assertFalse(checker.is_password_pwned(word), word)
+
+    def test_checks_use_hot_tier(self):
+        phot.buildHotTier(self.text_db, 3)
+        loc_stats = pstat.PwnedStats()
+        hits_before, misses_before = loc_stats.hot_tier_hits, loc_stats.hot_tier_misses
+        with pwned.PwnedChecker(pwned.DB_LOCAL_SORTED, self.text_db) as checker:
+            for word in PWNED_WORDS:
+                self.assertTrue(checker.is_password_pwned(word), word)
+            for word in SAFE_WORDS:
+                self.assertFalse(checker.is_password_pwned(word), word)
+            self.assertEqual(loc_stats.hot_tier_hits - hits_before, 3)
+            records = [pwned.password_record(word, sha1Hex(word), "test", line) for line, word in enumerate(PWNED_WORDS + SAFE_WORDS)]
+            checker.check_records(records)
+            self.assertEqual([record.ispwned for record in records], [True] * len(PWNED_WORDS) + [False] * len(SAFE_WORDS))
+        self.assertEqual(loc_stats.hot_tier_hits - hits_before, 6)
+        self.assertEqual(loc_stats.hot_tier_misses - misses_before, 2 * (len(PWNED_WORDS) + len(SAFE_WORDS) - 3))
+
+    def test_hash_input_over_two_chunks(self):
+        #-s input in lower case: the records carry no raw digest, the hot ones must still be flagged when the results are written
+        phot.buildHotTier(self.text_db, 3)
+        hash_file = os.path.join(self.work_dir, "hashes.txt")
+        out_file = os.path.join(self.work_dir, "out.txt")
+        words = SAFE_WORDS + PWNED_WORDS
+        with open(hash_file, "w", encoding="utf-8") as the_file:
+            the_file.write("".join((sha1Hex(word).lower() if word in self.hot_words else sha1Hex(word)) + "\n" for word in words))
+        loc_stats = pstat.PwnedStats()
+        hits_before = loc_stats.hot_tier_hits
+        pwned.checkPlainPasswordFile(hash_file, pwned.DB_LOCAL_SORTED, self.text_db, out_file, pwned.OM_HASH, l_chunk_size=4)
+        pwned.closeResultWriter()
+        with open(out_file, encoding="utf-8") as the_file:
+            flags = [the_line.strip().rsplit(",", 1)[1] for the_line in the_file]
+        self.assertEqual(flags, ["False"] * len(SAFE_WORDS) + ["True"] * len(PWNED_WORDS))
+        self.assertEqual(loc_stats.hot_tier_hits - hits_before, 3)   #counted once, in the first pass
+
+
+class TestRangeDirectory(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.range_dir = os.path.join(self.work_dir, "ranges")
+        os.mkdir(self.range_dir)
+        #the layout of the HIBP downloader: one XXXXX.txt file of SUFFIX:count lines per prefix
+        for count, word in enumerate(PWNED_WORDS, start=1):
+            with open(os.path.join(self.range_dir, sha1Hex(word)[:5] + ".txt"), "a", newline="", encoding="utf-8") as range_file:
+                range_file.write(sha1Hex(word)[5:] + ":" + str(count) + "\r\n")
+
+    def tearDown(self):
+        pranges.closeRangeDirectories()
+        super().tearDown()
+
+    def check_ranges(self, path):
+        with pwned.PwnedChecker(pwned.DB_LOCAL_RANGES, path) as checker:
+            for word in PWNED_WORDS:
+                self.assertTrue(checker.is_password_pwned(word), word)
+            for word in SAFE_WORDS:
+                self.assertFalse(checker.is_password_pwned(word), word)
+            records = [pwned.password_record(word, sha1Hex(word), "test", line) for line, word in enumerate(PWNED_WORDS + SAFE_WORDS)]
+            checker.check_records(records)
+            self.assertEqual([record.ispwned for record in records], [True] * len(PWNED_WORDS) + [False] * len(SAFE_WORDS))
+            the_directory = pranges.getRangeDirectoryFor(path)
+            self.assertEqual(the_directory.missing_files, 2 * len(SAFE_WORDS))   #no range file for them: empty ranges
+            self.assertEqual(the_directory.files_read, 2 * len(PWNED_WORDS))
+
+    def test_directory(self):
+        self.check_ranges(self.range_dir)
+
+    def test_zip(self):
+        import zipfile
+        zip_file = os.path.join(self.work_dir, "ranges.zip")
+        with zipfile.ZipFile(zip_file, "w") as the_zip:
+            for name in os.listdir(self.range_dir):
+                the_zip.write(os.path.join(self.range_dir, name), "ranges/" + name)
+        self.check_ranges(zip_file)
+
+    def test_not_a_range_directory(self):
+        with self.assertRaises(pranges.RangeDirectoryError):
+            pranges.RangeDirectory(self.work_dir)
+        self.assertEqual(pranges.rangePrefixOf("ranges/0a1b2.txt"), "0A1B2")
+        self.assertIsNone(pranges.rangePrefixOf("ranges/0a1b2x.txt"))
+
+
+class TestRangeServer(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text_db = os.path.join(self.work_dir, "db.txt")
+        self.packed_db = os.path.join(self.work_dir, "db.bin")
+        self.many_words = ["word" + str(i) for i in range(3000)]
+        writeTextDb(self.text_db, PWNED_WORDS + self.many_words)
+        pbindb.buildPackedDb(self.text_db, self.packed_db)
+
+    def tearDown(self):
+        pwned.closeRangeClient()
+        pwned.BASE_PWD_SEARCH_URL = "https://api.pwnedpasswords.com/range/"
+        super().tearDown()
+
+    def test_readers_agree(self):
+        with open(self.text_db, encoding="utf-8") as db_file:
+            db_lines = db_file.read().splitlines()
+        prefixes = sorted({sha1Hex(word)[:5] for word in PWNED_WORDS + SAFE_WORDS + self.many_words[:50]} | {"00000", "FFFFF"})
+        expected = {prefix: [the_line[5:].encode("ascii") for the_line in db_lines if the_line.startswith(prefix)] for prefix in prefixes}
+        readers = [prangeserve.SortedDbRanges(self.text_db), prangeserve.PackedDbRanges(self.packed_db)]
+        indexes = [pidx.PrefixIndex(self.text_db, pidx.buildIndex(self.text_db, prefix_bits, self.text_db + "." + str(prefix_bits)))
+                   for prefix_bits in [16, 20]]
+        readers += [prangeserve.SortedDbRanges(self.text_db, the_index) for the_index in indexes]
+        for reader in readers:
+            for prefix in prefixes:
+                self.assertEqual(reader.range_lines(prefix), expected[prefix], prefix)
+            reader.close()
+        for the_index in indexes:
+            the_index.close()
+        self.assertFalse(prangeserve.isValidPrefix("0A1B"))
+        self.assertFalse(prangeserve.isValidPrefix("0A1BX"))
+
+    def test_web_mode_against_mirror(self):
+        server = prangeserve.makeRangeServer("http://127.0.0.1:0", prangeserve.RangeService(prangeserve.PackedDbRanges(self.packed_db)))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            pwned.setRangeApiUrl(prangeserve.rangeUrlOf(server).replace("/range/", ""))
+            self.assertEqual(pwned.BASE_PWD_SEARCH_URL, prangeserve.rangeUrlOf(server))
+            with pwned.PwnedChecker(pwned.DB_WEB) as checker:
+                for word in PWNED_WORDS:
+                    self.assertTrue(checker.is_password_pwned(word), word)
+                for word in SAFE_WORDS:
+                    self.assertFalse(checker.is_password_pwned(word), word)
+            with self.assertRaises(urllib.error.HTTPError) as raised:
+                urllib.request.urlopen(prangeserve.rangeUrlOf(server) + "0A1BX")
+            self.assertEqual(raised.exception.code, 400)
+            with urllib.request.urlopen(prangeserve.rangeUrlOf(server).replace("/range/", "/stats")) as response:
+                the_stats = json.load(response)
+            self.assertEqual(the_stats["requests"], len(PWNED_WORDS) + len(SAFE_WORDS))
+            self.assertGreaterEqual(the_stats["hashes_served"], len(PWNED_WORDS))
+        finally:
+            server.shutdown()
+            server.server_close()
+            server.service.ranges.close()
+        self.assertEqual(pweb.normalizeApiUrl("http://10.0.0.2:8080/mirror/range"), "http://10.0.0.2:8080/mirror/range/")
+        with self.assertRaises(ValueError):
+            pweb.normalizeApiUrl("10.0.0.2:8080")
+
+
+class TestSortDb(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.raw_db = os.path.join(self.work_dir, "raw.txt")
+        self.words = PWNED_WORDS + ["word" + str(i) for i in range(3000)]
+        #unsorted, CRLF, repeated hashes (counts summed), a lower case hash and lines to skip
+        lines = [sha1Hex(word) + ":" + str(count) for count, word in enumerate(self.words, start=1)]
+        lines += [sha1Hex(word) + ":1000" for word in self.words[::7]]
+        lines.reverse()
+        lines[10] = lines[10].lower()
+        lines += ["", "not a hash:3"]
+        with open(self.raw_db, "w", encoding="utf-8", newline="") as db_file:
+            db_file.write("\r\n".join(lines) + "\r\n")
+        counts = {sha1Hex(word): count for count, word in enumerate(self.words, start=1)}
+        for word in self.words[::7]:
+            counts[sha1Hex(word)] += 1000
+        self.expected = "".join(the_hash + ":" + str(counts[the_hash]) + "\r\n" for the_hash in sorted(counts))
+
+    def tearDown(self):
+        psort.MAX_OPEN_RUNS = 128
+        pidx.closeIndexes()
+        super().tearDown()
+
+    def check_sorted(self, sorted_db, summary):
+        with open(sorted_db, encoding="utf-8", newline="") as db_file:
+            self.assertEqual(db_file.read(), self.expected)
+        self.assertEqual(summary.hashes_written, len(self.words))
+        self.assertEqual(summary.duplicates_merged, len(self.words[::7]))
+        self.assertEqual(summary.invalid_lines, 1)
+        self.assertFalse(summary.input_sorted)
+
+    def test_sort_in_runs(self):
+        psort.MAX_OPEN_RUNS = 3   #more than one merge pass
+        for workers in [1, 2]:
+            sorted_db = os.path.join(self.work_dir, "sorted" + str(workers) + ".txt")
+            summary = psort.sortDb(self.raw_db, sorted_db, "", workers, 0.01, 20)
+            self.assertGreater(summary.runs, 5)
+            self.assertGreater(summary.merge_passes, 1)
+            self.check_sorted(sorted_db, summary)
+            with open(summary.index_filename, "rb") as index_file:
+                sort_index = index_file.read()
+            with open(pidx.buildIndex(sorted_db, 20, sorted_db + ".rebuilt"), "rb") as index_file:
+                self.assertEqual(sort_index, index_file.read())
+            with pwned.PwnedChecker(pwned.DB_LOCAL_SORTED, sorted_db) as checker:
+                for word in PWNED_WORDS:
+                    self.assertTrue(checker.is_password_pwned(word), word)
+                for word in SAFE_WORDS:
+                    self.assertFalse(checker.is_password_pwned(word), word)
+        self.assertEqual([name for name in os.listdir(self.work_dir) if name.startswith("pwned_sort_") or name.endswith(".tmp")], [])
+
+    def test_zip_and_in_place(self):
+        import zipfile
+        zip_file = os.path.join(self.work_dir, "raw.zip")
+        with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_DEFLATED) as the_zip:
+            the_zip.write(self.raw_db, "raw.txt")
+        sorted_db = os.path.join(self.work_dir, "sorted.txt")
+        self.check_sorted(sorted_db, psort.sortDb("raw.txt", sorted_db, zip_file))
+        summary = psort.sortDb(sorted_db, sorted_db)
+        self.assertTrue(summary.input_sorted)
+        self.assertEqual(summary.duplicates_merged, 0)
+        with open(sorted_db, encoding="utf-8", newline="") as db_file:
+            self.assertEqual(db_file.read(), self.expected)
+
+
+
+class TestBlockDb(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text_db = os.path.join(self.work_dir, "db.txt")
+        self.packed_db = os.path.join(self.work_dir, "db.bin")
+        self.block_db = os.path.join(self.work_dir, "db.blk")
+        self.words = PWNED_WORDS + ["word" + str(i) for i in range(2000)]
+
+    def test_same_records_as_packed(self):
+        writeTextDb(self.text_db, self.words)
+        pbindb.buildPackedDb(self.text_db, self.packed_db)
+        self.assertEqual(pblockdb.buildBlockDb(self.text_db, self.block_db, records_per_block=64), len(self.words))
+        self.assertLess(os.path.getsize(self.block_db), os.path.getsize(self.text_db) * 0.6)
+        with pbindb.PackedHashDB(self.packed_db) as packed_db, pblockdb.BlockHashDB(self.block_db) as block_db:
+            self.assertEqual(len(block_db), len(packed_db))
+            self.assertEqual(block_db.number_of_blocks, (len(self.words) + 63) // 64)
+            self.assertEqual(list(block_db.iter_records()), [(packed_db.digest_at(i), packed_db.count_at(i)) for i in range(len(packed_db))])
+            for index in range(0, len(packed_db), 37):
+                digest = packed_db.digest_at(index)
+                self.assertEqual(block_db.find(digest), index)
+                self.assertEqual(block_db.get_count(digest), packed_db.get_count(digest))
+                self.assertEqual(block_db.lower_bound(digest[:3] + bytes(17)), packed_db.lower_bound(digest[:3] + bytes(17)))
+            for word in SAFE_WORDS:
+                self.assertFalse(block_db.lookup_hex(sha1Hex(word)), word)
+            self.assertEqual(block_db.find(bytes(20)), -1)
+            self.assertEqual(block_db.find(b"\xff" * 20), -1)
+            self.assertFalse(block_db.lookup_hex("not_an_hash"))
+            self.assertEqual(block_db.get_count(bytes.fromhex(sha1Hex("qwerty"))), 3)
+        with pwned.PwnedChecker(pwned.DB_LOCAL_BLOCKS, self.block_db) as checker:
+            for word in PWNED_WORDS:
+                self.assertTrue(checker.is_password_pwned(word), word)
+            for word in SAFE_WORDS:
+                self.assertFalse(checker.is_password_pwned(word), word)
+
+    def test_unsorted_zipped_input(self):
+        import zipfile
+        writeTextDb(self.text_db, self.words + self.words[:50], sort_it=False)   #repeated hashes are merged
+        zip_file = os.path.join(self.work_dir, "db.zip")
+        with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_DEFLATED) as the_zip:
+            the_zip.write(self.text_db, "db.txt")
+        self.assertEqual(pblockdb.buildBlockDb("db.txt", self.block_db, zip_file, records_per_block=100), len(self.words))
+        with pblockdb.BlockHashDB(self.block_db) as block_db:
+            for word in PWNED_WORDS:
+                self.assertTrue(block_db.lookup_hex(sha1Hex(word)), word)
+            self.assertEqual(block_db.get_count(bytes.fromhex(sha1Hex("qwerty"))), 3 + len(self.words) + 3)
+        self.assertEqual(sorted(os.listdir(self.work_dir)), ["db.blk", "db.txt", "db.zip"])
+
+    def test_filter_and_hot_tier_of_a_block_db(self):
+        writeTextDb(self.text_db, self.words)
+        pblockdb.buildBlockDb(self.text_db, self.block_db, records_per_block=64)
+        with pfilter.BloomFilter(self.block_db, pfilter.buildFilter(self.block_db)) as the_filter:
+            self.assertEqual(the_filter.count, len(self.words))
+            for word in PWNED_WORDS:
+                self.assertTrue(the_filter.might_contain(bytes.fromhex(sha1Hex(word))), word)
+        the_tier = phot.HotTier(self.block_db, phot.buildHotTier(self.block_db, 3))
+        self.assertEqual(len(the_tier), 3)
+        self.assertIn(bytes.fromhex(sha1Hex(self.words[-1])), the_tier)
+        try:
+            with pwned.PwnedChecker(pwned.DB_LOCAL_BLOCKS, self.block_db) as checker:
+                for word in PWNED_WORDS:
+                    self.assertTrue(checker.is_password_pwned(word), word)
+        finally:
+            pfilter.closeFilters()
+            phot.closeHotTiers()
+
+    def test_unsorted_input_error(self):
+        digests = sorted(bytes.fromhex(sha1Hex(word)) for word in PWNED_WORDS)
+        with self.assertRaises(pblockdb.InputNotSortedError):
+            pblockdb.writeBlockDb(self.block_db, [(digest, 1) for digest in reversed(digests)], 4, pblockdb.BLOCK_DEFAULT_LEVEL)
+
+    def test_not_a_block_db(self):
+        writeTextDb(self.text_db, PWNED_WORDS)
+        pbindb.buildPackedDb(self.text_db, self.packed_db)
+        for filename in [self.text_db, self.packed_db]:
+            with self.assertRaises(pblockdb.BlockDBError):
+                pblockdb.BlockHashDB(filename)
+
+
+class TestBatchHashing(WorkDirTestCase):
+    def test_batches_in_order(self):
+        words = ["word" + str(i) for i in range(5000)] + ["àèìòù", "KjW@i2348.@@DICIOTTO"]
+        batches = [words[i:i + 700] for i in range(0, len(words), 700)]
+        for workers in [1, 2]:
+            hashed = list(phash.iterHashedBatches(iter(batches), workers))
+            self.assertEqual([the_batch for the_batch, _ in hashed], batches)
+            digests = [digest for _, the_digests in hashed for digest in phash.splitDigests(the_digests)]
+            self.assertEqual([phash.hexDigest(digest) for digest in digests], [sha1Hex(word) for word in words])
+
+    def test_records_from_file(self):
+        password_file = os.path.join(self.work_dir, "passwords.txt")
+        with open(password_file, "w", encoding="utf-8") as the_file:
+            the_file.write("\n".join(PWNED_WORDS[:3] + [""] + SAFE_WORDS) + "\n")
+        records = pwned.readTextPasswordFromTextFile(password_file, pwned.OM_PLAIN, 2)
+        self.assertEqual([the_record.src_password for the_record in records], PWNED_WORDS[:3] + SAFE_WORDS)
+        self.assertEqual([the_record.found_linenumber for the_record in records], [1, 2, 3, 5, 6, 7])
+        self.assertEqual([the_record.src_hash for the_record in records], [sha1Hex(word) for word in PWNED_WORDS[:3] + SAFE_WORDS])
+
+
+class TestRecordStore(WorkDirTestCase):
+    def make_store(self, words, keep_passwords=True):
+        the_store = precords.RecordStore("input.txt", keep_passwords)
+        the_store.extend_digests(words if keep_passwords else None, range(1, len(words) + 1), phash.sha1Digests(words))
+        return the_store
+
+    def test_views(self):
+        the_store = self.make_store(PWNED_WORDS)
+        the_store.append("odd", 99, src_hash="not_an_hash")
+        self.assertEqual(len(the_store), len(PWNED_WORDS) + 1)
+        self.assertEqual([the_record.src_hash for the_record in the_store], [sha1Hex(word) for word in PWNED_WORDS] + ["not_an_hash"])
+        self.assertIsNone(the_store[-1].src_digest)
+        the_store[2].ispwned = True
+        the_store[-1].ispwned = True
+        the_store[-1].ispwned = False
+        self.assertEqual([the_record.ispwned for the_record in the_store], [False, False, True] + [False] * (len(PWNED_WORDS) - 2))
+        self.assertEqual((the_store[2].src_password, the_store[2].found_linenumber, the_store[2].found_filename), (PWNED_WORDS[2], 3, "input.txt"))
+        with self.assertRaises(AttributeError):
+            the_store[0].some_attribute = 1   #__slots__
+        self.assertEqual(self.make_store(SAFE_WORDS, False)[0].src_password, precords.PASSWORD_NOT_KEPT)
+
+    def test_chunks_and_select(self):
+        words = ["word" + str(i) for i in range(100)]
+        batches = [self.make_store(words[i:i + 30]) for i in range(0, len(words), 30)]
+        batches[1][0].ispwned = True
+        chunks = list(precords.iterStoreChunks(batches, 40))
+        self.assertEqual([len(the_chunk) for the_chunk in chunks], [40, 40, 20])
+        self.assertEqual([the_record.src_password for the_chunk in chunks for the_record in the_chunk], words)
+        self.assertTrue(chunks[0][30].ispwned)
+        self.assertEqual(chunks[0].pwned_count(), 1)
+        selected = chunks[0].select([30, 0])
+        self.assertEqual([(the_record.src_password, the_record.ispwned) for the_record in selected], [("word30", True), ("word0", False)])
+
+    def test_odd_hashes_across_chunks(self):
+        the_store = self.make_store(["word" + str(i) for i in range(5)], False)
+        the_store.append(precords.PASSWORD_NOT_KEPT, 6, src_hash="odd6")
+        the_store.append(precords.PASSWORD_NOT_KEPT, 7, src_hash="odd7")
+        the_store[6].ispwned = True
+        chunks = list(precords.iterStoreChunks([the_store], 4))
+        self.assertEqual([the_record.src_hash for the_chunk in chunks for the_record in the_chunk], [the_record.src_hash for the_record in the_store])
+        self.assertEqual([(the_record.found_linenumber, the_record.ispwned) for the_record in chunks[1]], [(5, False), (6, False), (7, True)])
+        self.assertEqual([the_record.src_hash for the_record in chunks[1].select([2, 0])], ["odd7", sha1Hex("word4")])
+
+    def test_engines_on_a_store(self):
+        text_db = os.path.join(self.work_dir, "db.txt")
+        packed_db = os.path.join(self.work_dir, "db.bin")
+        writeTextDb(text_db, PWNED_WORDS)
+        pbindb.buildPackedDb(text_db, packed_db)
+        expected = [True] * len(PWNED_WORDS) + [False] * len(SAFE_WORDS)
+        for engine, db_file in [(pwned.isHashListPwnedLocal, text_db), (pwned.isHashListPwnedLocalBinary, text_db), (pwned.isHashListPwnedLocalPacked, packed_db)]:
+            the_store = self.make_store(PWNED_WORDS + SAFE_WORDS, False)
+            engine(the_store, db_file, "", pwned.OM_PLAIN)
+            self.assertEqual([the_record.ispwned for the_record in the_store], expected, engine.__name__)
+
+
+class TestBench(WorkDirTestCase):
+    def test_generated_files(self):
+        files = pbench.BenchFiles(self.work_dir, 500, 200, 0.5, 3)
+        prepared = pbench.prepareFiles(files, 500, 200, 0.5, 3)
+        with open(files.unsorted_db, encoding="utf-8") as db_file:
+            unsorted_lines = db_file.read().splitlines()
+        with open(files.sorted_db, encoding="utf-8") as db_file:
+            sorted_lines = db_file.read().splitlines()
+        self.assertEqual(len(unsorted_lines), 500)
+        self.assertEqual(sorted_lines, sorted(unsorted_lines))
+        self.assertIn(pbench.benchHash(pbench.benchPassword(3, 499)), unsorted_lines[499])
+        with open(files.input_file, encoding="utf-8") as input_file:
+            passwords = input_file.read().splitlines()
+        self.assertEqual(len(passwords), 200)
+        self.assertEqual(sum(the_password.startswith("bench") for the_password in passwords), prepared["expected_hits"])
+        self.assertTrue(50 < prepared["expected_hits"] < 150)
+
+        with pbench.mockRangeServer(files.packed_db) as base_url:
+            client = pweb.RangeClient(base_url, 2)
+            the_hash = pbench.benchHash(pbench.benchPassword(3, 7))
+            range_result = client.fetch_range(the_hash[:5])
+            client.close()
+        self.assertTrue(range_result.is_valid())
+        self.assertIn(the_hash[5:], range_result.suffixes)
+
+    def test_compare(self):
+        old_results = {"cases": [{"name": "batch/local", "throughput_per_sec": 100.0}, {"name": "batch/sorted", "throughput_per_sec": 100.0}]}
+        new_results = {"cases": [{"name": "batch/local", "throughput_per_sec": 85.0}, {"name": "batch/sorted", "throughput_per_sec": 95.0},
+                                 {"name": "batch/web", "throughput_per_sec": 10.0}]}
+        comparison = pbench.compareResults(old_results, new_results)
+        self.assertEqual([(name, regression) for name, _, _, _, regression in comparison], [("batch/local", True), ("batch/sorted", False)])
+
+
+class TestMetrics(WorkDirTestCase):
+    def test_threads_and_snapshot(self):
+        registry = pmetrics.MetricsRegistry()
+        the_counter = registry.counter("test_total", "test")
+        the_histogram = registry.histogram("test_seconds", "test", (1, 10))
+
+        def work():
+            for i in range(1000):
+                the_counter.inc(labels={"kind": "a"})
+                the_histogram.observe(i % 20)
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for the_thread in threads:
+            the_thread.start()
+        for the_thread in threads:
+            the_thread.join()
+        self.assertEqual(the_counter.value({"kind": "a"}), 4000)
+        self.assertEqual(the_histogram.count(), 4000)
+        self.assertEqual(the_histogram.total(), 4 * 50 * sum(range(20)))
+
+        other = pmetrics.MetricsRegistry()
+        other.histogram("test_seconds", "test", (1, 10)).observe_counts({0: 2, 15: 1})
+        other.merge(registry.snapshot())
+        merged = other.to_dict()["histograms"]["test_seconds"][0]
+        self.assertEqual(merged["count"], 4003)
+        self.assertEqual(merged["buckets"], {"1": 402, "10": 2202, "+Inf": 4003})
+        with self.assertRaises(ValueError):
+            other.histogram("test_seconds").add_series([1, 2], 3.0, 3)
+
+    def test_prometheus_and_json(self):
+        registry = pmetrics.MetricsRegistry()
+        registry.counter("test_total", "Things").inc(3)
+        registry.gauge("test_ratio", "Ratio").set(0.5)
+        with registry.stage(pmetrics.STAGE_LOOKUP):
+            pass
+        text = registry.to_prometheus()
+        self.assertIn("# TYPE test_total counter\ntest_total 3\n", text)
+        self.assertIn("# TYPE test_ratio gauge\ntest_ratio 0.5\n", text)
+        self.assertIn('pwned_stage_seconds_bucket{stage="lookup",le="+Inf"} 1\n', text)
+        self.assertIn('pwned_stage_seconds_count{stage="lookup"} 1\n', text)
+        self.assertEqual(pmetrics.formatFromFilename("run.prom"), pmetrics.FORMAT_PROMETHEUS)
+        metrics_file = os.path.join(self.work_dir, "metrics.json")
+        registry.write(metrics_file)
+        with open(metrics_file, encoding="utf-8") as the_file:
+            self.assertEqual(json.load(the_file)["counters"]["test_total"], [{"labels": {}, "value": 3}])
+
+    def test_stats_not_reset_by_single_lookups(self):
+        text_db = os.path.join(self.work_dir, "db.txt")
+        writeTextDb(text_db, PWNED_WORDS)
+        loc_stats = pstat.PwnedStats()
+        read_before, scanned_before = loc_stats.number_of_password_read, loc_stats.scanned_lines_in_db
+        for word in PWNED_WORDS:
+            self.assertTrue(pwned.isHashPwnedLocalBinary(sha1Hex(word), text_db))
+            self.assertTrue(pwned.isHashPwnedLocal(sha1Hex(word), text_db))
+        self.assertEqual(loc_stats.number_of_password_read - read_before, 2 * len(PWNED_WORDS))
+        self.assertGreater(loc_stats.scanned_lines_in_db - scanned_before, 2 * len(PWNED_WORDS))
+
+
+class TestUpdate(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text_db = os.path.join(self.work_dir, "db.txt")
+        self.delta = os.path.join(self.work_dir, "delta.txt")
+        #old db: PWNED_WORDS, delta: the first two with new counts, the third unchanged and SAFE_WORDS added
+        writeTextDb(self.text_db, PWNED_WORDS)
+        self.expected = {sha1Hex(word): count for count, word in enumerate(PWNED_WORDS, start=1)}
+        delta = {sha1Hex(PWNED_WORDS[0]): 100, sha1Hex(PWNED_WORDS[1]): 200, sha1Hex(PWNED_WORDS[2]): 3}
+        delta.update({sha1Hex(word): 5 for word in SAFE_WORDS})
+        with open(self.delta, "w", encoding="utf-8", newline="\n") as delta_file:
+            delta_file.write("".join(the_hash + ":" + str(count) + "\n" for the_hash, count in delta.items()))
+        self.expected.update(delta)
+
+    def tearDown(self):
+        pidx.closeIndexes()
+        pfilter.closeFilters()
+        super().tearDown()
+
+    def expected_content(self):
+        return "".join(the_hash + ":" + str(count) + "\n" for the_hash, count in sorted(self.expected.items()))
+
+    def test_merge(self):
+        out_db = os.path.join(self.work_dir, "out.txt")
+        with self.assertRaises(pupdate.DeltaNotSortedError):
+            list(pupdate.iterDeltaRecords(self.delta))
+        summary = pupdate.mergeDelta(self.text_db, pupdate.sortedDeltaRecords(self.delta), out_db)
+        self.assertEqual((summary.added, summary.updated, summary.unchanged), (len(SAFE_WORDS), 2, 1))
+        with open(out_db, encoding="utf-8", newline="") as the_file:
+            self.assertEqual(the_file.read(), self.expected_content())
+        self.assertEqual(sum(summary.bytes_by_prefix), os.path.getsize(out_db) - os.path.getsize(self.text_db))
+        changelog = pupdate.appendChangelog(out_db, self.delta, summary)
+        with open(changelog, encoding="utf-8") as the_file:
+            lines = the_file.read().splitlines()
+        self.assertTrue(lines[0].endswith("delta.txt: 3 added, 2 updated"))
+        self.assertIn(sha1Hex(SAFE_WORDS[0])[:5] + ":1:0", lines)
+        self.assertEqual(len(lines), 1 + len(set(sha1Hex(word)[:5] for word in SAFE_WORDS + PWNED_WORDS[:2])))
+
+    def test_no_final_end_of_line(self):
+        with open(self.text_db, "rb+") as the_file:
+            the_file.truncate(os.path.getsize(self.text_db) - 1)
+        out_db = os.path.join(self.work_dir, "out.txt")
+        pupdate.mergeDelta(self.text_db, [(b"F" * 40, 1)], out_db)
+        with open(out_db, encoding="utf-8", newline="") as the_file:
+            self.assertTrue(the_file.read().endswith("\n" + "F" * 40 + ":1\n"))
+
+    def test_update_sidecars(self):
+        for prefix_bits in pidx.INDEX_ALLOWED_BITS:
+            writeTextDb(self.text_db, PWNED_WORDS)
+            pidx.buildIndex(self.text_db, prefix_bits)
+            pfilter.buildFilter(self.text_db)
+            phot.buildHotTier(self.text_db, 3)
+            pwned.updateSortedDb(self.text_db, self.delta)
+            with open(self.text_db, encoding="utf-8", newline="") as the_file:
+                self.assertEqual(the_file.read(), self.expected_content())
+            #the patched index is the one a full rebuild gives
+            with open(pidx.indexFilenameFor(self.text_db), "rb") as the_file:
+                patched_index = the_file.read()
+            rebuilt = pidx.buildIndex(self.text_db, prefix_bits, os.path.join(self.work_dir, "rebuilt.idx"))
+            with open(rebuilt, "rb") as the_file:
+                self.assertEqual(patched_index, the_file.read())
+            with pfilter.BloomFilter(self.text_db) as the_filter:
+                self.assertEqual(the_filter.count, len(PWNED_WORDS) + len(SAFE_WORDS))
+                for word in PWNED_WORDS + SAFE_WORDS:
+                    self.assertTrue(the_filter.might_contain_hex(sha1Hex(word)), word)
+            with pidx.PrefixIndex(self.text_db) as the_index:
+                for word in PWNED_WORDS + SAFE_WORDS:
+                    self.assertTrue(the_index.lookup(sha1Hex(word)), word)
+            self.assertEqual(len(phot.HotTier(self.text_db)), 3)   #still valid for the updated db
+            pidx.closeIndexes()
+            os.remove(pupdate.changelogFilenameFor(self.text_db))
+
+    def test_filter_count_with_unsorted_delta(self):
+        #sorted new hashes then one out of order: the first pass adds them all to the filter before failing
+        new_hashes = sorted(sha1Hex("new" + str(i)) for i in range(50))
+        with open(self.delta, "w", encoding="utf-8", newline="\n") as delta_file:
+            delta_file.write("".join(the_hash + ":1\n" for the_hash in new_hashes[1:] + new_hashes[:1]))
+        pfilter.buildFilter(self.text_db)
+        pwned.updateSortedDb(self.text_db, self.delta)
+        with pfilter.BloomFilter(self.text_db) as the_filter:
+            self.assertEqual(the_filter.count, len(PWNED_WORDS) + len(new_hashes))
+
+
+class TestServe(WorkDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pwned_hashes = set(sha1Hex(word) for word in PWNED_WORDS)
+        self.service = pserve.LookupService(lambda the_hash: the_hash in self.pwned_hashes)
+
+    def check_address(self, address):
+        server = pserve.makeServer(address, self.service)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            with pserve.LookupClient(address) as client:
+                for word in PWNED_WORDS:
+                    self.assertTrue(client.is_password_pwned(word), word)
+                for word in SAFE_WORDS:
+                    self.assertFalse(client.is_password_pwned(word), word)
+                results = client.check_hashes([sha1Hex(word).lower() for word in PWNED_WORDS + SAFE_WORDS])
+                self.assertEqual(sum(results.values()), len(PWNED_WORDS))
+                with self.assertRaises(pserve.ServeError):
+                    client.check_hashes(["not_an_hash"])
+                the_stats = client.stats()
+                self.assertEqual(the_stats["requests"], len(PWNED_WORDS) + len(SAFE_WORDS) + 1)
+                self.assertGreaterEqual(the_stats["p99_ms"], the_stats["p50_ms"])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    @unittest.skipUnless(hasattr(socketserver, "UnixStreamServer"), "no unix sockets")
+    def test_unix_socket(self):
+        self.check_address("unix:" + os.path.join(self.work_dir, "pwned.sock"))
+
+    def test_http(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        self.check_address("http://127.0.0.1:" + str(port))
+
+    def test_bad_address(self):
+        with self.assertRaises(pserve.ServeError):
+            pserve.parseAddress("localhost:8080")
+
+
+if __name__ == '__main__':
+    unittest.main()